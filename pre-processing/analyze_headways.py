@@ -1,125 +1,106 @@
-import pandas as pd
-import zipfile
+import argparse
+import json
 import os
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import urlopen
 
-# Path to GTFS zip file
-GTFS_ZIP_PATH = os.path.join('..', 'GTFS-2025-10-28.zip')
+from gtfs_loader import GTFS_ZIP_PATH
+from query_service import DEFAULT_HOST, DEFAULT_PORT, FeedIndex
 
-print("Loading GTFS data from zip file...")
-with zipfile.ZipFile(GTFS_ZIP_PATH) as z:
-    with z.open('routes.txt') as f:
-        routes = pd.read_csv(f)
-    with z.open('trips.txt') as f:
-        trips = pd.read_csv(f)
-    with z.open('stop_times.txt') as f:
-        stop_times = pd.read_csv(f)
-    with z.open('calendar.txt') as f:
-        calendar = pd.read_csv(f)
+def make_query(url):
+    """query(path, **params) -> (status, decoded JSON), against the service at `url` or a local FeedIndex."""
+    if url:
+        def query(path, **params):
+            try:
+                with urlopen(f"{url.rstrip('/')}{path}?{urlencode(params)}") as response:
+                    return response.status, json.load(response)
+            except HTTPError as e:
+                return e.code, json.load(e)
+        return query
 
-# Filter for route 539
-route_539 = routes[routes['route_short_name'] == '539']
-print("Route 539 variants:")
-print(route_539[['route_id', 'route_short_name', 'route_long_name']])
-print()
+    index = FeedIndex.load(GTFS_ZIP_PATH)
+    if index is None:
+        return None
 
-# Get trips for route 539
-trips_539 = trips[trips['route_id'].isin(route_539['route_id'])]
-print(f"Total trips for route 539: {len(trips_539)}")
-print()
+    def query(path, **params):
+        status, body = index.handle(f"{path}?{urlencode(params)}")
+        return status, json.loads(body)
+    return query
 
-# Get service patterns
-print("Service patterns:")
-service_info = trips_539.merge(calendar, on='service_id')
-print(service_info[['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']].drop_duplicates())
-print()
+def print_route_headways(route_id, stats):
+    """Weekday headway statistics and hour-by-hour table of one route variant."""
+    print(f"\nHeadway Statistics for {route_id}:")
+    print(f"Number of trips: {stats['num_trips']}")
+    print(f"First departure: {stats['first_departure']}")
+    print(f"Last departure: {stats['last_departure']}")
+    print(f"Average headway: {stats['avg_headway_minutes']:.1f} minutes")
+    print(f"Min headway: {stats['min_headway_minutes']:.1f} minutes")
+    print(f"Max headway: {stats['max_headway_minutes']:.1f} minutes")
 
-# Get stop times for these trips
-stop_times_539 = stop_times[stop_times['trip_id'].isin(trips_539['trip_id'])]
-print(f"Total stop time entries: {len(stop_times_539)}")
-print()
+    print("\nHour-by-hour frequency analysis:")
+    print("Hour      | Trips | Avg Headway | Buses/Hour")
+    print("-" * 50)
+    for entry in stats['hourly_profile']:
+        if entry['trips'] == 0:
+            continue
+        time_label = f"{entry['hour']:02d}:00-{entry['hour'] + 1:02d}:00"
+        if entry['avg_headway_minutes']:
+            print(f"{time_label:10} | {entry['trips']:5} | {entry['avg_headway_minutes']:11.1f} | "
+                  f"{entry['buses_per_hour']:10.1f}")
+        else:
+            print(f"{time_label:10} | {entry['trips']:5} | {'N/A':>11} | {'N/A':>10}")
 
-# Pick a representative stop (let's use the first stop of the route)
-first_stops = stop_times_539[stop_times_539['stop_sequence'] == 1]
-print(f"Trips starting from first stops: {len(first_stops)}")
-print()
+def print_stop(query, stop_id, route, after):
+    """Routes, per-stop headways and next departures of one stop."""
+    status, data = query('/headways', stop=stop_id, route=route)
+    if status != 200:
+        print(data['error'])
+        return
+    print(f"\nStop {data['stop_id']} ({data['stop_code']}) {data['stop_name']}:")
+    for route_id, stats in data['routes'].items():
+        print(f"  {route_id}: {stats['num_trips']} trips, {stats['first_departure']}-{stats['last_departure']}, "
+              f"avg headway {stats['avg_headway_minutes']:.1f} min")
 
-# Analyze one direction (Z_4628 - Engativá)
-trips_engativa = trips_539[trips_539['route_id'] == 'Z_4628']
-stop_times_engativa = stop_times_539[stop_times_539['trip_id'].isin(trips_engativa['trip_id'])]
+    _, data = query('/departures', stop=stop_id, route=route, after=after, limit=10)
+    print(f"\nNext departures after {after}:")
+    for departure in data['departures']:
+        print(f"  {departure['departure_time']}  {departure['route_short_name']:6} ({departure['route_id']})")
 
-# Get the first stop of this direction
-first_stop_engativa = stop_times_engativa[stop_times_engativa['stop_sequence'] == 1].copy()
+def main():
+    parser = argparse.ArgumentParser(description="Weekday headways of a route (and optionally one of its stops)")
+    parser.add_argument('route', nargs='?', default='539', help="route_short_name or route_id (default: 539)")
+    parser.add_argument('--stop', help="also show headways and departures of the route at this stop_id")
+    parser.add_argument('--after', default='06:00', help="first departure time listed with --stop (default: 06:00)")
+    parser.add_argument('--url', help=f"ask a running query_service.py (e.g. http://{DEFAULT_HOST}:{DEFAULT_PORT}) "
+                                      "instead of loading the feed here")
+    args = parser.parse_args()
 
-# Convert times to datetime for analysis
-def time_to_minutes(time_str):
-    """Convert HH:MM:SS to minutes since midnight"""
-    parts = time_str.split(':')
-    hours = int(parts[0])
-    minutes = int(parts[1])
-    seconds = int(parts[2])
-    return hours * 60 + minutes + seconds / 60
+    if not args.url and not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
 
-first_stop_engativa['departure_minutes'] = first_stop_engativa['departure_time'].apply(time_to_minutes)
-first_stop_engativa = first_stop_engativa.sort_values('departure_minutes')
+    query = make_query(args.url)
+    if query is None:
+        return
 
-print(f"\n539 Engativá - First stop departures:")
-print(first_stop_engativa[['trip_id', 'departure_time', 'stop_id']].head(20))
+    status, variants = query('/routes', route=args.route)
+    if status != 200:
+        print(variants['error'])
+        return
+    print(f"Route {args.route} variants:")
+    for route in variants:
+        print(f"  {route['route_id']:10} {route['route_short_name']:6} {route['route_long_name']}")
 
-# Calculate headways
-if len(first_stop_engativa) > 1:
-    departures_sorted = sorted(first_stop_engativa['departure_minutes'].values)
-    headways = [departures_sorted[i+1] - departures_sorted[i] for i in range(len(departures_sorted)-1)]
-    
-    print(f"\n\nHeadway Statistics for Route 539 Engativá:")
-    print(f"Number of trips: {len(first_stop_engativa)}")
-    print(f"First departure: {first_stop_engativa.iloc[0]['departure_time']}")
-    print(f"Last departure: {first_stop_engativa.iloc[-1]['departure_time']}")
-    print(f"Average headway: {sum(headways)/len(headways):.1f} minutes")
-    print(f"Min headway: {min(headways):.1f} minutes")
-    print(f"Max headway: {max(headways):.1f} minutes")
-    
-    # Analyze by time of day
-    print("\n\nHeadways by time period:")
-    
-    # Morning rush (6-9 AM)
-    morning_trips = first_stop_engativa[(first_stop_engativa['departure_minutes'] >= 6*60) & 
-                                         (first_stop_engativa['departure_minutes'] < 9*60)]
-    if len(morning_trips) > 1:
-        morning_deps = sorted(morning_trips['departure_minutes'].values)
-        morning_headways = [morning_deps[i+1] - morning_deps[i] for i in range(len(morning_deps)-1)]
-        print(f"Morning (6-9 AM): {len(morning_trips)} trips, avg headway {sum(morning_headways)/len(morning_headways):.1f} min")
-    
-    # Midday (9 AM - 4 PM)
-    midday_trips = first_stop_engativa[(first_stop_engativa['departure_minutes'] >= 9*60) & 
-                                        (first_stop_engativa['departure_minutes'] < 16*60)]
-    if len(midday_trips) > 1:
-        midday_deps = sorted(midday_trips['departure_minutes'].values)
-        midday_headways = [midday_deps[i+1] - midday_deps[i] for i in range(len(midday_deps)-1)]
-        print(f"Midday (9 AM-4 PM): {len(midday_trips)} trips, avg headway {sum(midday_headways)/len(midday_headways):.1f} min")
-    
-    # Evening rush (4-7 PM)
-    evening_trips = first_stop_engativa[(first_stop_engativa['departure_minutes'] >= 16*60) & 
-                                         (first_stop_engativa['departure_minutes'] < 19*60)]
-    if len(evening_trips) > 1:
-        evening_deps = sorted(evening_trips['departure_minutes'].values)
-        evening_headways = [evening_deps[i+1] - evening_deps[i] for i in range(len(evening_deps)-1)]
-        print(f"Evening (4-7 PM): {len(evening_trips)} trips, avg headway {sum(evening_headways)/len(evening_headways):.1f} min")
-    
-    # Hour-by-hour breakdown
-    print("\n\nHour-by-hour frequency analysis:")
-    print("Hour      | Trips | Avg Headway | Buses/Hour")
-    print("-" * 50)
-    
-    for hour in range(4, 24):
-        hour_trips = first_stop_engativa[(first_stop_engativa['departure_minutes'] >= hour*60) & 
-                                          (first_stop_engativa['departure_minutes'] < (hour+1)*60)]
-        if len(hour_trips) > 1:
-            hour_deps = sorted(hour_trips['departure_minutes'].values)
-            hour_headways = [hour_deps[i+1] - hour_deps[i] for i in range(len(hour_deps)-1)]
-            avg_headway = sum(hour_headways) / len(hour_headways)
-            buses_per_hour = 60 / avg_headway if avg_headway > 0 else 0
-            time_label = f"{hour:02d}:00-{hour+1:02d}:00"
-            print(f"{time_label:10} | {len(hour_trips):5} | {avg_headway:11.1f} | {buses_per_hour:10.1f}")
-        elif len(hour_trips) == 1:
-            time_label = f"{hour:02d}:00-{hour+1:02d}:00"
-            print(f"{time_label:10} | {len(hour_trips):5} | {'N/A':>11} | {'N/A':>10}")
+    _, headways = query('/headways', route=args.route)
+    for route in variants:
+        if route['route_id'] in headways:
+            print_route_headways(route['route_id'], headways[route['route_id']])
+        else:
+            print(f"\n{route['route_id']}: no weekday headways")
+
+    if args.stop:
+        print_stop(query, args.stop, args.route, args.after)
+
+if __name__ == "__main__":
+    main()
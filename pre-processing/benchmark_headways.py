@@ -0,0 +1,125 @@
+import json
+import os
+import time
+import zipfile
+
+import pandas as pd
+
+from gtfs_loader import GTFS_ZIP_PATH
+from headways import get_weekday_services, calculate_all_route_headways
+from extract_all_headways import load_gtfs_headway_data
+
+def load_raw_tables(zip_path):
+    """Reference loader: plain read_csv on every column, as the scripts used to do."""
+    with zipfile.ZipFile(zip_path) as z:
+        with z.open('routes.txt') as f:
+            routes = pd.read_csv(f)
+        with z.open('trips.txt') as f:
+            trips = pd.read_csv(f)
+        with z.open('stop_times.txt') as f:
+            stop_times = pd.read_csv(f)
+        with z.open('calendar.txt') as f:
+            calendar = pd.read_csv(f)
+
+    return routes, trips, stop_times, calendar
+
+def time_to_minutes(time_str):
+    """Convert HH:MM:SS to minutes since midnight"""
+    parts = time_str.split(':')
+    return int(parts[0]) * 60 + int(parts[1]) + int(parts[2]) / 60
+
+def legacy_route_headways(routes, trips, stop_times, weekday_services):
+    """Reference implementation: the original per-route loop over the full stop_times table."""
+    results = {}
+    for _, route in routes.iterrows():
+        route_id = route['route_id']
+        route_trips = trips[trips['route_id'] == route_id]
+        weekday_trips = route_trips[route_trips['service_id'].isin(weekday_services)]
+        if len(weekday_trips) == 0:
+            continue
+
+        trip_stop_times = stop_times[stop_times['trip_id'].isin(weekday_trips['trip_id'])]
+        first_stops = trip_stop_times[trip_stop_times['stop_sequence'] == 1].copy()
+        if len(first_stops) < 2:
+            continue
+
+        first_stops['departure_minutes'] = first_stops['departure_time'].apply(time_to_minutes)
+        first_stops = first_stops.sort_values('departure_minutes', kind='stable')
+
+        departures = sorted(first_stops['departure_minutes'].values)
+        headways = [departures[i+1] - departures[i] for i in range(len(departures)-1)]
+        headways_filtered = [h for h in headways if h > 0]
+        if len(headways_filtered) == 0:
+            continue
+
+        stats = {
+            'num_trips': len(first_stops),
+            'first_departure': first_stops.iloc[0]['departure_time'],
+            'last_departure': first_stops.iloc[-1]['departure_time'],
+            'avg_headway_minutes': round(sum(headways_filtered) / len(headways_filtered), 1),
+            'min_headway_minutes': round(min(headways_filtered), 1),
+            'max_headway_minutes': round(max(headways_filtered), 1)
+        }
+
+        hourly_profile = []
+        for hour in range(4, 24):
+            hour_trips = first_stops[
+                (first_stops['departure_minutes'] >= hour * 60) &
+                (first_stops['departure_minutes'] < (hour + 1) * 60)
+            ]
+            hour_deps = sorted(hour_trips['departure_minutes'].values)
+            hour_headways = [hour_deps[i+1] - hour_deps[i] for i in range(len(hour_deps)-1)]
+            hour_headways_filtered = [h for h in hour_headways if h > 0]
+
+            if len(hour_headways_filtered) > 0:
+                avg_headway = sum(hour_headways_filtered) / len(hour_headways_filtered)
+                hourly_profile.append({
+                    'hour': hour,
+                    'trips': len(hour_trips),
+                    'avg_headway_minutes': round(avg_headway, 1),
+                    'buses_per_hour': round(60 / avg_headway, 1) if avg_headway > 0 else 0
+                })
+            else:
+                hourly_profile.append({
+                    'hour': hour,
+                    'trips': len(hour_trips),
+                    'avg_headway_minutes': 0,
+                    'buses_per_hour': 0
+                })
+
+        stats['hourly_profile'] = hourly_profile
+        results[route_id] = stats
+
+    return results
+
+def main():
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    start = time.perf_counter()
+    routes, trips, stop_times, calendar = load_raw_tables(GTFS_ZIP_PATH)
+    print(f"Raw read_csv load:  {time.perf_counter() - start:8.3f} s")
+    print(f"{len(routes)} routes, {len(trips)} trips, {len(stop_times)} stop_times rows")
+
+    start = time.perf_counter()
+    legacy = legacy_route_headways(routes, trips, stop_times, get_weekday_services(calendar))
+    legacy_time = time.perf_counter() - start
+    print(f"Per-route loop:     {legacy_time:8.3f} s")
+
+    start = time.perf_counter()
+    routes, trips, stop_times, calendar, _ = load_gtfs_headway_data(GTFS_ZIP_PATH)
+    print(f"Shared loader load: {time.perf_counter() - start:8.3f} s")
+
+    start = time.perf_counter()
+    vectorized = calculate_all_route_headways(trips, stop_times, get_weekday_services(calendar))
+    vectorized_time = time.perf_counter() - start
+    print(f"Vectorized pass:    {vectorized_time:8.3f} s")
+
+    print(f"Speedup: {legacy_time / vectorized_time:.1f}x")
+
+    same = json.dumps(legacy, ensure_ascii=False, indent=2) == json.dumps(vectorized, ensure_ascii=False, indent=2)
+    print(f"Identical output: {same}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from od_index import OUTPUT_DIR, OUTPUT_NAME, DirectRouteIndex, route_patterns
+from trip_patterns import extract_trip_patterns
+
+def linear_routes_between(patterns, origin, destination):
+    """Reference implementation: scan the ordered stop list of every pattern."""
+    routes = set()
+    for route_id, stops in patterns:
+        if origin in stops and destination in stops[stops.index(origin) + 1:]:
+            routes.add(route_id)
+    return sorted(routes)
+
+def random_pairs(patterns, stop_ids, n, seed=0):
+    """Query pairs: half of random stops, half of two stops along the same pattern (mostly served)."""
+    rng = random.Random(seed)
+    pairs = [(rng.choice(stop_ids), rng.choice(stop_ids)) for _ in range(n // 2)]
+    for _ in range(n - len(pairs)):
+        _, stops = rng.choice(patterns)
+        pairs.append(tuple(rng.sample(stops, 2)) if len(stops) > 1 else (stops[0], stops[0]))
+    rng.shuffle(pairs)
+    return pairs
+
+def time_queries(query, pairs):
+    """Latency of every query in microseconds, and the results."""
+    latencies, results = [], []
+    for origin, destination in pairs:
+        start = time.perf_counter()
+        results.append(query(origin, destination))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return np.array(latencies), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ordered OD queries: direct-route index vs pattern scan")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with {OUTPUT_NAME} (default: {OUTPUT_DIR})")
+    parser.add_argument('-n', '--queries', type=int, default=10000)
+    args = parser.parse_args()
+
+    index_file = os.path.join(args.output_dir, OUTPUT_NAME)
+    if not os.path.exists(index_file):
+        print(f"File not found: {index_file}")
+        return
+
+    feed = load_feed(GTFS_ZIP_PATH, ['stop_times', 'trips'])
+    if feed is None:
+        return
+
+    pattern_routes, pattern_stops, stop_ids, route_ids = route_patterns(
+        extract_trip_patterns(feed['stop_times'], feed['trips']))
+    patterns = [(route_ids[route], [stop_ids[stop] for stop in stops.tolist()])
+                for route, stops in zip(pattern_routes.tolist(), pattern_stops)]
+
+    start = time.perf_counter()
+    index = DirectRouteIndex.load(args.output_dir)
+    print(f"Index load: {time.perf_counter() - start:8.3f} s ({len(index.stop_index)} stops, "
+          f"{len(index.pattern_routes)} patterns, {os.path.getsize(index_file) / 1024:.0f} KB)")
+
+    pairs = random_pairs(patterns, stop_ids, args.queries)
+    linear_us, linear = time_queries(lambda a, b: linear_routes_between(patterns, a, b), pairs)
+    index_us, indexed = time_queries(index.routes_between, pairs)
+
+    for name, latencies in (('Pattern scan', linear_us), ('OD index', index_us)):
+        print(f"{name + ':':14} mean {latencies.mean():10.1f} us, p50 {np.percentile(latencies, 50):10.1f} us, "
+              f"p99 {np.percentile(latencies, 99):10.1f} us")
+    print(f"Speedup: {linear_us.mean() / index_us.mean():.1f}x")
+    print(f"Pairs with a direct route: {sum(1 for routes in indexed if routes)} of {len(pairs)}")
+    print(f"Identical results: {linear == indexed}")
+
+if __name__ == "__main__":
+    main()
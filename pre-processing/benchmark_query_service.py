@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+from query_service import DEFAULT_HOST, DEFAULT_PORT
+
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+
+def query_targets(stops_with_routes, n, repeat=0.5, hot_set=200, seed=0):
+    """Random request targets over every endpoint.
+
+    A `repeat` fraction of them is drawn from `hot_set` fixed queries, so
+    the LRU cache sees repeated queries as well as new ones.
+    """
+    rng = random.Random(seed)
+    stops = [stop for stop in stops_with_routes if stop['routes']]
+
+    def target():
+        stop = rng.choice(stops)
+        route = rng.choice(stop['routes'])
+        kind = rng.randrange(6)
+        after = f"{rng.randrange(5, 23):02d}:{rng.randrange(60):02d}"
+        path, params = [
+            ('/headways', {'route': route['route_id']}),
+            ('/headways', {'route': route['route_short_name'], 'hour': rng.randrange(5, 23)}),
+            ('/headways', {'stop': stop['stop_id']}),
+            ('/stop_routes', {'stop': stop['stop_id']}),
+            ('/departures', {'stop': stop['stop_id'], 'after': after}),
+            ('/departures', {'stop': stop['stop_id'], 'after': after, 'route': route['route_id']}),
+        ][kind]
+        return f"{path}?{urlencode(params)}"
+
+    hot = [target() for _ in range(hot_set)]
+    return [rng.choice(hot) if rng.random() < repeat else target() for _ in range(n)]
+
+async def request(reader, writer, host, target):
+    """GET `target` on a keep-alive connection. Returns (status, body)."""
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('ascii'))
+    await writer.drain()
+    head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+    length = next(int(line.split(':', 1)[1]) for line in head if line.lower().startswith('content-length:'))
+    return int(head[0].split()[1]), await reader.readexactly(length)
+
+async def client(host, port, queue, latencies, statuses):
+    """Send queued targets one after another over one connection, timing each request."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while not queue.empty():
+            target = queue.get_nowait()
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, host, target)
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def load_test(host, port, targets, concurrency):
+    """Run `targets` through `concurrency` connections. Returns (latencies in ms, status counts, wall seconds)."""
+    queue = asyncio.Queue()
+    for target in targets:
+        queue.put_nowait(target)
+
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, queue, latencies, statuses) for _ in range(concurrency)))
+    return np.array(latencies), statuses, time.perf_counter() - start
+
+async def fetch_json(host, port, target):
+    """Decoded JSON body of one request on a fresh connection."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return json.loads((await request(reader, writer, host, target))[1])
+    finally:
+        writer.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test a running query_service.py with concurrent requests")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('-n', '--requests', type=int, default=20000)
+    parser.add_argument('-c', '--concurrency', type=int, default=32, help="concurrent connections (default: 32)")
+    parser.add_argument('--repeat', type=float, default=0.5,
+                        help="fraction of requests repeating a small set of hot queries (default: 0.5)")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with stops_with_routes.json, the source of the queried IDs "
+                             f"(default: {OUTPUT_DIR})")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    stops_file = os.path.join(args.output_dir, 'stops_with_routes.json')
+    if not os.path.exists(stops_file):
+        print(f"File not found: {stops_file}")
+        return
+    with open(stops_file, encoding='utf-8') as f:
+        targets = query_targets(json.load(f), args.requests, args.repeat, seed=args.seed)
+
+    try:
+        before = asyncio.run(fetch_json(args.host, args.port, '/stats'))
+    except OSError:
+        print(f"No query service on {args.host}:{args.port}; start it with python query_service.py")
+        return
+
+    latencies, statuses, wall = asyncio.run(load_test(args.host, args.port, targets, args.concurrency))
+    after = asyncio.run(fetch_json(args.host, args.port, '/stats'))
+
+    print(f"{len(latencies)} requests over {args.concurrency} connections in {wall:.2f} s "
+          f"({len(latencies) / wall:.0f} requests/s)")
+    print(f"Latency: mean {latencies.mean():8.2f} ms, p50 {np.percentile(latencies, 50):8.2f} ms, "
+          f"p99 {np.percentile(latencies, 99):8.2f} ms, max {latencies.max():8.2f} ms")
+    print(f"Status codes: {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))}")
+    hits = after['cache']['hits'] - before['cache']['hits']
+    misses = after['cache']['misses'] - before['cache']['misses']
+    print(f"Cache: {hits} hits, {misses} misses ({hits / max(hits + misses, 1):.0%} hit rate)")
+
+if __name__ == "__main__":
+    main()
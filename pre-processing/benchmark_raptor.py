@@ -0,0 +1,68 @@
+import argparse
+import os
+import random
+import time
+
+import numpy as np
+
+from gtfs_loader import GTFS_ZIP_PATH, format_gtfs_time
+from raptor import MAX_TRANSFERS, MAX_WALK_M, load_timetable, plan
+
+# Departure times of the sampled queries, seconds since midnight
+FIRST_DEPARTURE = 6 * 3600
+LAST_DEPARTURE = 20 * 3600
+
+def random_queries(timetable, n, seed=0):
+    """Random (origin, destination, departure) queries between stops served by some pattern."""
+    rng = random.Random(seed)
+    served = np.unique(timetable['pattern_stops']).tolist()
+    stop_ids = timetable['stop_ids']
+    return [(stop_ids[rng.choice(served)], stop_ids[rng.choice(served)],
+             rng.randrange(FIRST_DEPARTURE, LAST_DEPARTURE)) for _ in range(n)]
+
+def timetable_bytes(timetable):
+    """Bytes held by the timetable's NumPy arrays."""
+    return sum(value.nbytes for value in timetable.values() if isinstance(value, np.ndarray))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark RAPTOR journey queries over a random OD sample")
+    parser.add_argument('-n', '--queries', type=int, default=500)
+    parser.add_argument('--date', help="service date YYYYMMDD (default: a typical weekday of the feed)")
+    parser.add_argument('--max-transfers', type=int, default=MAX_TRANSFERS)
+    parser.add_argument('--max-walk', type=float, default=MAX_WALK_M,
+                        help=f"longest walking transfer in metres (default: {MAX_WALK_M})")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    start = time.perf_counter()
+    timetable = load_timetable(GTFS_ZIP_PATH, args.date, args.max_walk)
+    if timetable is None:
+        return
+    print(f"Timetable build: {time.perf_counter() - start:8.3f} s ({timetable_bytes(timetable) / 1024 ** 2:.1f} MB "
+          f"of arrays)")
+
+    queries = random_queries(timetable, args.queries, args.seed)
+    latencies, rides = [], []
+    for origin, destination, departure in queries:
+        start = time.perf_counter()
+        journeys = plan(timetable, origin, destination, departure, args.max_transfers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if journeys:
+            # The fastest journey is the last one (more rides only appear when they arrive earlier)
+            rides.append(journeys[-1]['rides'])
+
+    latencies = np.array(latencies)
+    print(f"{len(queries)} queries between {format_gtfs_time(FIRST_DEPARTURE)} and "
+          f"{format_gtfs_time(LAST_DEPARTURE)}, at most {args.max_transfers} transfers:")
+    print(f"Latency: mean {latencies.mean():8.2f} ms, p50 {np.percentile(latencies, 50):8.2f} ms, "
+          f"p99 {np.percentile(latencies, 99):8.2f} ms, max {latencies.max():8.2f} ms")
+    print(f"Answered: {len(rides)} of {len(queries)}")
+    for count in sorted(set(rides)):
+        print(f"  fastest with {count} ride(s): {rides.count(count)}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from process_stops import OUTPUT_DIR
+from stop_index import GRID_DIR, StopGridIndex, haversine_m
+
+def linear_routes_near(stops_with_routes, lat, lon, radius_m):
+    """Reference implementation: scan every stop of stops_with_routes.json."""
+    near = []
+    for stop in stops_with_routes:
+        distance = float(haversine_m(lat, lon, stop['stop_lat'], stop['stop_lon']))
+        if distance <= radius_m:
+            near.append((distance, stop))
+
+    nearest = {}
+    for distance, stop in sorted(near, key=lambda item: item[0]):
+        for route in stop['routes']:
+            if route['route_id'] not in nearest:
+                nearest[route['route_id']] = distance
+    return list(nearest.items())
+
+def random_points(stops_with_routes, n, seed=0):
+    """Random query points in the bounding box of the stops."""
+    rng = random.Random(seed)
+    lats = [stop['stop_lat'] for stop in stops_with_routes]
+    lons = [stop['stop_lon'] for stop in stops_with_routes]
+    return [(rng.uniform(min(lats), max(lats)), rng.uniform(min(lons), max(lons))) for _ in range(n)]
+
+def time_queries(query, points, radius_m):
+    """Latency of every query in milliseconds, and the results."""
+    latencies, results = [], []
+    for lat, lon in points:
+        start = time.perf_counter()
+        results.append(query(lat, lon, radius_m))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies), results
+
+def shard_sizes(output_dir):
+    """Size in bytes of every grid shard."""
+    grid_dir = os.path.join(output_dir, GRID_DIR)
+    return {name: os.path.getsize(os.path.join(grid_dir, name))
+            for name in os.listdir(grid_dir) if name != 'index.json'}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark nearby-route queries: grid index vs linear scan")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with stops_with_routes.json and the stop grid (default: {OUTPUT_DIR})")
+    parser.add_argument('-n', '--queries', type=int, default=1000)
+    parser.add_argument('-r', '--radius', type=float, default=500, help="query radius in metres (default: 500)")
+    args = parser.parse_args()
+
+    stops_file = os.path.join(args.output_dir, 'stops_with_routes.json')
+    if not os.path.exists(stops_file):
+        print(f"File not found: {stops_file}")
+        return
+
+    with open(stops_file, encoding='utf-8') as f:
+        stops_with_routes = json.load(f)
+
+    start = time.perf_counter()
+    index = StopGridIndex.load(args.output_dir)
+    print(f"Index load from shards: {time.perf_counter() - start:8.3f} s ({len(index.stop_ids)} stops, "
+          f"{len(index.cells)} cells)")
+
+    points = random_points(stops_with_routes, args.queries)
+    linear_ms, linear = time_queries(lambda lat, lon, r: linear_routes_near(stops_with_routes, lat, lon, r),
+                                     points, args.radius)
+    grid_ms, grid = time_queries(index.routes_near, points, args.radius)
+
+    for name, latencies in (('Linear scan', linear_ms), ('Grid index', grid_ms)):
+        print(f"{name + ':':13} mean {latencies.mean():8.3f} ms, p50 {np.percentile(latencies, 50):8.3f} ms, "
+              f"p99 {np.percentile(latencies, 99):8.3f} ms")
+    print(f"Speedup: {linear_ms.mean() / grid_ms.mean():.1f}x")
+
+    # Distances differ in the last bits between the scalar and vectorized haversine
+    same = all([r for r, _ in a] == [r for r, _ in b] and np.allclose([d for _, d in a], [d for _, d in b])
+               for a, b in zip(linear, grid))
+    print(f"Identical results: {same}")
+
+    sizes = shard_sizes(args.output_dir)
+    shard_bytes = np.array(list(sizes.values()))
+    print(f"Shards: {len(sizes)}, mean {shard_bytes.mean() / 1024:.1f} KB, max {shard_bytes.max() / 1024:.1f} KB "
+          f"(stops_with_routes.json: {os.path.getsize(stops_file) / 1024:.1f} KB)")
+
+if __name__ == "__main__":
+    main()
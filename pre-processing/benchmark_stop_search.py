@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import random
+import time
+
+import numpy as np
+
+from process_stops import OUTPUT_DIR
+from stop_search import SEARCH_DIR, StopSearchIndex, linear_search, search_tokens
+
+def random_queries(stops_with_routes, routes_index, n, seed=0):
+    """Search queries as a user types them: prefixes of stop codes, stop name words and route short names."""
+    rng = random.Random(seed)
+    stops = [stop for stop in stops_with_routes if stop['stop_code']]
+    queries = []
+    for _ in range(n):
+        kind = rng.randrange(3)
+        if kind == 0:
+            text = rng.choice(stops)['stop_code']
+        elif kind == 1:
+            text = rng.choice(search_tokens(rng.choice(stops_with_routes)['stop_name']) or ['a'])
+        else:
+            text = rng.choice(routes_index)['route_short_name']
+        queries.append(text[:rng.randint(min(2, len(text)), len(text))])
+    return queries
+
+def time_queries(query, queries):
+    """Latency of every query in milliseconds, and the results."""
+    latencies, results = [], []
+    for text in queries:
+        start = time.perf_counter()
+        results.append(query(text))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.array(latencies), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark stop/route search: prefix shards vs linear scan")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with stops_with_routes.json, routes_index.json and the search shards "
+                             f"(default: {OUTPUT_DIR})")
+    parser.add_argument('-n', '--queries', type=int, default=1000)
+    parser.add_argument('--limit', type=int, default=10, help="results kept per query, as in the app (default: 10)")
+    args = parser.parse_args()
+
+    stops_file = os.path.join(args.output_dir, 'stops_with_routes.json')
+    routes_file = os.path.join(args.output_dir, 'routes_index.json')
+    for path in (stops_file, routes_file, os.path.join(args.output_dir, SEARCH_DIR, 'index.json')):
+        if not os.path.exists(path):
+            print(f"File not found: {path}")
+            return
+
+    with open(stops_file, encoding='utf-8') as f:
+        stops_with_routes = json.load(f)
+    with open(routes_file, encoding='utf-8') as f:
+        routes_index = json.load(f)
+    # Search only covers the indexed routes that serve a stop, like the shards
+    served = {route['route_id'] for stop in stops_with_routes for route in stop['routes']}
+    routes_index = [route for route in routes_index if route['route_id'] in served]
+
+    queries = random_queries(stops_with_routes, routes_index, args.queries)
+    linear_ms, linear = time_queries(lambda text: linear_search(stops_with_routes, routes_index, text, args.limit),
+                                     queries)
+
+    # A fresh index per query: every lookup fetches its shards like a first visit in the app
+    shard_bytes = []
+    def shard_search(text):
+        index = StopSearchIndex(args.output_dir)
+        result = index.search(text, args.limit)
+        shard_bytes.append(index.bytes_read)
+        return result
+    shard_ms, sharded = time_queries(shard_search, queries)
+
+    for name, latencies in (('Linear scan', linear_ms), ('Search shards', shard_ms)):
+        print(f"{name + ':':15} mean {latencies.mean():8.3f} ms, p50 {np.percentile(latencies, 50):8.3f} ms, "
+              f"p99 {np.percentile(latencies, 99):8.3f} ms")
+    print(f"Speedup: {linear_ms.mean() / shard_ms.mean():.1f}x")
+    print(f"Identical results: {linear == sharded}")
+
+    shard_bytes = np.array(shard_bytes)
+    scan_bytes = os.path.getsize(stops_file) + os.path.getsize(routes_file)
+    print(f"Fetched per query: mean {shard_bytes.mean() / 1024:.1f} KB, p99 {np.percentile(shard_bytes, 99) / 1024:.1f} KB, "
+          f"max {shard_bytes.max() / 1024:.1f} KB (linear scan: {scan_bytes / 1024:.0f} KB)")
+
+    search_dir = os.path.join(args.output_dir, SEARCH_DIR)
+    sizes = np.array([os.path.getsize(os.path.join(search_dir, name)) for name in os.listdir(search_dir)
+                      if name != 'index.json'])
+    print(f"Shards: {len(sizes)}, mean {sizes.mean() / 1024:.1f} KB, max {sizes.max() / 1024:.1f} KB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from instrumentation import measure, peak_rss_mb
+from synthetic_gtfs import feed_shape, generate_feed
+
+# Results of the last run, relative to pre-processing/
+BENCHMARK_RESULTS = 'benchmark_results.json'
+FEEDS_DIR = '.benchmark_feeds'
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+STOPS_PER_TRIP = 25
+TRIPS_PER_ROUTE = 80
+# Pipeline stages (see pipeline.build_stages) and the scripts they stand for
+STAGES = {
+    'shapes': 'process_gtfs.py',
+    'stops': 'process_stops.py',
+    'frequencies': 'extract_all_headways.py',
+    'day_type_frequencies': 'extract_all_headways.py --day-types',
+    'stop_frequencies': 'stop_headways.py',
+    'od_index': 'od_index.py',
+    'shape_stops': 'linear_referencing.py',
+}
+
+def git_commit():
+    """Commit the benchmark runs against, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def feed_path(stop_times_rows, seed=0):
+    """Synthetic feed of about `stop_times_rows` rows, generated on first use."""
+    routes = feed_shape(stop_times_rows, STOPS_PER_TRIP, TRIPS_PER_ROUTE)
+    path = os.path.join(FEEDS_DIR, f"synthetic-{routes}x{TRIPS_PER_ROUTE}x{STOPS_PER_TRIP}-{seed}.zip")
+    if not os.path.exists(path):
+        os.makedirs(FEEDS_DIR, exist_ok=True)
+        print(f"Generating {path}...")
+        generate_feed(path, routes, TRIPS_PER_ROUTE, STOPS_PER_TRIP, seed)
+    return path, routes
+
+def run_stage(stage, zip_path, output_dir):
+    """Load the feed, extract its trip patterns and run one stage in this process.
+
+    Returns the stage's metrics (see instrumentation.measure) with the load
+    and pattern extraction times.
+    """
+    from gtfs_loader import load_feed
+    from pipeline import build_stages
+    from trip_patterns import compression_stats, extract_trip_patterns
+
+    # Always parsed from the zip, so load times stay comparable
+    feed, load = measure(load_feed, (zip_path, ['routes', 'trips', 'shapes', 'stops', 'stop_times', 'calendar']),
+                         kwargs={'use_cache': False, 'fill_cache': False, 'optional': ['calendar_dates']})
+    feed['patterns'], patterns = measure(extract_trip_patterns, (feed['stop_times'], feed['trips']))
+    settings = {'tolerance_m': 0, 'precision': None, 'columnar_frequencies': False, 'dedupe_shapes': False}
+    function, args = build_stages(feed, output_dir, settings)[stage]
+    _, result = measure(function, args)
+    result.update({'load_wall_s': load['wall_s'], 'load_cpu_s': load['cpu_s'], 'load_peak_rss_mb': load['peak_rss_mb'],
+                   'patterns_wall_s': patterns['wall_s'],
+                   'compression_ratio': compression_stats(feed['patterns'])['compression_ratio']})
+    return result
+
+def run_stage_subprocess(stage, zip_path):
+    """run_stage in a fresh interpreter, so every stage starts from an empty heap and its own peak RSS."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        completed = subprocess.run([sys.executable, __file__, '--run-stage', stage, zip_path, output_dir],
+                                   capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr)
+        return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'failed'}
+    # The stage's own output comes first; the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def print_comparison(runs, baseline_path):
+    """Print each stage's wall time against the same size and stage in an earlier results file."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(run['stop_times_rows'], run['stage']): run for run in baseline['runs'] if 'wall_s' in run}
+
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('commit')}):")
+    for run in runs:
+        before = previous.get((run['stop_times_rows'], run['stage']))
+        if before is None or 'wall_s' not in run:
+            continue
+        print(f"{run['stop_times_rows']:>10} {run['stage']:22} {before['wall_s']:9.2f} s -> {run['wall_s']:9.2f} s "
+              f"({run['wall_s'] / before['wall_s']:5.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every pre-processing stage on synthetic feeds of growing size")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="stop_times rows of the synthetic feeds (default: 10k to 10M)")
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=BENCHMARK_RESULTS,
+                        help=f"results file (default: {BENCHMARK_RESULTS})")
+    parser.add_argument('--baseline', help="earlier results file to compare wall times with")
+    parser.add_argument('--run-stage', nargs=3, metavar=('STAGE', 'ZIP', 'OUTPUT_DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        print(json.dumps(run_stage(*args.run_stage)))
+        return
+
+    if peak_rss_mb() is None:
+        print("Warning: neither resource nor psutil is available, peak RSS is not recorded")
+
+    runs = []
+    for size in args.sizes:
+        zip_path, routes = feed_path(size, args.seed)
+        rows = routes * TRIPS_PER_ROUTE * STOPS_PER_TRIP
+        for stage in args.stages:
+            result = run_stage_subprocess(stage, zip_path)
+            runs.append({'stop_times_rows': rows, 'routes': routes, 'trips_per_route': TRIPS_PER_ROUTE,
+                         'stops_per_trip': STOPS_PER_TRIP, 'stage': stage, 'script': STAGES[stage], **result})
+            if 'error' in result:
+                print(f"{rows:>10} {stage:22} failed: {result['error']}")
+                continue
+            peak = f"{result['peak_rss_mb']:8.0f} MB" if result['peak_rss_mb'] is not None else "       - MB"
+            print(f"{rows:>10} {stage:22} load {result['load_wall_s']:7.2f} s, stage {result['wall_s']:8.2f} s "
+                  f"(cpu {result['cpu_s']:8.2f} s), peak {peak}")
+
+    results = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'seed': args.seed,
+        'runs': runs,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {args.output}")
+
+    if args.baseline:
+        print_comparison(runs, args.baseline)
+
+if __name__ == "__main__":
+    main()
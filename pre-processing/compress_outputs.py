@@ -0,0 +1,118 @@
+import argparse
+import gzip
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Paths
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+# Per-file size report of the last run, relative to pre-processing/
+COMPRESSION_REPORT = 'compression_report.json'
+
+JSON_EXTENSIONS = ('.json', '.geojson')
+COMPRESSED_EXTENSIONS = ('.gz', '.br')
+# Content-hashed copies of the outputs (see hash_outputs.py). They are made
+# from the compressed outputs and must never change, so they are skipped here
+HASHED_DIR = 'hashed'
+
+def find_outputs(output_dir):
+    """Every JSON/GeoJSON file under output_dir (but not hashed/), largest first so big files start early."""
+    paths = []
+    for root, dirs, names in os.walk(output_dir):
+        if root == output_dir:
+            dirs[:] = [name for name in dirs if name != HASHED_DIR]
+        paths.extend(os.path.join(root, name) for name in names if name.endswith(JSON_EXTENSIONS))
+    return sorted(paths, key=os.path.getsize, reverse=True)
+
+def remove_orphans(output_dir):
+    """Delete .gz/.br files whose uncompressed file no longer exists (e.g. removed routes)."""
+    removed = 0
+    for root, dirs, names in os.walk(output_dir):
+        if root == output_dir:
+            dirs[:] = [name for name in dirs if name != HASHED_DIR]
+        for name in names:
+            base, ext = os.path.splitext(name)
+            if ext in COMPRESSED_EXTENSIONS and base.endswith(JSON_EXTENSIONS) and base not in names:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+def compress_file(path):
+    """Minify a JSON file in place and write its .gz and .br siblings. Returns its sizes in bytes."""
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    minified = json.dumps(json.loads(raw), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    if minified != raw:
+        with open(path, 'wb') as f:
+            f.write(minified)
+
+    gzipped = gzip.compress(minified, compresslevel=9, mtime=0)
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzipped)
+
+    sizes = {'raw': len(raw), 'minified': len(minified), 'gzip': len(gzipped)}
+    if brotli is not None:
+        brotlied = brotli.compress(minified, quality=11)
+        with open(path + '.br', 'wb') as f:
+            f.write(brotlied)
+        sizes['brotli'] = len(brotlied)
+    elif os.path.exists(path + '.br'):
+        # Left by an earlier run, and now out of date
+        os.remove(path + '.br')
+
+    return sizes
+
+def print_size_report(report, output_dir, count=10):
+    """Print the largest files and the totals."""
+    columns = [column for column in ('raw', 'minified', 'gzip', 'brotli') if any(column in s for s in report.values())]
+
+    def row(name, sizes):
+        return f"{name:40} " + " ".join(f"{sizes.get(column, 0) / 1024:12.1f}" for column in columns)
+
+    print(f"\n{'File (KB)':40} " + " ".join(f"{column:>12}" for column in columns))
+    for path, sizes in list(report.items())[:count]:
+        print(row(os.path.relpath(path, output_dir), sizes))
+    if len(report) > count:
+        print(f"... {len(report) - count} more files in {COMPRESSION_REPORT}")
+
+    totals = {column: sum(sizes.get(column, 0) for sizes in report.values()) for column in columns}
+    print(row(f"Total ({len(report)} files)", totals))
+
+def compress_outputs(output_dir=OUTPUT_DIR, workers=None):
+    """Minify every JSON/GeoJSON output and write maximum-level .gz/.br siblings, in parallel."""
+    if brotli is None:
+        print("Warning: brotli is not installed, only writing .gz files")
+
+    removed = remove_orphans(output_dir)
+    if removed:
+        print(f"Removed {removed} compressed files of outputs that no longer exist")
+
+    paths = find_outputs(output_dir)
+    print(f"Compressing {len(paths)} files...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        report = dict(zip(paths, pool.map(compress_file, paths)))
+
+    print_size_report(report, output_dir)
+    with open(COMPRESSION_REPORT, 'w', encoding='utf-8') as f:
+        json.dump({os.path.relpath(path, output_dir): sizes for path, sizes in report.items()}, f, indent=2)
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Minify the JSON outputs and write .gz/.br versions of them")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with the generated files (default: {OUTPUT_DIR})")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    compress_outputs(args.output_dir, args.workers)
+
+if __name__ == "__main__":
+    main()
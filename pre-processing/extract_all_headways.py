@@ -1,184 +1,222 @@
-import pandas as pd
+import argparse
 import json
-import zipfile
 import os
 
-# Path to GTFS zip file
-GTFS_ZIP_PATH = os.path.join('..', 'GTFS-2025-10-28.zip')
-
-print("Loading GTFS data from zip file...")
-with zipfile.ZipFile(GTFS_ZIP_PATH) as z:
-    with z.open('routes.txt') as f:
-        routes = pd.read_csv(f)
-    with z.open('trips.txt') as f:
-        trips = pd.read_csv(f)
-    with z.open('stop_times.txt') as f:
-        stop_times = pd.read_csv(f)
-    with z.open('calendar.txt') as f:
-        calendar = pd.read_csv(f)
-
-# Get weekday service IDs (Monday-Friday)
-weekday_services = calendar[
-    (calendar['monday'] == 1) & 
-    (calendar['tuesday'] == 1) & 
-    (calendar['wednesday'] == 1) & 
-    (calendar['thursday'] == 1) & 
-    (calendar['friday'] == 1)
-]['service_id'].unique()
-
-print(f"Found {len(weekday_services)} weekday service patterns")
-print(f"Processing {len(routes)} routes...")
-
-def time_to_minutes(time_str):
-    """Convert HH:MM:SS to minutes since midnight"""
-    parts = time_str.split(':')
-    hours = int(parts[0])
-    minutes = int(parts[1])
-    seconds = int(parts[2])
-    return hours * 60 + minutes + seconds / 60
-
-def calculate_route_headways(route_id, route_trips, all_stop_times):
-    """Calculate headway statistics for a single route"""
-    
-    # Get weekday trips only
-    weekday_trips = route_trips[route_trips['service_id'].isin(weekday_services)]
-    
-    if len(weekday_trips) == 0:
-        return None
-    
-    # Get stop times for these trips
-    trip_stop_times = all_stop_times[all_stop_times['trip_id'].isin(weekday_trips['trip_id'])]
-    
-    # Get first stop departures (stop_sequence == 1)
-    first_stops = trip_stop_times[trip_stop_times['stop_sequence'] == 1].copy()
-    
-    if len(first_stops) < 2:
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from headways import get_weekday_services, calculate_all_route_headways, calculate_profile_route_headways
+from service_calendar import build_service_days, day_type_services
+from stop_times_stream import DEFAULT_MEMORY_BUDGET_MB, stream_stop_times
+
+OUTPUT_FILE = os.path.join('..', 'gtfs-app', 'public', 'routes_data', 'route_frequencies.json')
+DAY_TYPE_OUTPUT_NAME = 'route_frequencies_by_day_type.json'
+
+# Version of the compact columnar layout (see to_columnar)
+COLUMNAR_VERSION = 1
+ROUTE_COLUMNS = ['route_short_name', 'route_long_name', 'route_color', 'route_text_color',
+                 'num_trips', 'first_departure', 'last_departure',
+                 'avg_headway_minutes', 'min_headway_minutes', 'max_headway_minutes']
+HOURLY_COLUMNS = ['trips', 'avg_headway_minutes', 'buses_per_hour']
+
+def load_gtfs_headway_data(zip_path):
+    """Load the GTFS tables needed for headway calculation."""
+    feed = load_feed(zip_path, ['routes', 'trips', 'stop_times', 'calendar'], optional=['calendar_dates'])
+    if feed is None:
         return None
-    
-    # Convert times to minutes
-    first_stops['departure_minutes'] = first_stops['departure_time'].apply(time_to_minutes)
-    first_stops = first_stops.sort_values('departure_minutes')
-    
-    # Calculate overall statistics
-    departures = sorted(first_stops['departure_minutes'].values)
-    headways = [departures[i+1] - departures[i] for i in range(len(departures)-1)]
-    
-    # Filter out 0-minute headways (overlapping service patterns)
-    headways_filtered = [h for h in headways if h > 0]
-    
-    if len(headways_filtered) == 0:
+
+    return feed['routes'], feed['trips'], feed['stop_times'], feed['calendar'], feed.get('calendar_dates')
+
+def stream_gtfs_headway_data(zip_path, memory_budget_mb):
+    """Like load_gtfs_headway_data, but stop_times.txt is streamed down to its first-stop rows."""
+    feed = load_feed(zip_path, ['routes', 'trips', 'calendar'], fill_cache=False, optional=['calendar_dates'])
+    if feed is None:
         return None
-    
-    stats = {
-        'num_trips': len(first_stops),
-        'first_departure': first_stops.iloc[0]['departure_time'],
-        'last_departure': first_stops.iloc[-1]['departure_time'],
-        'avg_headway_minutes': round(sum(headways_filtered) / len(headways_filtered), 1),
-        'min_headway_minutes': round(min(headways_filtered), 1),
-        'max_headway_minutes': round(max(headways_filtered), 1)
+
+    _, first_stops = stream_stop_times(zip_path, feed['trips'], memory_budget_mb=memory_budget_mb)
+    return feed['routes'], feed['trips'], first_stops, feed['calendar'], feed.get('calendar_dates')
+
+def build_route_frequencies(routes, trips, stop_times, calendar):
+    """Build the route_id -> frequency data dict written to route_frequencies.json."""
+    # Get weekday service IDs (Monday-Friday)
+    weekday_services = get_weekday_services(calendar)
+
+    print(f"Found {len(weekday_services)} weekday service patterns")
+    print(f"Processing {len(routes)} routes...")
+
+    headways = calculate_all_route_headways(trips, stop_times, weekday_services)
+    route_frequency_data, processed, skipped = route_entries(routes, headways)
+
+    print(f"\nCompleted!")
+    print(f"Successfully processed: {processed} routes")
+    print(f"Skipped (no valid data): {skipped} routes")
+
+    return route_frequency_data
+
+def route_entries(routes, headways):
+    """route_id -> route fields plus headway stats, in routes.txt order. Also returns the processed/skipped counts."""
+    route_frequency_data = {}
+    processed = 0
+    skipped = 0
+
+    for route in routes.to_dict('records'):
+        route_id = route['route_id']
+
+        headway_data = headways.get(route_id)
+        if headway_data is None:
+            skipped += 1
+            continue
+
+        route_frequency_data[route_id] = {
+            'route_id': route_id,
+            'route_short_name': route['route_short_name'],
+            'route_long_name': route['route_long_name'],
+            'route_color': route['route_color'],
+            'route_text_color': route['route_text_color'],
+            **headway_data
+        }
+        processed += 1
+
+    return route_frequency_data, processed, skipped
+
+def build_day_type_frequencies(routes, trips, stop_times, calendar, calendar_dates=None):
+    """Frequency data of every day type (weekday, saturday, sunday_holiday), in one headway pass.
+
+    Each day type uses the services running on its representative date (see
+    service_calendar.py), so calendar_dates exceptions are taken into account.
+    Returns {'dates': {day_type: date}, 'day_types': {day_type: route_frequencies.json-like dict}}.
+    """
+    profiles = day_type_services(build_service_days(calendar, calendar_dates))
+    headways = calculate_profile_route_headways(trips, stop_times,
+                                                {day_type: services for day_type, (_, services) in profiles.items()})
+
+    day_types = {}
+    for day_type, (date, services) in profiles.items():
+        day_types[day_type], processed, _ = route_entries(routes, headways[day_type])
+        print(f"{day_type} ({date}, {len(services)} services): {processed} routes")
+
+    return {'dates': {day_type: date for day_type, (date, _) in profiles.items()}, 'day_types': day_types}
+
+def save_day_type_frequencies(day_type_data, output_file):
+    """Save the day-type profiles, each in the compact columnar layout (minified)."""
+    data = {
+        'dates': day_type_data['dates'],
+        'day_types': {day_type: to_columnar(route_frequency_data)
+                      for day_type, route_frequency_data in day_type_data['day_types'].items()},
     }
-    
-    # Calculate hourly profile
-    hourly_profile = []
-    for hour in range(4, 24):  # 4 AM to midnight
-        hour_trips = first_stops[
-            (first_stops['departure_minutes'] >= hour * 60) & 
-            (first_stops['departure_minutes'] < (hour + 1) * 60)
-        ]
-        
-        if len(hour_trips) > 1:
-            hour_deps = sorted(hour_trips['departure_minutes'].values)
-            hour_headways = [hour_deps[i+1] - hour_deps[i] for i in range(len(hour_deps)-1)]
-            hour_headways_filtered = [h for h in hour_headways if h > 0]
-            
-            if len(hour_headways_filtered) > 0:
-                avg_headway = sum(hour_headways_filtered) / len(hour_headways_filtered)
-                buses_per_hour = round(60 / avg_headway, 1) if avg_headway > 0 else 0
-                
-                hourly_profile.append({
-                    'hour': hour,
-                    'trips': len(hour_trips),
-                    'avg_headway_minutes': round(avg_headway, 1),
-                    'buses_per_hour': buses_per_hour
-                })
-            else:
-                # Hour has trips but no valid headways (single trip or all zero headways)
-                hourly_profile.append({
-                    'hour': hour,
-                    'trips': len(hour_trips),
-                    'avg_headway_minutes': 0,
-                    'buses_per_hour': 0
-                })
-        else:
-            # No trips or only one trip in this hour - add zero data
-            hourly_profile.append({
-                'hour': hour,
-                'trips': len(hour_trips),
-                'avg_headway_minutes': 0,
-                'buses_per_hour': 0
-            })
-    
-    stats['hourly_profile'] = hourly_profile
-    
-    return stats
-
-# Process all routes
-route_frequency_data = {}
-processed = 0
-skipped = 0
-
-for idx, route in routes.iterrows():
-    route_id = route['route_id']
-    route_short_name = route['route_short_name']
-    route_long_name = route['route_long_name']
-    
-    # Get trips for this route
-    route_trips = trips[trips['route_id'] == route_id]
-    
-    if len(route_trips) == 0:
-        skipped += 1
-        continue
-    
-    # Calculate headways
-    headway_data = calculate_route_headways(route_id, route_trips, stop_times)
-    
-    if headway_data is None:
-        skipped += 1
-        continue
-    
-    route_frequency_data[route_id] = {
-        'route_id': route_id,
-        'route_short_name': route_short_name,
-        'route_long_name': route_long_name,
-        'route_color': route['route_color'],
-        'route_text_color': route['route_text_color'],
-        **headway_data
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+
+    print(f"Saved day-type frequency data to: {output_file} ({os.path.getsize(output_file) / 1024:.0f} KB)")
+
+def columnar_path(output_file):
+    """route_frequencies.json -> route_frequencies.columnar.json"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.columnar{ext}"
+
+def to_columnar(route_frequency_data):
+    """Compact columnar form of the route_frequencies.json data.
+
+    One list per field, in route order, instead of one dict per route, and
+    the hourly profiles as one fixed-length row per route over a shared
+    `hours` axis. Values keep their JSON types, so from_columnar gives back
+    the same structure.
+    """
+    routes = list(route_frequency_data.values())
+    hours = sorted({entry['hour'] for route in routes for entry in route['hourly_profile']})
+    hour_position = {hour: i for i, hour in enumerate(hours)}
+
+    hourly = {column: [] for column in HOURLY_COLUMNS}
+    for route in routes:
+        rows = {column: [0] * len(hours) for column in HOURLY_COLUMNS}
+        for entry in route['hourly_profile']:
+            for column in HOURLY_COLUMNS:
+                rows[column][hour_position[entry['hour']]] = entry[column]
+        for column in HOURLY_COLUMNS:
+            hourly[column].append(rows[column])
+
+    return {
+        'version': COLUMNAR_VERSION,
+        'route_ids': list(route_frequency_data),
+        **{column: [route[column] for route in routes] for column in ROUTE_COLUMNS},
+        'hours': hours,
+        'hourly': hourly,
     }
-    
-    processed += 1
-    if processed % 50 == 0:
-        print(f"Processed {processed} routes...")
-
-print(f"\nCompleted!")
-print(f"Successfully processed: {processed} routes")
-print(f"Skipped (no valid data): {skipped} routes")
-
-# Save to JSON file
-output_file = '../gtfs-app/public/routes_data/route_frequencies.json'
-with open(output_file, 'w', encoding='utf-8') as f:
-    json.dump(route_frequency_data, f, ensure_ascii=False, indent=2)
-
-print(f"\nSaved frequency data to: {output_file}")
-
-# Print some sample statistics
-print("\n=== Sample Routes ===")
-sample_count = 0
-for route_id, data in route_frequency_data.items():
-    if sample_count >= 5:
-        break
-    print(f"\n{data['route_short_name']} - {data['route_long_name']}")
-    print(f"  Trips: {data['num_trips']}")
-    print(f"  Service hours: {data['first_departure']} - {data['last_departure']}")
-    print(f"  Avg headway: {data['avg_headway_minutes']} min")
-    print(f"  Peak frequency: {max([h['buses_per_hour'] for h in data['hourly_profile']])} buses/hour")
-    sample_count += 1
+
+def from_columnar(columnar):
+    """Decode to_columnar output back into the route_frequencies.json structure."""
+    hours = columnar['hours']
+    hourly = columnar['hourly']
+    route_frequency_data = {}
+    for i, route_id in enumerate(columnar['route_ids']):
+        route = {'route_id': route_id}
+        route.update({column: columnar[column][i] for column in ROUTE_COLUMNS})
+        route['hourly_profile'] = [
+            {'hour': hour, **{column: hourly[column][i][h] for column in HOURLY_COLUMNS}}
+            for h, hour in enumerate(hours)
+        ]
+        route_frequency_data[route_id] = route
+
+    return route_frequency_data
+
+def load_columnar_route_frequencies(path):
+    """Load a columnar file and decode it into the route_frequencies.json structure."""
+    with open(path, encoding='utf-8') as f:
+        return from_columnar(json.load(f))
+
+def save_route_frequencies(route_frequency_data, output_file, columnar=False):
+    """Save frequency data to JSON file, and optionally the compact columnar version next to it"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(route_frequency_data, f, ensure_ascii=False, indent=2)
+
+    print(f"\nSaved frequency data to: {output_file}")
+
+    if columnar:
+        compact_file = columnar_path(output_file)
+        with open(compact_file, 'w', encoding='utf-8') as f:
+            json.dump(to_columnar(route_frequency_data), f, ensure_ascii=False, separators=(',', ':'))
+
+        print(f"Saved columnar frequency data to: {compact_file} "
+              f"({os.path.getsize(compact_file) / 1024:.0f} KB vs {os.path.getsize(output_file) / 1024:.0f} KB)")
+
+def print_sample_routes(route_frequency_data, count=5):
+    """Print some sample statistics"""
+    print("\n=== Sample Routes ===")
+    for data in list(route_frequency_data.values())[:count]:
+        print(f"\n{data['route_short_name']} - {data['route_long_name']}")
+        print(f"  Trips: {data['num_trips']}")
+        print(f"  Service hours: {data['first_departure']} - {data['last_departure']}")
+        print(f"  Avg headway: {data['avg_headway_minutes']} min")
+        print(f"  Peak frequency: {max([h['buses_per_hour'] for h in data['hourly_profile']])} buses/hour")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build route_frequencies.json from a GTFS feed")
+    parser.add_argument('--stream', action='store_true',
+                        help="read stop_times.txt in chunks instead of loading it whole")
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"memory budget in MB for --stream (default: {DEFAULT_MEMORY_BUDGET_MB})")
+    parser.add_argument('--columnar', action='store_true',
+                        help="also write the compact route_frequencies.columnar.json")
+    parser.add_argument('--day-types', action='store_true',
+                        help=f"also write {DAY_TYPE_OUTPUT_NAME} (weekday, saturday and sunday/holiday profiles)")
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    if args.stream:
+        data = stream_gtfs_headway_data(GTFS_ZIP_PATH, args.memory_budget)
+    else:
+        data = load_gtfs_headway_data(GTFS_ZIP_PATH)
+    if not data:
+        return
+
+    routes, trips, stop_times, calendar, calendar_dates = data
+    route_frequency_data = build_route_frequencies(routes, trips, stop_times, calendar)
+    save_route_frequencies(route_frequency_data, OUTPUT_FILE, args.columnar)
+    if args.day_types:
+        day_type_data = build_day_type_frequencies(routes, trips, stop_times, calendar, calendar_dates)
+        save_day_type_frequencies(day_type_data, os.path.join(os.path.dirname(OUTPUT_FILE), DAY_TYPE_OUTPUT_NAME))
+    print_sample_routes(route_frequency_data)
+
+if __name__ == "__main__":
+    main()
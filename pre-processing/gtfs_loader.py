@@ -0,0 +1,253 @@
+import hashlib
+import importlib.util
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Paths
+GTFS_ZIP_PATH = os.path.join('..', 'GTFS-2025-10-28.zip')
+CACHE_DIR = '.gtfs_cache'
+
+# Bump when the table layout below changes so old caches are not reused
+CACHE_VERSION = 1
+
+# Columns read from each GTFS file. Columns missing from a feed are skipped.
+TABLE_COLUMNS = {
+    'routes': ['route_id', 'route_short_name', 'route_long_name', 'route_color', 'route_text_color'],
+    'trips': ['route_id', 'service_id', 'trip_id', 'shape_id', 'direction_id'],
+    'stop_times': ['trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence'],
+    'stops': ['stop_id', 'stop_code', 'stop_name', 'stop_lat', 'stop_lon'],
+    'shapes': ['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+    'calendar': ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                 'saturday', 'sunday', 'start_date', 'end_date'],
+    'calendar_dates': ['service_id', 'date', 'exception_type'],
+}
+
+# Explicit dtypes. ID columns are categoricals (see ID_COLUMNS); anything not
+# listed here keeps pandas' inferred dtype so the JSON outputs do not change.
+COLUMN_DTYPES = {
+    'stop_sequence': 'int32',
+    'shape_pt_sequence': 'int32',
+    'direction_id': 'Int8',
+    'monday': 'int8', 'tuesday': 'int8', 'wednesday': 'int8', 'thursday': 'int8',
+    'friday': 'int8', 'saturday': 'int8', 'sunday': 'int8',
+    'start_date': 'str', 'end_date': 'str', 'date': 'str',
+    'exception_type': 'int8',
+}
+
+# ID columns stored as categoricals. Each ID shares one set of categories
+# across all loaded tables, so merges on them stay integer joins.
+ID_COLUMNS = ['route_id', 'trip_id', 'stop_id', 'shape_id', 'service_id']
+
+# GTFS time columns, stored as int32 seconds since midnight (-1 when empty)
+TIME_COLUMNS = ['arrival_time', 'departure_time']
+
+def parse_gtfs_times(times):
+    """Parse GTFS HH:MM:SS (or H:MM:SS) strings to int32 seconds since midnight.
+
+    Empty values become -1. Hours past 24 are kept as-is, as in GTFS.
+    """
+    times = pd.Series(times, dtype='str')
+    missing = times.isna().to_numpy()
+    times = times.fillna('00:00:00').str.strip().str.zfill(8)
+
+    if len(times) and times.str.len().max() == 8:
+        # Fixed-width fast path: read the digits straight out of the bytes
+        digits = np.frombuffer(times.to_numpy(dtype='S8').tobytes(), dtype=np.uint8)
+        digits = digits.reshape(-1, 8).astype(np.int32) - ord('0')
+        seconds = ((digits[:, 0] * 10 + digits[:, 1]) * 3600 +
+                   (digits[:, 3] * 10 + digits[:, 4]) * 60 +
+                   digits[:, 6] * 10 + digits[:, 7])
+    else:
+        parts = times.str.split(':', expand=True).astype('int32').to_numpy()
+        seconds = parts[:, 0] * 3600 + parts[:, 1] * 60 + parts[:, 2]
+
+    seconds = seconds.astype(np.int32)
+    seconds[missing] = -1
+    return seconds
+
+def format_gtfs_time(seconds):
+    """Format seconds since midnight as a zero-padded HH:MM:SS string."""
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+def file_hash(path):
+    """Return the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def table_dtypes(columns, categories=None):
+    """read_csv dtypes for the given columns.
+
+    ID columns found in `categories` (column -> Index) get a fixed
+    CategoricalDtype, so codes line up across separately read chunks.
+    """
+    categories = categories or {}
+    dtypes = {col: COLUMN_DTYPES[col] for col in columns if col in COLUMN_DTYPES}
+    for col in columns:
+        if col in ID_COLUMNS:
+            dtypes[col] = pd.CategoricalDtype(categories[col]) if col in categories else 'category'
+        elif col in TIME_COLUMNS:
+            dtypes[col] = 'str'
+    return dtypes
+
+def parse_time_columns(table):
+    """Convert the GTFS time columns of a freshly read table to int32 seconds, in place."""
+    for col in TIME_COLUMNS:
+        if col in table.columns:
+            table[col] = parse_gtfs_times(table[col])
+    return table
+
+def read_table(z, name):
+    """Read one GTFS table from an open zip with only the needed columns and compact dtypes."""
+    wanted = TABLE_COLUMNS[name]
+    with z.open(f'{name}.txt') as f:
+        table = pd.read_csv(f, usecols=lambda col: col in wanted, dtype=table_dtypes(wanted), encoding='utf-8-sig')
+
+    return parse_time_columns(table)
+
+def iter_table_chunks(zip_path, name, chunk_rows, columns=None, categories=None):
+    """Yield a GTFS table from the zip in DataFrames of at most `chunk_rows` rows.
+
+    `chunk_rows` may also be a function, called before each read for the
+    size of the next chunk. Only `columns` (default: TABLE_COLUMNS[name])
+    are read. ID columns must be given fixed `categories` to be read as
+    categoricals; otherwise they are plain strings, since per-chunk
+    categories would not match. Values outside the given categories are
+    read as NaN.
+    """
+    wanted = columns or TABLE_COLUMNS[name]
+    dtypes = table_dtypes(wanted, categories)
+    for col in wanted:
+        if dtypes.get(col) == 'category':
+            dtypes[col] = 'str'
+
+    with zipfile.ZipFile(zip_path) as z:
+        with z.open(f'{name}.txt') as f:
+            reader = pd.read_csv(f, usecols=lambda col: col in wanted, dtype=dtypes,
+                                 encoding='utf-8-sig', iterator=True)
+            while True:
+                try:
+                    chunk = reader.get_chunk(chunk_rows() if callable(chunk_rows) else chunk_rows)
+                except StopIteration:
+                    return
+                yield parse_time_columns(chunk)
+
+def share_categories(tables):
+    """Give every ID column the same categories across all loaded tables."""
+    for col in ID_COLUMNS:
+        columns = [table[col] for table in tables.values() if col in table.columns]
+        if len(columns) < 2:
+            continue
+        categories = columns[0].cat.categories
+        for column in columns[1:]:
+            categories = categories.union(column.cat.categories)
+        for table in tables.values():
+            if col in table.columns:
+                table[col] = table[col].cat.set_categories(categories)
+
+def read_tables(zip_path, names, required):
+    """Parse the given tables out of the GTFS zip.
+
+    Tables in `names` that are not in the zip are skipped, unless they are
+    `required`, in which case None is returned.
+    """
+    tables = {}
+    with zipfile.ZipFile(zip_path) as z:
+        filenames = z.namelist()
+        for name in names:
+            if f'{name}.txt' not in filenames:
+                if name in required:
+                    print(f"Error: {name}.txt not found!")
+                    return None
+                continue
+            tables[name] = read_table(z, name)
+
+    share_categories(tables)
+    return tables
+
+def cache_path(cache_dir, zip_path):
+    """Cache directory for a given zip, keyed by its content hash."""
+    return os.path.join(cache_dir, f"v{CACHE_VERSION}-{file_hash(zip_path)}")
+
+def parquet_engine_available():
+    """Whether pandas can write Parquet (it needs pyarrow or fastparquet)."""
+    return any(importlib.util.find_spec(engine) is not None for engine in ('pyarrow', 'fastparquet'))
+
+def write_cache(path, tables):
+    """Write tables to Parquet files. Skipped (with a warning) when no Parquet engine is installed."""
+    if not parquet_engine_available():
+        print("Warning: could not write GTFS cache (pyarrow is not installed)")
+        return
+    os.makedirs(path, exist_ok=True)
+    for name, table in tables.items():
+        table.to_parquet(os.path.join(path, f'{name}.parquet'), index=False)
+    # Marker written last so a partially written cache is never used
+    with open(os.path.join(path, 'complete'), 'w') as f:
+        f.write(','.join(tables))
+
+def read_cache(path, names, required=()):
+    """Read tables from a complete cache. Returns None if the cache is missing or incomplete."""
+    marker = os.path.join(path, 'complete')
+    if not os.path.exists(marker):
+        return None
+    with open(marker) as f:
+        cached = set(f.read().split(','))
+
+    tables = {}
+    for name in names:
+        if name not in cached:
+            # The cache holds every table of the feed, so an optional table
+            # missing from it is missing from the feed too
+            if name in required:
+                return None
+            continue
+        tables[name] = pd.read_parquet(os.path.join(path, f'{name}.parquet'))
+    return tables
+
+def load_feed(zip_path=GTFS_ZIP_PATH, tables=None, cache_dir=CACHE_DIR, use_cache=True, fill_cache=True,
+              optional=None):
+    """Load GTFS tables as a dict of DataFrames.
+
+    Only the columns in TABLE_COLUMNS are read, IDs are categoricals shared
+    across tables and times are int32 seconds. The first load of a zip parses
+    every table and stores them as Parquet under `cache_dir`, keyed by the
+    zip's SHA-256; later loads of the same zip read the cache instead. With
+    `fill_cache=False`, or without pyarrow to write the cache, an existing
+    cache is still used, but a miss parses only the requested tables (used
+    by the streaming mode to avoid loading stop_times.txt whole).
+
+    Returns None if one of the requested tables is missing from the feed.
+    Tables in `optional` (such as calendar_dates) are loaded when the feed
+    has them and left out of the result otherwise.
+    """
+    names = list(tables) + list(optional or []) if tables else list(TABLE_COLUMNS)
+    required = list(tables) if tables else []
+    print(f"Loading GTFS data from {zip_path}...")
+
+    if not use_cache:
+        return read_tables(zip_path, names, required)
+
+    path = cache_path(cache_dir, zip_path)
+    feed = read_cache(path, names, required)
+    if feed is not None:
+        print(f"Using cached tables from {path}")
+        return feed
+
+    # Without a Parquet engine the cache can't be written, so parsing every
+    # table would only slow this load down
+    if not fill_cache or not parquet_engine_available():
+        return read_tables(zip_path, names, required)
+
+    # Parse everything once so the cache serves every script
+    all_tables = read_tables(zip_path, list(TABLE_COLUMNS), required)
+    if all_tables is None:
+        return None
+
+    write_cache(path, all_tables)
+    return {name: all_tables[name] for name in names if name in all_tables}
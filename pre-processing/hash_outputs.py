@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from compress_outputs import COMPRESSED_EXTENSIONS, HASHED_DIR
+from gtfs_loader import file_hash
+from process_gtfs import SHAPES_DIR
+
+# Paths
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+# Logical name -> content-hashed file, the only output that should be revalidated
+ASSET_MANIFEST_NAME = 'manifest.json'
+# Hex digits of the SHA-256 kept in the file names
+HASH_LENGTH = 16
+MANIFEST_VERSION = 1
+
+def find_assets(output_dir):
+    """Relative paths of every output to hash, largest first.
+
+    Skips the manifest, the hashed copies themselves, .gz/.br siblings
+    (copied along with their file) and shapes/, whose files are already
+    named by their content hash.
+    """
+    paths = []
+    for root, dirs, names in os.walk(output_dir):
+        if root == output_dir:
+            dirs[:] = [name for name in dirs if name not in (HASHED_DIR, SHAPES_DIR)]
+        for name in names:
+            if name.endswith(COMPRESSED_EXTENSIONS) or (root == output_dir and name == ASSET_MANIFEST_NAME):
+                continue
+            paths.append(os.path.relpath(os.path.join(root, name), output_dir))
+    return sorted(paths, key=lambda path: os.path.getsize(os.path.join(output_dir, path)), reverse=True)
+
+def hashed_name(path, digest):
+    """Hashed path of a logical path: Z_4628.json -> hashed/Z_4628.<digest>.json."""
+    base, ext = os.path.splitext(path)
+    return os.path.join(HASHED_DIR, f"{base}.{digest[:HASH_LENGTH]}{ext}").replace(os.sep, '/')
+
+def hash_asset(output_dir, path):
+    """Copy one output (and its .gz/.br siblings) to its content-hashed name. Returns the hashed path.
+
+    Files are copied, not linked: the next build rewrites the logical file
+    in place, and the hashed copy must never change.
+    """
+    source = os.path.join(output_dir, path)
+    target_path = hashed_name(path, file_hash(source))
+    target = os.path.join(output_dir, target_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    for ext in ('', *COMPRESSED_EXTENSIONS):
+        # An existing copy has the same content, so only missing ones are
+        # written. A .gz/.br older than its file is left from an earlier
+        # --compress run and does not match it
+        if not os.path.exists(source + ext) or os.path.exists(target + ext):
+            continue
+        if ext and os.path.getmtime(source + ext) < os.path.getmtime(source):
+            continue
+        shutil.copyfile(source + ext, target + ext)
+    return target_path
+
+def load_asset_manifest(output_dir):
+    """The asset manifest of the previous run, or None if there is none."""
+    path = os.path.join(output_dir, ASSET_MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def remove_stale_assets(output_dir, keep):
+    """Delete hashed files no manifest in `keep` refers to. Returns the number of files removed."""
+    referenced = {path for manifest in keep for path in manifest['files'].values()}
+    removed = 0
+    hashed_dir = os.path.join(output_dir, HASHED_DIR)
+    for root, _, names in os.walk(hashed_dir):
+        for name in names:
+            base, ext = os.path.splitext(name)
+            if ext not in COMPRESSED_EXTENSIONS:
+                base = name
+            relative = os.path.relpath(os.path.join(root, base), output_dir).replace(os.sep, '/')
+            if relative not in referenced:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+def hash_outputs(output_dir=OUTPUT_DIR, workers=None):
+    """Copy every output to a content-hashed name under hashed/ and write manifest.json, in parallel.
+
+    The manifest maps each logical path (relative to output_dir, e.g.
+    'Z_4628.json' or 'search/p_ca.json') to its hashed copy. Hashed files
+    can be cached forever; only manifest.json changes between builds. The
+    files of the previous manifest are kept, so clients still holding it
+    keep working; older ones are deleted.
+    """
+    previous = load_asset_manifest(output_dir)
+    paths = find_assets(output_dir)
+    print(f"Hashing {len(paths)} files...")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        hashed = list(pool.map(hash_asset, [output_dir] * len(paths), paths, chunksize=16))
+
+    manifest = {'version': MANIFEST_VERSION,
+                'files': {path.replace(os.sep, '/'): target for path, target in sorted(zip(paths, hashed))}}
+    with open(os.path.join(output_dir, ASSET_MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+
+    keep = [manifest] if previous is None else [manifest, previous]
+    removed = remove_stale_assets(output_dir, keep)
+    changed = len(manifest['files']) if previous is None else sum(
+        1 for path, target in manifest['files'].items() if previous['files'].get(path) != target)
+    manifest_size = os.path.getsize(os.path.join(output_dir, ASSET_MANIFEST_NAME))
+    print(f"Saved {ASSET_MANIFEST_NAME} ({manifest_size / 1024:.0f} KB): {changed} of {len(manifest['files'])} "
+          f"files changed, {removed} stale hashed files removed")
+    return {'files': len(manifest['files']), 'changed': changed, 'removed': removed}
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy the outputs to content-hashed names and write manifest.json")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with the generated files (default: {OUTPUT_DIR})")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: one per core)")
+    args = parser.parse_args()
+
+    hash_outputs(args.output_dir, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import format_gtfs_time
+
+# Hours covered by the hourly profile (4 AM to midnight)
+PROFILE_START_HOUR = 4
+PROFILE_END_HOUR = 24
+
+def get_weekday_services(calendar):
+    """Return the service_ids that run every day Monday-Friday."""
+    return calendar[
+        (calendar['monday'] == 1) &
+        (calendar['tuesday'] == 1) &
+        (calendar['wednesday'] == 1) &
+        (calendar['thursday'] == 1) &
+        (calendar['friday'] == 1)
+    ]['service_id'].unique()
+
+def seconds_to_minutes(seconds):
+    """Convert seconds since midnight to minutes (float array), computed as HH*60 + MM + SS/60."""
+    seconds = np.asarray(seconds, dtype=np.int64)
+    return seconds // 60 + (seconds % 60) / 60
+
+def first_stop_departures(stop_times):
+    """Departures at the first stop (stop_sequence == 1) of each trip, skipping empty times.
+
+    The result is itself a valid (reduced) stop_times table for
+    calculate_all_route_headways.
+    """
+    return stop_times.loc[
+        (stop_times['stop_sequence'] == 1) & (stop_times['departure_time'] >= 0),
+        ['trip_id', 'departure_time', 'stop_sequence']
+    ]
+
+def grouped_headways(group_codes, n_groups, departure_seconds):
+    """Headway arrays for many groups of departures, sorted once.
+
+    `group_codes` (0..n_groups-1) says which group (route, stop-route pair,
+    ...) each departure belongs to. Departures are sorted once by (group,
+    time); headways are the positive gaps between consecutive departures of
+    the same group. Sums are taken with np.bincount, which adds values in
+    order, so they match a per-group sum() over the sorted headways exactly.
+
+    Returns a dict of arrays: per group num_trips, first/last_departure
+    (seconds) and headway_count/sum/min/max; per (group, profile hour) slot
+    hour_trips and hour_headway_count/sum.
+    """
+    minutes = seconds_to_minutes(departure_seconds)
+
+    # Sort once by group, then by departure time (lexsort is stable)
+    order = np.lexsort((minutes, group_codes))
+    group_codes = np.asarray(group_codes)[order]
+    minutes = minutes[order]
+    departure_seconds = np.asarray(departure_seconds)[order]
+
+    num_trips = np.bincount(group_codes, minlength=n_groups)
+    ends = np.cumsum(num_trips)
+    starts = ends - num_trips
+    has_trips = num_trips > 0
+
+    # Headways between consecutive departures of the same group,
+    # dropping 0-minute headways (overlapping service patterns)
+    headways = np.diff(minutes)
+    same_group = group_codes[1:] == group_codes[:-1]
+    valid = same_group & (headways > 0)
+    valid_groups = group_codes[1:][valid]
+    valid_headways = headways[valid]
+
+    headway_min = np.full(n_groups, np.inf)
+    np.minimum.at(headway_min, valid_groups, valid_headways)
+    headway_max = np.full(n_groups, -np.inf)
+    np.maximum.at(headway_max, valid_groups, valid_headways)
+
+    # Hourly profile: the same computation keyed by (group, hour)
+    n_hours = PROFILE_END_HOUR - PROFILE_START_HOUR
+    hours = (minutes // 60).astype('int64')
+    in_profile = (hours >= PROFILE_START_HOUR) & (hours < PROFILE_END_HOUR)
+    slots = group_codes * n_hours + (hours - PROFILE_START_HOUR)
+    same_slot = valid & in_profile[1:] & (hours[1:] == hours[:-1])
+    slot_ids = slots[1:][same_slot]
+
+    first_departure = np.full(n_groups, -1, dtype=np.int64)
+    first_departure[has_trips] = departure_seconds[starts[has_trips]]
+    last_departure = np.full(n_groups, -1, dtype=np.int64)
+    last_departure[has_trips] = departure_seconds[ends[has_trips] - 1]
+
+    return {
+        'num_trips': num_trips,
+        'first_departure': first_departure,
+        'last_departure': last_departure,
+        'headway_count': np.bincount(valid_groups, minlength=n_groups),
+        'headway_sum': np.bincount(valid_groups, weights=valid_headways, minlength=n_groups),
+        'headway_min': headway_min,
+        'headway_max': headway_max,
+        'hour_trips': np.bincount(slots[in_profile], minlength=n_groups * n_hours).reshape(n_groups, n_hours),
+        'hour_headway_count': np.bincount(slot_ids, minlength=n_groups * n_hours).reshape(n_groups, n_hours),
+        'hour_headway_sum': np.bincount(slot_ids, weights=headways[same_slot],
+                                        minlength=n_groups * n_hours).reshape(n_groups, n_hours),
+    }
+
+def calculate_all_route_headways(trips, stop_times, service_ids):
+    """Calculate headway statistics for every route in one grouped pass.
+
+    `stop_times` times are int32 seconds, as returned by gtfs_loader.load_feed.
+    It may also be just the first-stop rows (see stop_times_stream).
+    Departures at the first stop (stop_sequence == 1) of the trips running on
+    `service_ids` go through grouped_headways, keyed by route.
+
+    Returns a dict route_id -> stats. Routes with fewer than two departures or
+    no positive headway are left out.
+    """
+    return calculate_profile_route_headways(trips, stop_times, {None: service_ids})[None]
+
+def calculate_profile_route_headways(trips, stop_times, profiles):
+    """calculate_all_route_headways for several service profiles in the same grouped pass.
+
+    `profiles` maps a profile name (e.g. a day type) to its service_ids. A
+    trip's departures are repeated once for each profile its service belongs
+    to, and grouped_headways runs once over (profile, route) groups.
+
+    Returns a dict profile -> {route_id -> stats}.
+    """
+    service_trips = pd.concat([
+        trips.loc[trips['service_id'].isin(service_ids), ['trip_id', 'route_id']].drop_duplicates().assign(profile=i)
+        for i, service_ids in enumerate(profiles.values())
+    ])
+    first_stops = first_stop_departures(stop_times)[['trip_id', 'departure_time']]
+    # The merge keeps the order of first_stops within every profile
+    first_stops = pd.merge(first_stops, service_trips, on='trip_id').dropna(subset=['route_id'])
+
+    results = {name: {} for name in profiles}
+    if len(first_stops) == 0:
+        return results
+
+    route_codes, route_ids = pd.factorize(first_stops['route_id'])
+    n_routes = len(route_ids)
+    groups = first_stops['profile'].to_numpy() * n_routes + route_codes
+    stats_arrays = grouped_headways(groups, len(profiles) * n_routes, first_stops['departure_time'].to_numpy())
+
+    # Routes of each profile in order of first departure row, as a
+    # single-profile factorize would list them
+    first_rows = np.full(len(profiles) * n_routes, len(groups))
+    np.minimum.at(first_rows, groups, np.arange(len(groups)))
+
+    # Averages and rounding are done on float64 arrays: the old per-route
+    # script rounded NumPy scalars, so np.round semantics must be kept
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_headway = np.round(stats_arrays['headway_sum'] / stats_arrays['headway_count'], 1)
+        hour_avg_headway = stats_arrays['hour_headway_sum'] / stats_arrays['hour_headway_count']
+        hour_buses_per_hour = np.round(60 / hour_avg_headway, 1)
+    hour_avg_headway = np.round(hour_avg_headway, 1)
+
+    # Back to Python scalars so the JSON output matches the old script exactly
+    num_trips = stats_arrays['num_trips'].tolist()
+    first_departure = stats_arrays['first_departure'].tolist()
+    last_departure = stats_arrays['last_departure'].tolist()
+    headway_count = stats_arrays['headway_count'].tolist()
+    avg_headway = avg_headway.tolist()
+    headway_min = np.round(stats_arrays['headway_min'], 1).tolist()
+    headway_max = np.round(stats_arrays['headway_max'], 1).tolist()
+    hour_trips = stats_arrays['hour_trips'].tolist()
+    hour_headway_count = stats_arrays['hour_headway_count'].tolist()
+    hour_avg_headway = hour_avg_headway.tolist()
+    hour_buses_per_hour = hour_buses_per_hour.tolist()
+
+    n_hours = PROFILE_END_HOUR - PROFILE_START_HOUR
+    for profile, name in enumerate(profiles):
+        profile_groups = np.arange(profile * n_routes, (profile + 1) * n_routes)
+        profile_groups = profile_groups[np.argsort(first_rows[profile_groups], kind='stable')]
+        for code in profile_groups.tolist():
+            if num_trips[code] < 2 or headway_count[code] == 0:
+                continue
+
+            stats = {
+                'num_trips': num_trips[code],
+                'first_departure': format_gtfs_time(first_departure[code]),
+                'last_departure': format_gtfs_time(last_departure[code]),
+                'avg_headway_minutes': avg_headway[code],
+                'min_headway_minutes': headway_min[code],
+                'max_headway_minutes': headway_max[code]
+            }
+
+            hourly_profile = []
+            for i in range(n_hours):
+                if hour_headway_count[code][i] > 0:
+                    hourly_profile.append({
+                        'hour': PROFILE_START_HOUR + i,
+                        'trips': hour_trips[code][i],
+                        'avg_headway_minutes': hour_avg_headway[code][i],
+                        'buses_per_hour': hour_buses_per_hour[code][i]
+                    })
+                else:
+                    # No trips, a single trip or only zero headways in this hour
+                    hourly_profile.append({
+                        'hour': PROFILE_START_HOUR + i,
+                        'trips': hour_trips[code][i],
+                        'avg_headway_minutes': 0,
+                        'buses_per_hour': 0
+                    })
+
+            stats['hourly_profile'] = hourly_profile
+            results[name][route_ids[code % n_routes]] = stats
+
+    return results
@@ -0,0 +1,270 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from extract_all_headways import build_route_frequencies, save_route_frequencies
+from process_gtfs import (SHAPES_DIR, build_route_features, indexed_route_ids, route_filename, save_all_routes,
+                          save_route_files, save_route_index)
+from simplify import SIMPLIFICATION_REPORT, save_simplification_report, simplify_route_features
+from process_stops import build_stops_with_routes, save_stop_outputs
+from stop_times_stream import stop_route_pairs
+
+# Manifest of input fingerprints from the last build, relative to pre-processing/
+MANIFEST_PATH = 'build_manifest.json'
+
+# Bump when the outputs change format so the next run rebuilds everything
+MANIFEST_VERSION = 1
+
+# Aggregate outputs an incremental build patches instead of regenerating
+AGGREGATE_OUTPUTS = ['routes_index.json', 'all_routes.geojson', 'route_frequencies.json', 'stops_with_routes.json']
+
+def row_hashes(table):
+    """64-bit hash of every row, based on values (not category codes)."""
+    return pd.util.hash_pandas_object(table, index=False).to_numpy()
+
+def category_codes(values, categories):
+    """Codes of `values` in `categories` (-1 when missing)."""
+    return np.asarray(pd.Categorical(values, categories=categories).codes, dtype=np.int64)
+
+def sum_by(codes, hashes, size):
+    """Order-independent combination of row hashes per group (wrapping uint64 sum)."""
+    keep = codes >= 0
+    totals = np.zeros(size, dtype=np.uint64)
+    np.add.at(totals, codes[keep], hashes[keep])
+    return totals
+
+def route_fingerprints(routes, trips, shapes, stop_times):
+    """Fingerprint of every route's inputs: its routes.txt row, trips, shapes and stop_times.
+
+    Rows are hashed with pandas and summed per route, so the whole feed is
+    fingerprinted in a few vectorized passes. Returns {route_id: hex digest}.
+    """
+    route_ids = routes['route_id'].astype('category').cat.categories
+    route_ids = route_ids.union(trips['route_id'].astype('category').cat.categories)
+    n_routes = len(route_ids)
+
+    route_part = sum_by(category_codes(routes['route_id'], route_ids), row_hashes(routes), n_routes)
+
+    trip_route_codes = category_codes(trips['route_id'], route_ids)
+    trips_part = sum_by(trip_route_codes, row_hashes(trips), n_routes)
+
+    # Shapes: hash each shape once, then add it to every route that uses it
+    shape_ids = shapes['shape_id'].astype('category').cat.categories
+    shape_hashes = sum_by(category_codes(shapes['shape_id'], shape_ids), row_hashes(shapes), len(shape_ids))
+    route_shapes = trips[['route_id', 'shape_id']].drop_duplicates()
+    shape_codes = category_codes(route_shapes['shape_id'], shape_ids)
+    pair_hashes = np.where(shape_codes >= 0, shape_hashes[np.maximum(shape_codes, 0)], np.uint64(0))
+    shapes_part = sum_by(category_codes(route_shapes['route_id'], route_ids), pair_hashes, n_routes)
+
+    # stop_times: map each row to its trip's route
+    trip_ids = trips['trip_id'].astype('category').cat.categories
+    trip_route = np.full(len(trip_ids), -1, dtype=np.int64)
+    trip_route[category_codes(trips['trip_id'], trip_ids)] = trip_route_codes
+    stop_time_trips = category_codes(stop_times['trip_id'], trip_ids)
+    stop_time_routes = np.where(stop_time_trips >= 0, trip_route[np.maximum(stop_time_trips, 0)], -1)
+    stop_times_part = sum_by(stop_time_routes, row_hashes(stop_times), n_routes)
+
+    parts = np.stack([route_part, trips_part, shapes_part, stop_times_part], axis=1)
+    present = set(routes['route_id'].dropna().astype(str))
+    return {
+        str(route_id): hashlib.sha256(parts[code].tobytes()).hexdigest()[:16]
+        for code, route_id in enumerate(route_ids)
+        if route_id in present
+    }
+
+def stop_fingerprints(stops):
+    """Fingerprint of every stops.txt row. Returns {stop_id: hex digest}."""
+    hashes = row_hashes(stops)
+    return {str(stop_id): f"{h:016x}" for stop_id, h in zip(stops['stop_id'], hashes.tolist())}
+
+def table_fingerprint(*tables):
+    """Fingerprint of whole tables (used for calendar inputs that affect every route)."""
+    digest = hashlib.sha256()
+    for table in tables:
+        digest.update(np.sort(row_hashes(table)).tobytes())
+    return digest.hexdigest()[:16]
+
+def build_manifest(feed, output_dir, settings=None):
+    """Fingerprint the loaded feed for the manifest written after a build.
+
+    `settings` are the build options that change the outputs; a build with
+    different settings can't reuse the previous outputs.
+    """
+    return {
+        'version': MANIFEST_VERSION,
+        'output_dir': os.path.normpath(output_dir),
+        'settings': settings or {},
+        'calendar': table_fingerprint(*[feed[name] for name in ('calendar', 'calendar_dates') if name in feed]),
+        'routes': route_fingerprints(feed['routes'], feed['trips'], feed['shapes'], feed['stop_times']),
+        'stops': stop_fingerprints(feed['stops']),
+    }
+
+def load_manifest(path):
+    """Load the previous build manifest, or None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, path):
+    """Save the build manifest."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def can_build_incrementally(old, new):
+    """True when `old` describes the outputs currently in new['output_dir']."""
+    if old is None or old.get('version') != MANIFEST_VERSION:
+        return False
+    if old.get('output_dir') != new['output_dir'] or old.get('settings', {}) != new['settings']:
+        return False
+    return all(os.path.exists(os.path.join(new['output_dir'], name)) for name in AGGREGATE_OUTPUTS)
+
+def diff_manifests(old, new):
+    """Compare two manifests. Returns a dict of changed/removed routes and stops."""
+    old_routes, new_routes = old['routes'], new['routes']
+    old_stops, new_stops = old['stops'], new['stops']
+    return {
+        'changed_routes': {r for r, fp in new_routes.items() if old_routes.get(r) != fp},
+        'removed_routes': set(old_routes) - set(new_routes),
+        'changed_stops': ({s for s, fp in new_stops.items() if old_stops.get(s) != fp} |
+                          (set(old_stops) - set(new_stops))),
+        'calendar_changed': old['calendar'] != new['calendar'],
+    }
+
+def update_simplification_report(report, replaced_routes, path=SIMPLIFICATION_REPORT):
+    """Replace the entries of rebuilt and removed routes in the saved simplification report."""
+    old_report = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            old_report = json.load(f)
+
+    merged = {route_id: stats for route_id, stats in old_report.items() if route_id not in replaced_routes}
+    merged.update(report)
+    save_simplification_report(dict(sorted(merged.items())), path)
+
+def prune_shape_store(output_dir, route_ids):
+    """Delete the shape store files no route file of `route_ids` references. Returns how many were deleted."""
+    referenced = set()
+    for route_id in route_ids:
+        path = os.path.join(output_dir, route_filename(route_id))
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                features = json.load(f)['features']
+            referenced.update(feature['properties'].get('geometry_ref') for feature in features)
+
+    shapes_dir = os.path.join(output_dir, SHAPES_DIR)
+    unreferenced = [name for name in os.listdir(shapes_dir) if name[:-len('.json')] not in referenced]
+    for name in unreferenced:
+        os.remove(os.path.join(shapes_dir, name))
+    return len(unreferenced)
+
+def update_route_files(routes, trips, shapes, output_dir, changed_routes, removed_routes,
+                       tolerance_m=0, precision=None, dedupe_shapes=False, workers=None):
+    """Rewrite the GeoJSON files of changed routes, delete removed ones and patch the aggregates.
+
+    The route files are written by `workers` processes (see
+    process_gtfs.save_route_files).
+    """
+    new_index, new_features = [], {}
+    if changed_routes:
+        changed = list(changed_routes)
+        routes = routes[routes['route_id'].isin(changed)]
+        trips = trips[trips['route_id'].isin(changed)]
+        shapes = shapes[shapes['shape_id'].isin(trips['shape_id'].dropna().unique())]
+        new_index, new_features = build_route_features(routes, trips, shapes)
+
+    if tolerance_m or precision is not None:
+        new_features, report = simplify_route_features(new_features, tolerance_m, precision)
+        update_simplification_report(report, set(changed_routes) | set(removed_routes))
+
+    # Shapes of other routes stay in the store until the prune below, so a
+    # shared geometry is never lost
+    new_feature_jsons = save_route_files(new_features, output_dir, workers, dedupe_shapes)
+
+    # Changed routes that lost all their shapes no longer get a file
+    stale = set(removed_routes) | (set(changed_routes) - set(new_features))
+    for route_id in stale:
+        path = os.path.join(output_dir, route_filename(route_id))
+        if os.path.exists(path):
+            os.remove(path)
+
+    with open(os.path.join(output_dir, 'routes_index.json'), encoding='utf-8') as f:
+        old_index = json.load(f)
+    with open(os.path.join(output_dir, 'all_routes.geojson'), encoding='utf-8') as f:
+        old_features = json.load(f)['features']
+
+    replaced = set(changed_routes) | set(removed_routes)
+    index = {meta['route_id']: meta for meta in old_index if meta['route_id'] not in replaced}
+    index.update({meta['route_id']: meta for meta in new_index})
+
+    # Reloaded features serialize back to the same text they were read from
+    features_by_route = {}
+    for feature in old_features:
+        features_by_route.setdefault(feature['properties']['route_id'], []).append(json.dumps(feature))
+    features_by_route.update(new_feature_jsons)
+
+    route_index = [index[route_id] for route_id in sorted(index)]
+    route_feature_jsons = {meta['route_id']: features_by_route.get(meta['route_id'], []) for meta in route_index}
+
+    save_route_index(route_index, output_dir)
+    feature_count = save_all_routes(route_feature_jsons, output_dir)
+
+    print(f"Rewrote {len(new_features)} route files, removed {len(stale)}")
+    if dedupe_shapes:
+        # Changed and removed routes can leave geometries nothing references any more
+        pruned = prune_shape_store(output_dir, index)
+        print(f"Pruned {pruned} unreferenced shapes from {SHAPES_DIR}/")
+    print(f"Saved all_routes.geojson with {feature_count} features")
+
+def update_route_frequencies(routes, trips, stop_times, calendar, output_file, changed_routes, columnar=False):
+    """Recompute route_frequencies.json entries of changed routes and reuse the others."""
+    new_data = {}
+    if changed_routes:
+        changed = list(changed_routes)
+        new_data = build_route_frequencies(routes[routes['route_id'].isin(changed)],
+                                           trips[trips['route_id'].isin(changed)],
+                                           stop_times, calendar)
+
+    with open(output_file, encoding='utf-8') as f:
+        old_data = json.load(f)
+
+    # Same order as a full build: routes.txt order
+    route_frequency_data = {}
+    for route_id in routes['route_id'].astype(str):
+        source = new_data if route_id in changed_routes else old_data
+        if route_id in source:
+            route_frequency_data[route_id] = source[route_id]
+
+    save_route_frequencies(route_frequency_data, output_file, columnar)
+
+def update_stop_outputs(stops, stop_times, trips, routes, shape_ids, output_dir,
+                        changed_routes, removed_routes, changed_stops):
+    """Rebuild the stop entries touched by changed routes or stops and reuse the others."""
+    with open(os.path.join(output_dir, 'stops_with_routes.json'), encoding='utf-8') as f:
+        old_stops = json.load(f)
+
+    # Stops whose entry can change: changed stop rows, stops that listed a
+    # changed or removed route, and stops the changed routes serve now
+    replaced = set(changed_routes) | set(removed_routes)
+    affected = set(changed_stops)
+    affected.update(stop['stop_id'] for stop in old_stops
+                    if any(route['route_id'] in replaced for route in stop['routes']))
+    changed_trips = trips.loc[trips['route_id'].isin(list(changed_routes)), 'trip_id']
+    served = stop_times.loc[stop_times['trip_id'].isin(changed_trips), 'stop_id']
+    affected.update(served.dropna().astype(str).unique())
+
+    # Restricting stop_times to the affected stops keeps the file order,
+    # so the rebuilt entries match a full build
+    affected_list = list(affected)
+    stop_routes = stop_route_pairs(stop_times[stop_times['stop_id'].isin(affected_list)], trips)
+    rebuilt = build_stops_with_routes(stops[stops['stop_id'].isin(affected_list)], stop_routes, routes)
+
+    stops_with_routes = [stop for stop in old_stops if stop['stop_id'] not in affected] + rebuilt
+    stops_with_routes.sort(key=lambda x: x['stop_id'])
+
+    print(f"Rebuilt {len(rebuilt)} of {len(stops_with_routes)} stop entries")
+    # stops_encoded.json is rewritten whole: route indexes shift when routes_index.json changes
+    save_stop_outputs(stops_with_routes, output_dir, indexed_route_ids=indexed_route_ids(routes, trips, shape_ids))
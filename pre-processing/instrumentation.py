@@ -0,0 +1,231 @@
+import cProfile
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows (the pixi platform); psutil reports memory and I/O there
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Report of the last pipeline run, relative to pre-processing/
+RUN_REPORT = 'run_report.json'
+# cProfile dumps of the stages (one <stage>.prof each) with --profile
+PROFILE_DIR = 'profiles'
+# How often ProcessSampler polls memory, CPU time and I/O
+SAMPLE_INTERVAL_S = 0.1
+
+def read_proc_file(name):
+    """'key: value' lines of a /proc/self file as a dict, or None off Linux."""
+    try:
+        with open(f'/proc/self/{name}', encoding='ascii') as f:
+            return dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+
+def reset_peak_rss():
+    """Restart the peak RSS measurement of this process where the OS allows it (Linux).
+
+    Pool workers are forked from the pipeline process and may run several
+    stages, so without a reset their peak would include the parent's and
+    earlier stages' memory. Returns True if the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (since the last reset_peak_rss), or None if unknown.
+
+    Only Linux can reset the peak; elsewhere this is the peak of the whole
+    process, and measure samples the RSS instead (see ProcessSampler).
+    """
+    status = read_proc_file('status')
+    if status and 'VmHWM' in status:
+        return int(status['VmHWM'].split()[0]) / 1024
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere
+        return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 ** 2
+    return None
+
+def cpu_seconds():
+    """CPU time of this process and its finished children (the stages' worker pools).
+
+    Windows reports no CPU time of children, so measure uses a
+    ProcessSampler there instead.
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+def bytes_written():
+    """Bytes this process has written so far (console output included), or None.
+
+    On Linux this includes its finished children; psutil (Windows, macOS)
+    counts the process alone, so measure uses a ProcessSampler there.
+    """
+    io = read_proc_file('io')
+    if io and 'wchar' in io:
+        return int(io['wchar'])
+    if psutil is not None:
+        try:
+            return psutil.Process().io_counters().write_bytes
+        except (AttributeError, psutil.Error):
+            return None
+    return None
+
+class ProcessSampler:
+    """Polls this process and its children with psutil while a stage runs, where /proc is missing.
+
+    Off Linux the peak RSS cannot be reset, so a reused pool worker would
+    report the peak of earlier stages, and the CPU time and bytes written of
+    the stages' own worker pools are not reported to the parent (Windows
+    reports no child CPU time at all). A thread therefore samples the RSS of
+    this process every SAMPLE_INTERVAL_S, and the CPU time and bytes written
+    of this process and every child. Children running before the stage count
+    from their first sample. Samples are approximate: a memory spike shorter
+    than the interval, or a child's last interval of work before it exits,
+    is missed.
+    """
+
+    def __init__(self):
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        # pid -> (cpu seconds, bytes written or None) at the first and last sample
+        self.first = {}
+        self.last = {}
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        """Record the RSS of this process and the counters of it and its children."""
+        try:
+            self.peak_rss = max(self.peak_rss, self.process.memory_info().rss)
+            processes = [self.process, *self.process.children(recursive=True)]
+        except psutil.Error:
+            return
+        for process in processes:
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    io = process.io_counters() if hasattr(process, 'io_counters') else None
+            except psutil.Error:
+                continue
+            counters = (times.user + times.system, io.write_bytes if io is not None else None)
+            self.first.setdefault(process.pid, counters)
+            self.last[process.pid] = counters
+
+    def run(self):
+        while not self.done.wait(SAMPLE_INTERVAL_S):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        self.sample()
+
+    def cpu_seconds(self):
+        """CPU time this process and its children used while sampled."""
+        return sum(self.last[pid][0] - self.first[pid][0] for pid in self.last)
+
+    def bytes_written(self):
+        """Bytes this process and its children wrote while sampled, or None if psutil cannot tell."""
+        if any(self.last[pid][1] is None for pid in self.last):
+            return None
+        return sum(self.last[pid][1] - self.first[pid][1] for pid in self.last)
+
+def input_rows(function, args, kwargs):
+    """Rows of every DataFrame argument, by parameter name."""
+    try:
+        bound = inspect.signature(function).bind_partial(*args, **kwargs).arguments
+    except TypeError:
+        bound = {**{f"arg{i}": arg for i, arg in enumerate(args)}, **kwargs}
+    return {name: len(value) for name, value in bound.items() if isinstance(value, pd.DataFrame)}
+
+def measure(function, args=(), profile_path=None, kwargs=None):
+    """Run function(*args, **kwargs) and measure it. Returns (result, metrics).
+
+    Metrics are wall and CPU time, peak RSS, bytes written, the rows of the
+    DataFrame arguments and, when the function returns a dict of counts
+    (as the pipeline stages do), the output rows. CPU time and bytes
+    written include the worker processes the function starts. On Linux
+    they come from /proc and os.times; elsewhere a ProcessSampler polls
+    them with psutil, and without psutil the children and the peak RSS are
+    not measured. With `profile_path`, the call runs under cProfile and the
+    stats are dumped there.
+    """
+    kwargs = kwargs or {}
+    reset_peak_rss()
+    sampler = ProcessSampler().start() if read_proc_file('io') is None and psutil is not None else None
+    start_bytes = bytes_written()
+    start_wall, start_cpu = time.perf_counter(), cpu_seconds()
+
+    if profile_path:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(function, *args, **kwargs)
+        profiler.dump_stats(profile_path)
+    else:
+        result = function(*args, **kwargs)
+
+    end_bytes = bytes_written()
+    cpu_s = cpu_seconds() - start_cpu
+    written = end_bytes - start_bytes if start_bytes is not None and end_bytes is not None else None
+    peak = peak_rss_mb()
+    if sampler is not None:
+        sampler.stop()
+        cpu_s, written, peak = sampler.cpu_seconds(), sampler.bytes_written(), sampler.peak_rss / 1024 ** 2
+    metrics = {
+        'wall_s': round(time.perf_counter() - start_wall, 4),
+        'cpu_s': round(cpu_s, 4),
+        'peak_rss_mb': peak,
+        'bytes_written': written,
+        'input_rows': input_rows(function, args, kwargs),
+    }
+    if isinstance(result, dict) and result and all(isinstance(value, int) for value in result.values()):
+        metrics['output_rows'] = result
+    if profile_path:
+        metrics['profile'] = profile_path
+    return result, metrics
+
+def stage_profile_path(profile_dir, stage):
+    """Where the cProfile dump of a stage goes, or None when profiling is off."""
+    if profile_dir is None:
+        return None
+    os.makedirs(profile_dir, exist_ok=True)
+    return os.path.join(profile_dir, f"{stage}.prof")
+
+def format_metrics(metrics):
+    """One-line summary of a stage's metrics for the progress output."""
+    line = f"{metrics['wall_s']:.2f} s (cpu {metrics['cpu_s']:.2f} s"
+    if metrics['peak_rss_mb'] is not None:
+        line += f", peak {metrics['peak_rss_mb']:.0f} MB"
+    if metrics['bytes_written']:
+        line += f", wrote {metrics['bytes_written'] / 1024 ** 2:.1f} MB"
+    return line + ")"
+
+def save_run_report(report, path=RUN_REPORT):
+    """Save a run report (see pipeline.run_pipeline)."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
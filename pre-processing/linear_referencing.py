@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from process_gtfs import shape_offsets
+from simplify import EARTH_RADIUS_M, project_to_metres
+from trip_patterns import extract_trip_patterns
+
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+OUTPUT_NAME = 'shape_stops.json'
+# Stops snapped farther than this from their shape are counted as suspicious
+FAR_STOP_M = 50
+# Decimals of the snapped stop coordinates (about 0.1 m)
+POINT_PRECISION = 6
+
+def shape_pattern_stops(patterns, trips):
+    """Stop visits of every (shape, trip pattern) pair a trip uses, in the pattern's stop order.
+
+    A stop a pattern serves twice (loops, out-and-back routes) is two
+    visits. Returns a DataFrame with shape_id, pattern, route_id, position
+    (in the pattern's stop list) and stop_id, sorted by shape_id, pattern
+    and position.
+    """
+    trip_patterns = pd.DataFrame({
+        'trip_id': np.asarray(patterns['trip_ids']).astype(str)[patterns['trip_codes']],
+        'pattern': patterns['trip_patterns'],
+    })
+    trip_shapes = trips[['trip_id', 'shape_id']].dropna().astype(str)
+    pattern_shapes = pd.merge(trip_patterns, trip_shapes, on='trip_id')[['pattern', 'shape_id']].drop_duplicates()
+
+    offsets = np.asarray(patterns['pattern_stop_offsets'])
+    lengths = np.diff(offsets)
+    pattern_stops = pd.DataFrame({'pattern': np.repeat(np.arange(len(lengths)), lengths),
+                                  'position': np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths),
+                                  'stop_id': np.asarray(patterns['stop_ids']).astype(str)[patterns['pattern_stops']]})
+    visits = pd.merge(pattern_shapes, pattern_stops, on='pattern')
+    route_ids = np.asarray(patterns['route_ids']).astype(str)
+    visits['route_id'] = route_ids[np.asarray(patterns['pattern_routes'])[visits['pattern'].to_numpy()]]
+    visits = visits.sort_values(['shape_id', 'pattern', 'position'], kind='stable').reset_index(drop=True)
+    return visits[['shape_id', 'pattern', 'route_id', 'position', 'stop_id']]
+
+def ordered_locations(line_xy, points_xy):
+    """Locate points along a line in their order: distances never decrease and the total snapping error is least.
+
+    The candidates of a point are its projection on every segment and every
+    segment's end (so the line's end is always reachable), which are
+    already sorted by distance along the line. A dynamic programme keeps,
+    per candidate, the cheapest sequence of earlier points at or before it.
+
+    Returns (distances, errors, segment indices, snapped x/y) of the points.
+    """
+    starts, vectors = line_xy[:-1], np.diff(line_xy, axis=0)
+    squared = (vectors ** 2).sum(axis=1)
+    segment_lengths = np.sqrt(squared)
+    cumulative = np.r_[0, np.cumsum(segment_lengths)][:-1]
+
+    offsets = points_xy[:, None, :] - starts[None, :, :]
+    t = np.divide((offsets * vectors).sum(axis=2), squared, out=np.zeros(offsets.shape[:2]), where=squared > 0)
+    # Columns: projection on segment 0, end of segment 0, projection on segment 1, ...
+    t = np.stack([np.clip(t, 0, 1), np.ones_like(t)], axis=2).reshape(len(points_xy), -1)
+    segments = np.arange(t.shape[1]) // 2
+    snapped = starts[segments] + t[..., None] * vectors[segments]
+    distances = cumulative[segments] + t * segment_lengths[segments]
+    errors = np.hypot(*(points_xy[:, None, :] - snapped).transpose(2, 0, 1))
+
+    cost = errors[0]
+    choices = np.zeros(t.shape, dtype=np.int64)
+    candidates = np.arange(t.shape[1])
+    for i in range(1, len(points_xy)):
+        best = np.minimum.accumulate(cost)
+        best_at = np.maximum.accumulate(np.where(cost == best, candidates, 0))
+        previous = np.searchsorted(distances[i - 1], distances[i], side='right') - 1
+        reachable = previous >= 0
+        cost = errors[i] + np.where(reachable, best[np.maximum(previous, 0)], np.inf)
+        choices[i] = best_at[np.maximum(previous, 0)]
+
+    picks = np.empty(len(points_xy), dtype=np.int64)
+    picks[-1] = np.argmin(cost)
+    for i in range(len(points_xy) - 1, 0, -1):
+        picks[i - 1] = choices[i, picks[i]]
+    rows = np.arange(len(points_xy))
+    return distances[rows, picks], errors[rows, picks], segments[picks], snapped[rows, picks]
+
+def locate_stops(shapes, trips, stops, patterns):
+    """Snap every stop visit of every (shape, pattern) pair to its distance along the shape.
+
+    Shapes and stops are projected to local metres around the network's
+    mean latitude; all shapes become one LineString array and all visits one
+    Point array, so line_locate_point and distance each run once. Where
+    those nearest points go backwards along a pattern (a stop near another
+    leg of a loop or out-and-back shape), the pattern's visits are located
+    again with ordered_locations, so distances follow the stop order.
+
+    Returns a DataFrame of the visits (shape_id, pattern, route_id,
+    position, stop_id, distance_m, error_m from stop to shape, vertex, the
+    index of the shape point starting the segment the stop falls on, and
+    the snapped lon/lat), a DataFrame of shape lengths and the number of
+    (shape, pattern) pairs located again.
+    """
+    coords, offsets = shape_offsets(shapes)
+    offsets = offsets[offsets['end'] - offsets['start'] >= 2].reset_index(drop=True)
+    shape_ids = offsets['shape_id'].astype(str).to_numpy()
+    starts, ends = offsets['start'].to_numpy(), offsets['end'].to_numpy()
+
+    ref_lat = float(coords[:, 1].mean()) if len(coords) else 0.0
+    lengths = ends - starts
+    rows = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(lengths.sum())
+    xy = project_to_metres(coords[rows], ref_lat)
+    lines = shapely.linestrings(xy, indices=np.repeat(np.arange(len(offsets)), lengths))
+
+    # Cumulative distance of every shape point, made increasing across
+    # shapes (each shape starts after the previous one's total) so one
+    # searchsorted finds the segment of every visit
+    segments = np.hypot(*np.diff(xy, axis=0).T)
+    point_starts = np.r_[0, np.cumsum(lengths)[:-1]]
+    segments[point_starts[1:] - 1] = 0
+    cumulative = np.r_[0, np.cumsum(segments)]
+    shape_base = cumulative[point_starts]
+    shape_lengths = cumulative[point_starts + lengths - 1] - shape_base
+
+    visits = shape_pattern_stops(patterns, trips)
+    shape_codes = pd.Index(shape_ids).get_indexer(visits['shape_id'])
+    stop_rows = stops.assign(stop_id=stops['stop_id'].astype(str)).drop_duplicates('stop_id').set_index('stop_id')
+    stop_codes = stop_rows.index.get_indexer(visits['stop_id'])
+    # A pattern keeps its visits only if all of its stops are known
+    unknown = pd.Series(stop_codes < 0).groupby([visits['shape_id'], visits['pattern']]).transform('any').to_numpy()
+    known = (shape_codes >= 0) & ~unknown
+    visits, shape_codes, stop_codes = visits[known].reset_index(drop=True), shape_codes[known], stop_codes[known]
+
+    stop_lonlat = stop_rows[['stop_lon', 'stop_lat']].to_numpy(dtype=np.float64)[stop_codes]
+    stop_xy = project_to_metres(stop_lonlat, ref_lat)
+    points = shapely.points(stop_xy)
+    visit_lines = lines[shape_codes]
+    distances = shapely.line_locate_point(visit_lines, points)
+    errors = shapely.distance(visit_lines, points)
+    snapped = shapely.get_coordinates(shapely.line_interpolate_point(visit_lines, distances))
+
+    # Segment index: last shape point at or before the stop's distance,
+    # kept off the shape's final point
+    global_rows = np.searchsorted(cumulative, shape_base[shape_codes] + distances, side='right') - 1
+    vertices = np.clip(global_rows - point_starts[shape_codes], 0, lengths[shape_codes] - 2)
+
+    # (shape, pattern) pairs whose nearest points go backwards somewhere
+    pattern_codes = visits['pattern'].to_numpy()
+    first = np.r_[True, (shape_codes[1:] != shape_codes[:-1]) | (pattern_codes[1:] != pattern_codes[:-1])]
+    group_starts = np.flatnonzero(first)
+    group_ends = np.r_[group_starts[1:], len(first)]
+    backwards = np.r_[False, np.diff(distances) < 0] & ~first
+    reordered = np.unique(np.cumsum(first)[backwards] - 1)
+    for group in reordered:
+        visit_rows = slice(group_starts[group], group_ends[group])
+        shape = shape_codes[group_starts[group]]
+        line_xy = xy[point_starts[shape]:point_starts[shape] + lengths[shape]]
+        (distances[visit_rows], errors[visit_rows], vertices[visit_rows],
+         snapped[visit_rows]) = ordered_locations(line_xy, stop_xy[visit_rows])
+
+    # Back to degrees: the projection is linear in each axis
+    scale = np.array([np.cos(np.radians(ref_lat)), 1.0]) * np.radians(1) * EARTH_RADIUS_M
+    snapped_lonlat = np.round(snapped / scale, POINT_PRECISION)
+
+    located = visits.assign(shape_code=shape_codes, distance_m=distances, error_m=errors, vertex=vertices,
+                            lon=snapped_lonlat[:, 0], lat=snapped_lonlat[:, 1])
+    return located, pd.DataFrame({'shape_id': shape_ids, 'length_m': shape_lengths}), len(reordered)
+
+def snap_error_stats(located, reordered_patterns):
+    """Mean, median, 95th percentile and max snapping error in metres, the count over FAR_STOP_M
+    and the number of (shape, pattern) pairs whose nearest points were out of order."""
+    errors = located['error_m'].to_numpy()
+    if len(errors) == 0:
+        return {'mean_m': 0.0, 'p50_m': 0.0, 'p95_m': 0.0, 'max_m': 0.0, 'far_stops': 0,
+                'reordered_patterns': reordered_patterns}
+    return {
+        'mean_m': round(float(errors.mean()), 2),
+        'p50_m': round(float(np.percentile(errors, 50)), 2),
+        'p95_m': round(float(np.percentile(errors, 95)), 2),
+        'max_m': round(float(errors.max()), 2),
+        'far_stops': int((errors > FAR_STOP_M).sum()),
+        'reordered_patterns': reordered_patterns,
+    }
+
+def build_shape_stops(located, shape_lengths, reordered_patterns):
+    """Columnar per-pattern stop arrays saved as shape_stops.json.
+
+    Every (shape, trip pattern) pair is one entry of pattern_shapes (its
+    position in shape_ids) and pattern_routes (its position in route_ids);
+    stop_offsets gives each pair's slice of the visit arrays, which follow
+    the pattern's stop order with non-decreasing distances along the shape.
+    A visit's vertex is the index of the shape point (in shapes.txt order,
+    as in the unsimplified route files) that starts its segment, and point
+    its snapped [lon, lat].
+    """
+    shape_codes = located['shape_code'].to_numpy()
+    pattern_codes = located['pattern'].to_numpy()
+    first = np.flatnonzero(np.r_[True, (shape_codes[1:] != shape_codes[:-1]) |
+                                 (pattern_codes[1:] != pattern_codes[:-1])]) if len(located) else np.zeros(0, np.int64)
+    used_shapes, pattern_shapes = np.unique(shape_codes[first], return_inverse=True)
+    pattern_routes, route_ids = pd.factorize(located['route_id'].to_numpy()[first], sort=True)
+    stop_codes, stop_ids = pd.factorize(located['stop_id'], sort=True)
+
+    return {
+        'shape_ids': shape_lengths['shape_id'].to_numpy()[used_shapes].tolist(),
+        'lengths_m': np.round(shape_lengths['length_m'].to_numpy()[used_shapes], 1).tolist(),
+        'route_ids': route_ids.tolist(),
+        'pattern_shapes': pattern_shapes.tolist(),
+        'pattern_routes': pattern_routes.tolist(),
+        'stop_offsets': np.r_[first, len(located)].tolist(),
+        'stop_ids': stop_ids.tolist(),
+        'stops': stop_codes.tolist(),
+        'distances_m': np.round(located['distance_m'].to_numpy(), 1).tolist(),
+        'vertices': located['vertex'].to_numpy().tolist(),
+        'points': located[['lon', 'lat']].to_numpy().tolist(),
+        'snap_error_m': snap_error_stats(located, reordered_patterns),
+    }
+
+def segment_coords(shape_stops, shape_coords, pattern, board, alight):
+    """[lon, lat] coordinates of a shape between two stops of a pattern, in constant time besides the copy.
+
+    `pattern` is a position in pattern_shapes, `shape_coords` the points of
+    its shape and `board`/`alight` positions in its stop slice (board
+    before alight), so the slice always runs forwards along the shape.
+    """
+    offset = shape_stops['stop_offsets'][pattern]
+    a, b = offset + board, offset + alight
+    first, last = shape_stops['vertices'][a], shape_stops['vertices'][b]
+    return [shape_stops['points'][a], *shape_coords[first + 1:last + 1], shape_stops['points'][b]]
+
+def save_shape_stops(shape_stops, output_file):
+    """Save the per-shape stop arrays (minified)."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(shape_stops, f, ensure_ascii=False, separators=(',', ':'))
+
+    print(f"Saved {len(shape_stops['stops'])} stop positions of {len(shape_stops['pattern_shapes'])} patterns "
+          f"on {len(shape_stops['shape_ids'])} shapes "
+          f"to {output_file} ({os.path.getsize(output_file) / 1024:.0f} KB)")
+
+def print_snap_errors(stats):
+    """One line of snapping error statistics."""
+    print(f"Snapping error: mean {stats['mean_m']} m, p50 {stats['p50_m']} m, p95 {stats['p95_m']} m, "
+          f"max {stats['max_m']} m; {stats['far_stops']} stop positions over {FAR_STOP_M} m from their shape; "
+          f"{stats['reordered_patterns']} patterns located again in stop order")
+
+def run_linear_referencing(shapes, trips, stops, patterns, output_dir):
+    """shape_stops.json. Returns the counts for the run report (snapping errors are printed and saved in the file)."""
+    located, shape_lengths, reordered_patterns = locate_stops(shapes, trips, stops, patterns)
+    shape_stops = build_shape_stops(located, shape_lengths, reordered_patterns)
+    print_snap_errors(shape_stops['snap_error_m'])
+    save_shape_stops(shape_stops, os.path.join(output_dir, OUTPUT_NAME))
+    return {'shapes': len(shape_stops['shape_ids']), 'shape_patterns': len(shape_stops['pattern_shapes']),
+            'stop_visits': len(shape_stops['stops']), 'far_stops': shape_stops['snap_error_m']['far_stops'],
+            'reordered_patterns': reordered_patterns}
+
+def main():
+    parser = argparse.ArgumentParser(description="Snap the stops of every trip pattern to distances along its shapes")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory for the generated file (default: {OUTPUT_DIR})")
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    feed = load_feed(GTFS_ZIP_PATH, ['shapes', 'trips', 'stops', 'stop_times'])
+    if feed is None:
+        return
+
+    patterns = extract_trip_patterns(feed['stop_times'], feed['trips'])
+    start = time.perf_counter()
+    counts = run_linear_referencing(feed['shapes'], feed['trips'], feed['stops'], patterns, args.output_dir)
+    print(f"Located {counts['stop_visits']} stop positions of {counts['shape_patterns']} patterns "
+          f"on {counts['shapes']} shapes "
+          f"in {time.perf_counter() - start:.2f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from trip_patterns import extract_trip_patterns
+
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+OUTPUT_NAME = 'od_index.json'
+
+def route_patterns(patterns):
+    """Distinct ordered stop sequences of every route, from the trip patterns (see trip_patterns.py).
+
+    Returns (pattern_routes, pattern_stops, stop_ids, route_ids): the route
+    code of each pattern, its stop codes as an int array, and the ID lists
+    of the stops and routes with trips, which the codes index into.
+    Patterns keep the order of first appearance.
+    """
+    offsets = patterns['pattern_stop_offsets']
+    used_stops, stop_codes = np.unique(patterns['pattern_stops'], return_inverse=True)
+    used_routes, route_codes = np.unique(patterns['pattern_routes'], return_inverse=True)
+
+    # Trip patterns that only differ in their stop_sequence numbers are one
+    # pattern here
+    sequences = {}
+    for pattern, route in enumerate(route_codes.tolist()):
+        stops = stop_codes[offsets[pattern]:offsets[pattern + 1]].astype(np.int32)
+        sequences.setdefault((route, stops.tobytes()), stops)
+
+    pattern_routes = np.array([route for route, _ in sequences], dtype=np.int64)
+    return (pattern_routes, list(sequences.values()), [str(stop_id) for stop_id in patterns['stop_ids'][used_stops]],
+            [str(route_id) for route_id in patterns['route_ids'][used_routes]])
+
+def build_od_index(patterns):
+    """Stop -> (pattern, first position, last position) CSR index for ordered direct-route queries.
+
+    A pattern goes from A to B when A's first position on it is before B's
+    last position, which also holds for loops that visit a stop twice.
+    """
+    pattern_routes, pattern_stops, stop_ids, route_ids = route_patterns(patterns)
+
+    lengths = np.array([len(stops) for stops in pattern_stops], dtype=np.int64)
+    patterns = np.repeat(np.arange(len(pattern_stops)), lengths)
+    stops = np.concatenate(pattern_stops) if pattern_stops else np.empty(0, dtype=np.int32)
+    positions = np.arange(len(stops)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    # One entry per (stop, pattern), sorted by stop then pattern
+    order = np.lexsort((positions, patterns, stops))
+    stops, patterns, positions = stops[order], patterns[order], positions[order]
+    starts = np.flatnonzero(np.r_[True, (stops[1:] != stops[:-1]) | (patterns[1:] != patterns[:-1])])
+    ends = np.r_[starts[1:], len(stops)]
+
+    entry_stops = stops[starts]
+    stop_offsets = np.searchsorted(entry_stops, np.arange(len(stop_ids) + 1))
+
+    return {
+        'stop_ids': stop_ids,
+        'route_ids': route_ids,
+        'pattern_routes': pattern_routes.tolist(),
+        'stop_offsets': stop_offsets.tolist(),
+        'patterns': patterns[starts].tolist(),
+        'first_positions': positions[starts].tolist(),
+        'last_positions': positions[ends - 1].tolist(),
+    }
+
+def save_od_index(od_index, output_file):
+    """Save the OD index (minified)."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(od_index, f, separators=(',', ':'))
+
+    print(f"Saved OD index of {len(od_index['pattern_routes'])} patterns over {len(od_index['stop_ids'])} stops "
+          f"to {output_file} ({os.path.getsize(output_file) / 1024:.0f} KB)")
+
+class DirectRouteIndex:
+    """In-memory OD index answering "which routes serve stop A and then stop B".
+
+    Every stop maps to two dicts, pattern -> first position and pattern ->
+    last position; a query intersects the patterns of A and B and keeps
+    those where A comes first.
+    """
+
+    def __init__(self, od_index):
+        self.route_ids = od_index['route_ids']
+        self.pattern_routes = od_index['pattern_routes']
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(od_index['stop_ids'])}
+
+        offsets = od_index['stop_offsets']
+        patterns, first, last = od_index['patterns'], od_index['first_positions'], od_index['last_positions']
+        self.first = [dict(zip(patterns[offsets[i]:offsets[i + 1]], first[offsets[i]:offsets[i + 1]]))
+                      for i in range(len(offsets) - 1)]
+        self.last = [dict(zip(patterns[offsets[i]:offsets[i + 1]], last[offsets[i]:offsets[i + 1]]))
+                     for i in range(len(offsets) - 1)]
+
+    @classmethod
+    def load(cls, output_dir):
+        """Index loaded from the od_index.json saved by the pipeline."""
+        with open(os.path.join(output_dir, OUTPUT_NAME), encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def routes_between(self, origin, destination):
+        """route_ids with a trip pattern serving `origin` and later `destination`, sorted by route_id."""
+        a, b = self.stop_index.get(origin), self.stop_index.get(destination)
+        if a is None or b is None:
+            return []
+        first, last = self.first[a], self.last[b]
+        if len(last) < len(first):
+            routes = {self.pattern_routes[p] for p, position in last.items() if first.get(p, position) < position}
+        else:
+            routes = {self.pattern_routes[p] for p, position in first.items() if position < last.get(p, -1)}
+        return [self.route_ids[r] for r in sorted(routes)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the ordered origin-destination direct-route index")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory for the generated file (default: {OUTPUT_DIR})")
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    feed = load_feed(GTFS_ZIP_PATH, ['stop_times', 'trips'])
+    if feed is None:
+        return
+
+    patterns = extract_trip_patterns(feed['stop_times'], feed['trips'])
+    save_od_index(build_od_index(patterns), os.path.join(args.output_dir, OUTPUT_NAME))
+
+if __name__ == "__main__":
+    main()
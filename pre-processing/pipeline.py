@@ -0,0 +1,312 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from instrumentation import PROFILE_DIR, RUN_REPORT, format_metrics, measure, save_run_report, stage_profile_path
+from process_gtfs import OUTPUT_DIR, add_dedupe_argument, add_simplification_arguments, indexed_route_ids, process_data
+from process_stops import process_stops_data
+from extract_all_headways import (DAY_TYPE_OUTPUT_NAME, build_day_type_frequencies, build_route_frequencies,
+                                  save_day_type_frequencies, save_route_frequencies)
+from vector_tiles import export_pmtiles
+from compress_outputs import compress_outputs
+from hash_outputs import ASSET_MANIFEST_NAME, hash_outputs
+from validate_outputs import validate_outputs
+from stop_headways import OUTPUT_NAME as STOP_FREQUENCIES_NAME, build_stop_frequencies, save_stop_frequencies
+from od_index import OUTPUT_NAME as OD_INDEX_NAME, build_od_index, save_od_index
+from linear_referencing import run_linear_referencing
+from trip_patterns import (compression_stats, extract_trip_patterns, format_compression, pattern_first_stop_departures,
+                           pattern_stop_routes)
+from incremental import (MANIFEST_PATH, build_manifest, can_build_incrementally, diff_manifests, load_manifest,
+                         save_manifest, update_route_files, update_route_frequencies, update_stop_outputs)
+
+# Stages of build_stages and build_incremental_stages, which run in parallel
+PARALLEL_STAGES = ['shapes', 'stops', 'frequencies', 'day_type_frequencies', 'stop_frequencies', 'od_index',
+                   'shape_stops']
+
+# Each stage returns the row counts of its outputs for the run report
+
+def run_shapes_stage(routes, trips, shapes, output_dir, tolerance_m=0, precision=None, dedupe_shapes=False,
+                     workers=None):
+    """Route GeoJSON files, routes_index.json and all_routes.geojson, written by `workers` processes."""
+    route_features = process_data(routes, trips, shapes, output_dir, workers, tolerance_m=tolerance_m,
+                                  precision=precision, dedupe_shapes=dedupe_shapes)
+    return {'route_files': len(route_features),
+            'features': sum(len(features) for features in route_features.values())}
+
+def run_stops_stage(stops, patterns, trips, routes, shape_ids, output_dir):
+    """stops_with_routes.json, stops.geojson, routes_to_stops.json and stops_encoded.json."""
+    stop_routes = pattern_stop_routes(patterns)
+    # The shapes stage writes routes_index.json in parallel, so its order is recomputed here
+    stops_with_routes = process_stops_data(stops, stop_routes, routes, output_dir,
+                                           indexed_route_ids(routes, trips, shape_ids))
+    return {'stop_route_pairs': len(stop_routes), 'stops_with_routes': len(stops_with_routes)}
+
+def run_frequencies_stage(routes, trips, first_stops, calendar, output_dir, columnar=False):
+    """route_frequencies.json (and route_frequencies.columnar.json with `columnar`)."""
+    route_frequency_data = build_route_frequencies(routes, trips, first_stops, calendar)
+    save_route_frequencies(route_frequency_data, os.path.join(output_dir, 'route_frequencies.json'), columnar)
+    return {'routes': len(route_frequency_data)}
+
+def run_day_type_frequencies_stage(routes, trips, first_stops, calendar, calendar_dates, output_dir):
+    """route_frequencies_by_day_type.json."""
+    day_type_data = build_day_type_frequencies(routes, trips, first_stops, calendar, calendar_dates)
+    save_day_type_frequencies(day_type_data, os.path.join(output_dir, DAY_TYPE_OUTPUT_NAME))
+    return {day_type: len(routes) for day_type, routes in day_type_data['day_types'].items()}
+
+def run_stop_frequencies_stage(trips, stop_times, calendar, output_dir):
+    """stop_frequencies.json."""
+    columnar = build_stop_frequencies(trips, stop_times, calendar)
+    save_stop_frequencies(columnar, os.path.join(output_dir, STOP_FREQUENCIES_NAME))
+    return {'stops': len(columnar['stop_ids']), 'stop_route_pairs': len(columnar['route'])}
+
+def run_od_index_stage(patterns, output_dir):
+    """od_index.json."""
+    od_index = build_od_index(patterns)
+    save_od_index(od_index, os.path.join(output_dir, OD_INDEX_NAME))
+    return {'patterns': len(od_index['pattern_routes']), 'stop_pattern_pairs': len(od_index['patterns'])}
+
+def shape_writer_workers(workers, stages):
+    """Route file writers of the shapes stage: the cores the other parallel stages leave free, at least 1.
+
+    The shapes stage already runs next to the other stages, so its own pool
+    gets the rest of the `workers` budget (one per core by default) instead
+    of one process per core on top of them; 1 writes in-process.
+    """
+    return max(1, (workers or os.cpu_count() or 1) - (len(stages) - 1))
+
+def build_stages(feed, output_dir, settings, shape_workers=None):
+    """Stage name -> (function, args). Each stage only gets the tables it needs.
+
+    `feed` also holds the trip patterns of stop_times (see
+    trip_patterns.py), which the stops, frequency and OD index stages use
+    instead of the full table. `shape_workers` sizes the route file
+    writers of the shapes stage (default: one per core, for a stage run
+    alone).
+    """
+    first_stops = pattern_first_stop_departures(feed['patterns'])
+    return {
+        'shapes': (run_shapes_stage, (feed['routes'], feed['trips'], feed['shapes'], output_dir,
+                                      settings['tolerance_m'], settings['precision'], settings['dedupe_shapes'],
+                                      shape_workers)),
+        'stops': (run_stops_stage, (feed['stops'], feed['patterns'], feed['trips'], feed['routes'],
+                                    feed['shapes']['shape_id'].unique(), output_dir)),
+        # The frequency stages only look at first-stop departures, so they get
+        # those instead of the whole stop_times table
+        'frequencies': (run_frequencies_stage, (feed['routes'], feed['trips'], first_stops,
+                                                feed['calendar'], output_dir,
+                                                settings['columnar_frequencies'])),
+        'day_type_frequencies': (run_day_type_frequencies_stage, (feed['routes'], feed['trips'], first_stops,
+                                                                  feed['calendar'], feed.get('calendar_dates'),
+                                                                  output_dir)),
+        'stop_frequencies': (run_stop_frequencies_stage, (feed['trips'], feed['stop_times'], feed['calendar'],
+                                                          output_dir)),
+        'od_index': (run_od_index_stage, (feed['patterns'], output_dir)),
+        'shape_stops': (run_linear_referencing, (feed['shapes'], feed['trips'], feed['stops'], feed['patterns'],
+                                                 output_dir)),
+    }
+
+def build_incremental_stages(feed, output_dir, settings, changes, shape_workers=None):
+    """Like build_stages, but each stage only rebuilds what `changes` (see diff_manifests) touches."""
+    changed_routes = changes['changed_routes']
+    removed_routes = changes['removed_routes']
+    # A calendar change affects the frequencies of every route
+    frequency_routes = set(feed['routes']['route_id'].astype(str)) if changes['calendar_changed'] else changed_routes
+    first_stops = pattern_first_stop_departures(feed['patterns'])
+
+    return {
+        'shapes': (update_route_files, (feed['routes'], feed['trips'], feed['shapes'], output_dir,
+                                        changed_routes, removed_routes,
+                                        settings['tolerance_m'], settings['precision'], settings['dedupe_shapes'],
+                                        shape_workers)),
+        'stops': (update_stop_outputs, (feed['stops'], feed['stop_times'], feed['trips'], feed['routes'],
+                                        feed['shapes']['shape_id'].unique(), output_dir,
+                                        changed_routes, removed_routes, changes['changed_stops'])),
+        'frequencies': (update_route_frequencies, (feed['routes'], feed['trips'], first_stops, feed['calendar'],
+                                                   os.path.join(output_dir, 'route_frequencies.json'),
+                                                   frequency_routes, settings['columnar_frequencies'])),
+        # Single passes over the first-stop rows / stop_times; cheaper to redo than to patch
+        'day_type_frequencies': (run_day_type_frequencies_stage, (feed['routes'], feed['trips'], first_stops,
+                                                                  feed['calendar'], feed.get('calendar_dates'),
+                                                                  output_dir)),
+        'stop_frequencies': (run_stop_frequencies_stage, (feed['trips'], feed['stop_times'], feed['calendar'],
+                                                          output_dir)),
+        'od_index': (run_od_index_stage, (feed['patterns'], output_dir)),
+        # One vectorized pass over every shape
+        'shape_stops': (run_linear_referencing, (feed['shapes'], feed['trips'], feed['stops'], feed['patterns'],
+                                                 output_dir)),
+    }
+
+def run_pipeline(zip_path, output_dir, workers=None, use_cache=True, incremental=False, manifest_path=MANIFEST_PATH,
+                 tolerance_m=0, precision=None, pmtiles=False, columnar_frequencies=False, compress=False,
+                 dedupe_shapes=False, validate=False, hashed_names=False, report_path=RUN_REPORT, profile_dir=None):
+    """Load the feed once and run the shapes, stops and frequency stages in parallel.
+
+    `tolerance_m` and `precision` configure the optional simplification of
+    the route shapes (see simplify.py). With `pmtiles`, the route and stop
+    GeoJSON outputs are then tiled into network.pmtiles (see vector_tiles.py).
+    `columnar_frequencies` adds the compact route_frequencies.columnar.json.
+    `dedupe_shapes` makes the route files reference a shared shape store.
+    With `compress`, a last stage minifies every JSON output and writes
+    .gz/.br versions of it (see compress_outputs.py). With `validate`, the
+    finished outputs are checked last (see validate_outputs.py) and the
+    build fails if they have errors. With `hashed_names`, every output is
+    then copied to a content-hashed name listed in manifest.json (see
+    hash_outputs.py); invalid outputs are not published there.
+
+    With `incremental`, route inputs are fingerprinted and compared with the
+    manifest of the previous build, and only the outputs of changed or removed
+    routes and stops are rewritten. A manifest is saved after every build
+    whose outputs are valid.
+
+    Every stage is measured (see instrumentation.measure) and the metrics
+    are saved to `report_path`. With `profile_dir`, each stage also runs
+    under cProfile and its stats are dumped to <profile_dir>/<stage>.prof.
+    """
+    pipeline_start = time.perf_counter()
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'gtfs': zip_path,
+        'output_dir': output_dir,
+        'incremental': incremental,
+        'stages': {},
+    }
+
+    def record(name, metrics):
+        report['stages'][name] = metrics
+        print(f"[pipeline] {name}: {format_metrics(metrics)}")
+
+    feed, metrics = measure(load_feed, (zip_path, ['routes', 'trips', 'shapes', 'stops', 'stop_times', 'calendar']),
+                            stage_profile_path(profile_dir, 'load'),
+                            {'use_cache': use_cache, 'optional': ['calendar_dates']})
+    if feed is None:
+        return False
+    metrics['output_rows'] = {name: len(table) for name, table in feed.items()}
+    record('load', metrics)
+
+    feed['patterns'], metrics = measure(extract_trip_patterns, (feed['stop_times'], feed['trips']),
+                                        stage_profile_path(profile_dir, 'patterns'))
+    metrics['output_rows'] = compression_stats(feed['patterns'])
+    record('patterns', metrics)
+    print(f"[pipeline] {format_compression(metrics['output_rows'])}")
+
+    settings = {'tolerance_m': tolerance_m, 'precision': precision, 'columnar_frequencies': columnar_frequencies,
+                'dedupe_shapes': dedupe_shapes}
+    report['settings'] = settings
+    manifest, metrics = measure(build_manifest, (feed, output_dir, settings),
+                                stage_profile_path(profile_dir, 'fingerprints'))
+    record('fingerprints', metrics)
+
+    # Created up front so parallel stages don't race on it
+    os.makedirs(output_dir, exist_ok=True)
+
+    previous = load_manifest(manifest_path) if incremental else None
+    if incremental and not can_build_incrementally(previous, manifest):
+        print("[pipeline] no usable manifest from a previous build, rebuilding everything")
+        previous = None
+
+    shape_workers = shape_writer_workers(workers, PARALLEL_STAGES)
+    if previous is None:
+        stages = build_stages(feed, output_dir, settings, shape_workers)
+    else:
+        changes = diff_manifests(previous, manifest)
+        print(f"[pipeline] {len(changes['changed_routes'])} routes changed, "
+              f"{len(changes['removed_routes'])} removed, {len(changes['changed_stops'])} stops changed"
+              f"{', calendar changed' if changes['calendar_changed'] else ''}")
+        report['changes'] = {name: len(value) if isinstance(value, set) else value for name, value in changes.items()}
+        if any(changes.values()):
+            stages = build_incremental_stages(feed, output_dir, settings, changes, shape_workers)
+        else:
+            # The outputs are still validated (and hashed) below: the previous
+            # build may have failed validation after writing them
+            print("[pipeline] nothing to rebuild")
+            stages = {}
+
+    if stages:
+        with ProcessPoolExecutor(max_workers=workers or len(stages)) as pool:
+            futures = {pool.submit(measure, stage, args, stage_profile_path(profile_dir, name)): name
+                       for name, (stage, args) in stages.items()}
+            for future in as_completed(futures):
+                record(futures[future], future.result()[1])
+
+        # Tiles are cut from the finished GeoJSON outputs, so they come last
+        if pmtiles:
+            record('tiles', measure(export_pmtiles, (output_dir,), stage_profile_path(profile_dir, 'tiles'))[1])
+
+        if compress:
+            record('compress', measure(compress_outputs, (output_dir, workers),
+                                       stage_profile_path(profile_dir, 'compress'))[1])
+
+    valid = True
+    if validate:
+        valid, metrics = measure(validate_outputs, (output_dir, workers), stage_profile_path(profile_dir, 'validate'))
+        metrics['valid'] = valid
+        record('validate', metrics)
+
+    # After compression, so the hashed copies are the final bytes
+    if hashed_names and valid:
+        record('hash', measure(hash_outputs, (output_dir, workers), stage_profile_path(profile_dir, 'hash'))[1])
+
+    # Without a manifest of these inputs, the next incremental build compares
+    # against the last valid one and rewrites the same routes again
+    if valid:
+        save_manifest(manifest, manifest_path)
+    finish_report(report, report_path, pipeline_start)
+    return valid
+
+def finish_report(report, report_path, pipeline_start):
+    """Add the total time to the run report and save it."""
+    report['total_wall_s'] = round(time.perf_counter() - pipeline_start, 4)
+    save_run_report(report, report_path)
+    print(f"[pipeline] total: {report['total_wall_s']:.2f} s (report: {report_path})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the full GTFS pre-processing pipeline")
+    parser.add_argument('gtfs', nargs='?', default=GTFS_ZIP_PATH,
+                        help=f"path to the GTFS zip (default: {GTFS_ZIP_PATH})")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory for the generated files (default: {OUTPUT_DIR})")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: one per stage, one per core for --compress); the shapes "
+                             "stage writes route files with the workers (or cores) the other stages leave free")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="parse the zip even if a cached copy of the tables exists")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only rewrite outputs of routes and stops that changed since the last build")
+    parser.add_argument('--manifest', default=MANIFEST_PATH,
+                        help=f"build manifest with the input fingerprints (default: {MANIFEST_PATH})")
+    add_simplification_arguments(parser)
+    add_dedupe_argument(parser)
+    parser.add_argument('--pmtiles', action='store_true',
+                        help="also export routes and stops as vector tiles to network.pmtiles")
+    parser.add_argument('--columnar-frequencies', action='store_true',
+                        help="also write the compact route_frequencies.columnar.json")
+    parser.add_argument('--compress', action='store_true',
+                        help="minify the JSON outputs and write .gz/.br versions of them")
+    parser.add_argument('--validate', action='store_true',
+                        help="check every output file and their consistency at the end, failing on errors")
+    parser.add_argument('--hashed-names', action='store_true',
+                        help=f"also copy every output to a content-hashed name and list them in {ASSET_MANIFEST_NAME}")
+    parser.add_argument('--report', default=RUN_REPORT,
+                        help=f"run report with the metrics of every stage (default: {RUN_REPORT})")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"run every stage under cProfile and save the stats to {PROFILE_DIR}/<stage>.prof")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gtfs):
+        print(f"File not found: {args.gtfs}")
+        return
+
+    ok = run_pipeline(args.gtfs, args.output_dir, args.workers, use_cache=not args.no_cache,
+                      incremental=args.incremental, manifest_path=args.manifest,
+                      tolerance_m=args.tolerance, precision=args.precision, pmtiles=args.pmtiles,
+                      columnar_frequencies=args.columnar_frequencies, compress=args.compress,
+                      dedupe_shapes=args.dedupe_shapes, validate=args.validate, hashed_names=args.hashed_names,
+                      report_path=args.report, profile_dir=PROFILE_DIR if args.profile else None)
+    if not ok:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
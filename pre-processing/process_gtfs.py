@@ -1,73 +1,95 @@
+import argparse
+import hashlib
+import numpy as np
 import pandas as pd
-import zipfile
 import json
 import os
-from shapely.geometry import LineString, mapping
+from concurrent.futures import ProcessPoolExecutor
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from simplify import print_simplification_summary, save_simplification_report, simplify_route_features
 
 # Paths
-GTFS_ZIP_PATH = os.path.join('..', 'GTFS-2025-10-28.zip')
 OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
 
+# Shared shape store of deduplicated geometries, inside the output directory
+SHAPES_DIR = 'shapes'
+
+# Smallest batch of routes worth sending to a worker process
+MIN_ROUTES_PER_BATCH = 8
+
 def load_gtfs_data(zip_path):
-    print(f"Loading GTFS data from {zip_path}...")
-    with zipfile.ZipFile(zip_path) as z:
-        # Check files
-        filenames = z.namelist()
-        print(f"Files in zip: {filenames}")
-        
-        if 'shapes.txt' not in filenames:
-            print("Error: shapes.txt not found!")
-            return None
-        
-        # Load necessary files
-        with z.open('routes.txt') as f:
-            routes = pd.read_csv(f)
-        
-        with z.open('trips.txt') as f:
-            trips = pd.read_csv(f)
-            
-        with z.open('shapes.txt') as f:
-            shapes = pd.read_csv(f)
-            
-    return routes, trips, shapes
+    feed = load_feed(zip_path, ['routes', 'trips', 'shapes'])
+    if feed is None:
+        return None
 
-def process_data(routes, trips, shapes):
-    print("Processing data...")
-    
-    # Create output directory
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        print(f"Created directory {OUTPUT_DIR}")
+    return feed['routes'], feed['trips'], feed['shapes']
+
+def route_filename(route_id):
+    """Safe file name of a route's GeoJSON file."""
+    safe_route_id = "".join([c for c in str(route_id) if c.isalnum() or c in ('-', '_')])
+    return f"{safe_route_id}.json"
+
+def shape_offsets(shapes):
+    """Sort the shape points and locate each shape in the sorted arrays.
+
+    Returns (coords, offsets): coords is an (n, 2) array of [lon, lat] points,
+    and offsets is a DataFrame with the [start, end) rows of every shape_id.
+    """
+    shapes = shapes.dropna(subset=['shape_id']).sort_values(['shape_id', 'shape_pt_sequence'])
+    coords = shapes[['shape_pt_lon', 'shape_pt_lat']].to_numpy(dtype=np.float64)
+
+    # After sorting, every shape is a contiguous run of rows
+    codes, shape_ids = pd.factorize(shapes['shape_id'], sort=False)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    ends = np.r_[starts[1:], len(codes)]
+    offsets = pd.DataFrame({'shape_id': shapes['shape_id'].iloc[starts].to_numpy(), 'start': starts, 'end': ends})
 
+    return coords, offsets
+
+def indexed_route_ids(routes, trips, shape_ids):
+    """route_ids of routes_index.json, in its order, without building the features.
+
+    A route is indexed when one of its trips uses a shape in `shape_ids`
+    (the shape_ids of shapes.txt); build_route_features groups by route_id,
+    so the index is sorted by route_id.
+    """
+    shaped = trips.loc[trips['shape_id'].isin(shape_ids), 'route_id']
+    return sorted(routes.loc[routes['route_id'].isin(shaped), 'route_id'].astype(str).unique())
+
+def build_route_features(routes, trips, shapes):
+    """Build the route index and the GeoJSON features of every route.
+
+    Returns (route_index, route_features), where route_features maps each
+    route_id to a list of (feature, coords) pairs in route_id order: the
+    feature dict without its geometry, and the (n, 2) coordinate array of
+    its LineString (a view into the sorted shape points).
+    """
     # We want to map route -> shape(s).
     # trips.txt links route_id to shape_id.
     
     # Get unique shape_ids per route
     route_shapes = trips[['route_id', 'shape_id']].drop_duplicates()
     
-    # Sort by sequence first
-    shapes = shapes.sort_values(['shape_id', 'shape_pt_sequence'])
-    
-    # Group by shape_id and create list of points
-    shapes_grouped = shapes.groupby('shape_id')[['shape_pt_lon', 'shape_pt_lat']].apply(
-        lambda x: x.values.tolist()
-    ).reset_index(name='coords')
+    # Points of every shape, as a slice of one sorted coordinate array
+    coords, offsets = shape_offsets(shapes)
     
     # Merge with route info
-    merged = pd.merge(route_shapes, shapes_grouped, on='shape_id')
+    merged = pd.merge(route_shapes, offsets, on='shape_id')
     
     # Merge with route details (names, colors)
     final_data = pd.merge(merged, routes, on='route_id')
     
     # Group by route_id to handle multiple shapes per route
     route_index = []
-    all_features = []
+    route_features = {}
     
     for route_id, group in final_data.groupby('route_id'):
         features = []
+        rows = group.to_dict('records')
         
         # Get metadata from the first row of the group
-        first_row = group.iloc[0]
+        first_row = rows[0]
         route_meta = {
             'route_id': str(first_row['route_id']),
             'route_short_name': str(first_row['route_short_name']),
@@ -77,12 +99,9 @@ def process_data(routes, trips, shapes):
         }
         route_index.append(route_meta)
         
-        for _, row in group.iterrows():
-            coords = row['coords']
-            if len(coords) < 2:
+        for row in rows:
+            if row['end'] - row['start'] < 2:
                 continue
-                
-            line = LineString(coords)
             
             properties = {
                 'route_id': row['route_id'],
@@ -97,41 +116,206 @@ def process_data(routes, trips, shapes):
                 "type": "Feature",
                 "id": row['shape_id'], # Important for maplibre feature state
                 "properties": properties,
-                "geometry": mapping(line)
             }
-            features.append(feature)
-            all_features.append(feature)
+            features.append((feature, coords[row['start']:row['end']]))
             
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features
-        }
-        
-        # Save individual file
-        # Safe filename
-        safe_route_id = "".join([c for c in str(route_id) if c.isalnum() or c in ('-', '_')])
-        file_path = os.path.join(OUTPUT_DIR, f"{safe_route_id}.json")
-        
+        route_features[route_id] = features
+
+    return route_index, route_features
+
+def feature_json(feature, coords):
+    """Serialize a feature with its LineString geometry."""
+    geometry = {"type": "LineString", "coordinates": coords.tolist()}
+    return json.dumps(dict(feature, geometry=geometry))
+
+def feature_collection_json(feature_jsons):
+    """FeatureCollection from already serialized features (same text as json.dump)."""
+    return '{"type": "FeatureCollection", "features": [' + ', '.join(feature_jsons) + ']}'
+
+def shape_hash(coords):
+    """Content hash of a shape's coordinates, used as its name in the shape store."""
+    return hashlib.sha256(np.ascontiguousarray(coords).tobytes()).hexdigest()[:16]
+
+def feature_ref_json(feature, geometry_ref):
+    """Serialize a feature whose geometry is in the shape store (geometry null, properties.geometry_ref)."""
+    properties = dict(feature['properties'], geometry_ref=geometry_ref)
+    return json.dumps(dict(feature, properties=properties, geometry=None))
+
+def write_route_files(route_features, output_dir, dedupe=False):
+    """Serialize and save the files of a batch of routes. Returns {route_id: feature JSON strings}.
+
+    With `dedupe` the files reference the shape store instead of embedding
+    the geometry; the returned strings always hold the full features.
+    """
+    serialized = {}
+    for route_id, features in route_features.items():
+        feature_jsons = [feature_json(feature, coords) for feature, coords in features]
+        file_jsons = feature_jsons
+        if dedupe:
+            file_jsons = [feature_ref_json(feature, shape_hash(coords)) for feature, coords in features]
+
+        file_path = os.path.join(output_dir, route_filename(route_id))
         with open(file_path, 'w') as f:
-            json.dump(geojson, f)
+            f.write(feature_collection_json(file_jsons))
+        serialized[route_id] = feature_jsons
+
+    return serialized
+
+def write_shape_files(shapes, shapes_dir):
+    """Save a batch of {hash: coords} shape store entries, one LineString file each. Returns {hash: bytes}."""
+    sizes = {}
+    for geometry_ref, coords in shapes.items():
+        text = json.dumps({"type": "LineString", "coordinates": coords.tolist()})
+        with open(os.path.join(shapes_dir, f"{geometry_ref}.json"), 'w') as f:
+            f.write(text)
+        sizes[geometry_ref] = len(text)
+
+    return sizes
+
+def unique_shapes(route_features):
+    """{content hash: coords} of every distinct shape geometry, in first-seen order."""
+    shapes = {}
+    for features in route_features.values():
+        for _, coords in features:
+            shapes.setdefault(shape_hash(coords), coords)
+    return shapes
+
+def map_batches(pool, workers, function, items, *args):
+    """Run function(batch, *args) on the pool over batches of the `items` dict and merge the returned dicts."""
+    keys = list(items)
+
+    # A few batches per worker keeps the pool busy when item sizes vary
+    n_batches = max(1, min(workers * 4, len(keys) // MIN_ROUTES_PER_BATCH))
+    batches = [{key: items[key] for key in keys[i::n_batches]} for i in range(n_batches)]
+
+    results = {}
+    for batch in pool.map(function, batches, *([arg] * n_batches for arg in args)):
+        results.update(batch)
+    return {key: results[key] for key in keys}
+
+def print_dedupe_summary(route_features, route_feature_jsons, shape_sizes):
+    """Report how many duplicate geometries the shape store removed from the route files."""
+    n_features = sum(len(features) for features in route_features.values())
+    embedded = sum(len(text) for texts in route_feature_jsons.values() for text in texts)
+    referenced = sum(len(feature_ref_json(feature, shape_hash(coords)))
+                     for features in route_features.values() for feature, coords in features)
+    store = sum(shape_sizes.values())
+
+    print(f"Shape store: {len(shape_sizes)} unique geometries for {n_features} features "
+          f"({n_features - len(shape_sizes)} duplicates removed)")
+    print(f"Route files: {embedded / 1e6:.2f} MB with embedded geometry -> "
+          f"{referenced / 1e6:.2f} MB + {store / 1e6:.2f} MB shape store "
+          f"(saved {(embedded - referenced - store) / 1e6:.2f} MB)")
+
+def save_route_files(route_features, output_dir, workers=None, dedupe=False):
+    """Save one GeoJSON FeatureCollection file per route, spread over a pool of worker processes.
+
+    With `dedupe`, every distinct geometry is saved once to the shape store
+    (shapes/<content hash>.json) and the route files reference it.
+
+    Returns {route_id: feature JSON strings}, in the order of route_features,
+    so all_routes.geojson can be assembled without serializing again.
+    """
+    workers = workers or os.cpu_count() or 1
+    shapes = unique_shapes(route_features) if dedupe else {}
+    shapes_dir = os.path.join(output_dir, SHAPES_DIR)
+    if dedupe:
+        os.makedirs(shapes_dir, exist_ok=True)
+
+    if workers == 1 or len(route_features) < MIN_ROUTES_PER_BATCH * 2:
+        serialized = write_route_files(route_features, output_dir, dedupe)
+        shape_sizes = write_shape_files(shapes, shapes_dir)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            serialized = map_batches(pool, workers, write_route_files, route_features, output_dir, dedupe)
+            shape_sizes = map_batches(pool, workers, write_shape_files, shapes, shapes_dir)
+
+    if dedupe:
+        print_dedupe_summary(route_features, serialized, shape_sizes)
 
-    # Save index file
-    with open(os.path.join(OUTPUT_DIR, 'routes_index.json'), 'w') as f:
+    return serialized
+
+def clear_shape_store(output_dir):
+    """Delete the shape store so a full build doesn't keep geometries nothing references."""
+    shapes_dir = os.path.join(output_dir, SHAPES_DIR)
+    if os.path.isdir(shapes_dir):
+        for name in os.listdir(shapes_dir):
+            os.remove(os.path.join(shapes_dir, name))
+
+def resolve_geometry_refs(geojson, output_dir):
+    """Replace the geometry_ref of deduplicated route file features with their geometry from the shape store."""
+    for feature in geojson['features']:
+        geometry_ref = feature['properties'].pop('geometry_ref', None)
+        if geometry_ref is not None:
+            with open(os.path.join(output_dir, SHAPES_DIR, f"{geometry_ref}.json")) as f:
+                feature['geometry'] = json.load(f)
+    return geojson
+
+def save_route_index(route_index, output_dir):
+    """Save routes_index.json."""
+    with open(os.path.join(output_dir, 'routes_index.json'), 'w') as f:
         json.dump(route_index, f)
 
-    # Save ALL routes file
-    all_geojson = {
-        "type": "FeatureCollection",
-        "features": all_features
-    }
-    with open(os.path.join(OUTPUT_DIR, 'all_routes.geojson'), 'w') as f:
-        json.dump(all_geojson, f)
+def save_all_routes(route_feature_jsons, output_dir):
+    """Save all_routes.geojson from the serialized features of every route. Returns the feature count."""
+    all_features = [feature for features in route_feature_jsons.values() for feature in features]
+    with open(os.path.join(output_dir, 'all_routes.geojson'), 'w') as f:
+        f.write(feature_collection_json(all_features))
+
+    return len(all_features)
+
+def simplify_features(route_features, tolerance_m=0, precision=None):
+    """Apply the optional geometry simplification and report what it changed."""
+    if not tolerance_m and precision is None:
+        return route_features
+
+    print(f"Simplifying shapes (tolerance {tolerance_m} m, precision {precision} decimals)...")
+    route_features, report = simplify_route_features(route_features, tolerance_m, precision)
+    print_simplification_summary(report)
+    save_simplification_report(report)
+    return route_features
+
+def process_data(routes, trips, shapes, output_dir=OUTPUT_DIR, workers=None, tolerance_m=0, precision=None,
+                 dedupe_shapes=False):
+    print("Processing data...")
+    
+    # Create output directory
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        print(f"Created directory {output_dir}")
+
+    route_index, route_features = build_route_features(routes, trips, shapes)
+    route_features = simplify_features(route_features, tolerance_m, precision)
+
+    clear_shape_store(output_dir)
+    route_feature_jsons = save_route_files(route_features, output_dir, workers, dedupe_shapes)
+    save_route_index(route_index, output_dir)
+    feature_count = save_all_routes(route_feature_jsons, output_dir)
         
-    print(f"Saved {len(final_data['route_id'].unique())} route files to {OUTPUT_DIR}")
-    print(f"Saved all_routes.geojson with {len(all_features)} features")
-    print(f"Saved index to {os.path.join(OUTPUT_DIR, 'routes_index.json')}")
+    print(f"Saved {len(route_features)} route files to {output_dir}")
+    print(f"Saved all_routes.geojson with {feature_count} features")
+    print(f"Saved index to {os.path.join(output_dir, 'routes_index.json')}")
+    return route_features
+
+def add_simplification_arguments(parser):
+    """--tolerance and --precision options, shared with pipeline.py."""
+    parser.add_argument('--tolerance', type=float, default=0,
+                        help="Douglas-Peucker tolerance in metres for route shapes (default: 0, keep every point)")
+    parser.add_argument('--precision', type=int, default=None,
+                        help="round route coordinates to this many decimals (default: full precision)")
+
+def add_dedupe_argument(parser):
+    """--dedupe-shapes option, shared with pipeline.py."""
+    parser.add_argument('--dedupe-shapes', action='store_true',
+                        help=f"store each distinct shape geometry once in {SHAPES_DIR}/ and reference it from "
+                             "the route files")
 
 def main():
+    parser = argparse.ArgumentParser(description="Generate route GeoJSON files from GTFS shapes")
+    add_simplification_arguments(parser)
+    add_dedupe_argument(parser)
+    args = parser.parse_args()
+
     if not os.path.exists(GTFS_ZIP_PATH):
         print(f"File not found: {GTFS_ZIP_PATH}")
         return
@@ -141,7 +325,8 @@ def main():
         return
         
     routes, trips, shapes = data
-    process_data(routes, trips, shapes)
+    process_data(routes, trips, shapes, tolerance_m=args.tolerance, precision=args.precision,
+                 dedupe_shapes=args.dedupe_shapes)
 
 if __name__ == "__main__":
     main()
@@ -1,115 +1,228 @@
 import pandas as pd
-import zipfile
+import numpy as np
+import argparse
 import json
 import os
 
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from stop_index import GRID_CELL_DEGREES, GRID_DIR, save_stop_grid
+from stop_search import SEARCH_DIR, save_search_index
+from stop_times_stream import DEFAULT_MEMORY_BUDGET_MB, stop_route_pairs, stream_stop_times
+
 # Paths
-GTFS_ZIP_PATH = os.path.join('..', 'GTFS-2025-10-28.zip')
 OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+# Dictionary-encoded stops (route indexes into routes_index.json)
+ENCODED_STOPS_NAME = 'stops_encoded.json'
 
 def load_gtfs_stops_data(zip_path):
     """Load GTFS data related to stops and routes."""
-    print(f"Loading GTFS data from {zip_path}...")
-    with zipfile.ZipFile(zip_path) as z:
-        # Check files
-        filenames = z.namelist()
-        print(f"Files in zip: {filenames}")
-        
-        required_files = ['stops.txt', 'stop_times.txt', 'trips.txt', 'routes.txt']
-        for required in required_files:
-            if required not in filenames:
-                print(f"Error: {required} not found!")
-                return None
-        
-        # Load necessary files
-        with z.open('stops.txt') as f:
-            stops = pd.read_csv(f)
-        
-        with z.open('stop_times.txt') as f:
-            stop_times = pd.read_csv(f)
-            
-        with z.open('trips.txt') as f:
-            trips = pd.read_csv(f)
-            
-        with z.open('routes.txt') as f:
-            routes = pd.read_csv(f)
-            
-    return stops, stop_times, trips, routes
-
-def process_stops_data(stops, stop_times, trips, routes):
-    """Process stop data to create a mapping of stops to routes."""
-    print("Processing stops data...")
-    
-    # Create output directory if it doesn't exist
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-        print(f"Created directory {OUTPUT_DIR}")
-    
-    # Link stop_times -> trips -> routes
+    feed = load_feed(zip_path, ['stops', 'stop_times', 'trips', 'routes'])
+    if feed is None:
+        return None
+
+    return feed['stops'], feed['stop_times'], feed['trips'], feed['routes']
+
+def stream_gtfs_stops_data(zip_path, memory_budget_mb):
+    """Load stops, trips and routes, and fold stop_times.txt into stop-route pairs in chunks."""
+    feed = load_feed(zip_path, ['stops', 'trips', 'routes'], fill_cache=False)
+    if feed is None:
+        return None
+
+    stop_routes, _ = stream_stop_times(zip_path, feed['trips'], feed['stops'], memory_budget_mb)
+    return feed['stops'], stop_routes, feed['routes']
+
+def get_stop_routes(stop_times, trips):
+    """Link stop_times -> trips -> routes and return the unique stop-route pairs."""
     # stop_times has: trip_id, stop_id
     # trips has: trip_id, route_id
-    # routes has: route_id, route_short_name, route_long_name, etc.
-    
-    print(f"Total stops: {len(stops)}")
     print(f"Total stop_times entries: {len(stop_times)}")
     print(f"Total trips: {len(trips)}")
-    print(f"Total routes: {len(routes)}")
-    
-    # Merge stop_times with trips to get route_id for each stop
-    print("Merging stop_times with trips...")
-    stop_trips = pd.merge(
-        stop_times[['trip_id', 'stop_id']].drop_duplicates(),
-        trips[['trip_id', 'route_id']],
-        on='trip_id'
-    )
-    
-    # Get unique stop_id and route_id combinations
+
     print("Getting unique stop-route combinations...")
-    stop_routes = stop_trips[['stop_id', 'route_id']].drop_duplicates()
-    
-    # Merge with route details
-    print("Merging with route details...")
-    stop_routes_detailed = pd.merge(stop_routes, routes, on='route_id')
+    return stop_route_pairs(stop_times, trips)
+
+def process_stops_data(stops, stop_routes, routes, output_dir=OUTPUT_DIR, indexed_route_ids=None):
+    """Process stop data to create a mapping of stops to routes.
+
+    With `indexed_route_ids` (the route_ids of routes_index.json, in order),
+    the dictionary-encoded stops_encoded.json is written too.
+    """
+    print("Processing stops data...")
     
-    # Merge with stop details (coordinates, name)
-    print("Merging with stop details...")
-    stop_routes_detailed = pd.merge(stop_routes_detailed, stops, on='stop_id')
+    # Create output directory if it doesn't exist
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+        print(f"Created directory {output_dir}")
     
-    # Group by stop to get all routes serving each stop
-    print("Grouping routes by stop...")
+    # routes has: route_id, route_short_name, route_long_name, etc.
+    print(f"Total stops: {len(stops)}")
+    print(f"Total stop-route pairs: {len(stop_routes)}")
+    print(f"Total routes: {len(routes)}")
+
+    adjacency = stop_route_adjacency(stops, stop_routes, routes)
+    stops_with_routes = stops_with_routes_from_adjacency(adjacency, stops)
+    save_stop_outputs(stops_with_routes, output_dir, adjacency, indexed_route_ids)
+    return stops_with_routes
+
+def csr_adjacency(stop_codes, route_codes, n_stops, n_routes):
+    """Stop->route and route->stop CSR arrays (offsets + indices) of integer-coded pairs.
+
+    Each stop keeps its routes in pair order; each route lists its stops
+    in stop code order.
+    """
+    order = np.argsort(stop_codes, kind='stable')
+    stop_offsets = np.concatenate([[0], np.cumsum(np.bincount(stop_codes, minlength=n_stops))])
+    stop_routes = route_codes[order]
+
+    # Transpose: the pairs are now sorted by stop, so a stable sort by route
+    # leaves every route's stops sorted
+    pair_stops = stop_codes[order]
+    order = np.argsort(stop_routes, kind='stable')
+    route_offsets = np.concatenate([[0], np.cumsum(np.bincount(stop_routes, minlength=n_routes))])
+    route_stops = pair_stops[order]
+
+    return {
+        'stop_offsets': stop_offsets,
+        'stop_routes': stop_routes,
+        'route_offsets': route_offsets,
+        'route_stops': route_stops,
+    }
+
+def route_details(routes):
+    """Route info dict of every row of `routes`, as stored in stops_with_routes.json."""
+    return [{
+        'route_id': str(row['route_id']),
+        'route_short_name': str(row['route_short_name']),
+        'route_long_name': str(row['route_long_name']) if pd.notna(row['route_long_name']) else "",
+        'route_color': f"{row['route_color']}" if pd.notna(row['route_color']) else "000000",
+        'route_text_color': f"{row['route_text_color']}" if pd.notna(row['route_text_color']) else "FFFFFF"
+    } for row in routes.to_dict('records')]
+
+def stop_route_adjacency(stops, stop_routes, routes):
+    """The stop-route relation as integer-coded CSR arrays, in both directions.
+
+    Stops and routes are coded by their position in the sorted `stop_ids`
+    and `route_ids`. Pairs whose stop or route is missing from `stops` or
+    `routes` are dropped. `routes` holds one route info dict per route code,
+    shared by every stop the route serves.
+    """
+    known = stop_routes['stop_id'].isin(stops['stop_id']) & stop_routes['route_id'].isin(routes['route_id'])
+    pairs = stop_routes[known]
+    stop_codes, stop_ids = pd.factorize(pairs['stop_id'].astype(str), sort=True)
+    route_codes, route_ids = pd.factorize(pairs['route_id'].astype(str), sort=True)
+
+    route_rows = routes.assign(route_id=routes['route_id'].astype(str)).drop_duplicates('route_id')
+    route_rows = route_rows.set_index('route_id', drop=False).loc[route_ids]
+
+    return {
+        'stop_ids': stop_ids.tolist(),
+        'route_ids': route_ids.tolist(),
+        'routes': route_details(route_rows),
+        **csr_adjacency(stop_codes, route_codes, len(stop_ids), len(route_ids)),
+    }
+
+def adjacency_from_stops_with_routes(stops_with_routes):
+    """stop_route_adjacency of an existing stops_with_routes list (sorted by stop_id)."""
+    route_counts = np.array([len(stop['routes']) for stop in stops_with_routes], dtype=np.int64)
+    pair_routes = [route['route_id'] for stop in stops_with_routes for route in stop['routes']]
+    route_codes, route_ids = pd.factorize(pd.Series(pair_routes, dtype=object), sort=True)
+    stop_codes = np.repeat(np.arange(len(stops_with_routes)), route_counts)
+
+    details = {route['route_id']: route for stop in stops_with_routes for route in stop['routes']}
+    return {
+        'stop_ids': [stop['stop_id'] for stop in stops_with_routes],
+        'route_ids': route_ids.tolist(),
+        'routes': [details[route_id] for route_id in route_ids],
+        **csr_adjacency(stop_codes, route_codes.astype(np.int64), len(stops_with_routes), len(route_ids)),
+    }
+
+def stops_with_routes_from_adjacency(adjacency, stops):
+    """Build the stops_with_routes list (sorted by stop_id) from the CSR adjacency."""
+    print("Building stops with routes...")
+    stop_rows = stops.assign(stop_id=stops['stop_id'].astype(str)).drop_duplicates('stop_id')
+    stop_rows = stop_rows.set_index('stop_id', drop=False).loc[adjacency['stop_ids']].to_dict('records')
+
+    offsets = adjacency['stop_offsets'].tolist()
+    stop_routes = adjacency['stop_routes'].tolist()
+    routes = adjacency['routes']
+
     stops_with_routes = []
-    
-    for stop_id, group in stop_routes_detailed.groupby('stop_id'):
-        first_row = group.iloc[0]
-        
-        # Get list of routes serving this stop
-        routes_list = []
-        for _, row in group.iterrows():
-            route_info = {
-                'route_id': str(row['route_id']),
-                'route_short_name': str(row['route_short_name']),
-                'route_long_name': str(row['route_long_name']) if pd.notna(row['route_long_name']) else "",
-                'route_color': f"{row['route_color']}" if pd.notna(row['route_color']) else "000000",
-                'route_text_color': f"{row['route_text_color']}" if pd.notna(row['route_text_color']) else "FFFFFF"
-            }
-            routes_list.append(route_info)
-        
-        stop_info = {
-            'stop_id': str(stop_id),
-            'stop_name': str(first_row['stop_name']) if pd.notna(first_row['stop_name']) else "",
-            'stop_lat': float(first_row['stop_lat']),
-            'stop_lon': float(first_row['stop_lon']),
-            'stop_code': str(first_row['stop_code']) if 'stop_code' in first_row and pd.notna(first_row['stop_code']) else "",
+    for i, row in enumerate(stop_rows):
+        routes_list = [routes[code] for code in stop_routes[offsets[i]:offsets[i + 1]]]
+        stops_with_routes.append({
+            'stop_id': row['stop_id'],
+            'stop_name': str(row['stop_name']) if pd.notna(row['stop_name']) else "",
+            'stop_lat': float(row['stop_lat']),
+            'stop_lon': float(row['stop_lon']),
+            'stop_code': str(row['stop_code']) if 'stop_code' in row and pd.notna(row['stop_code']) else "",
             'routes': routes_list,
             'route_count': len(routes_list)
-        }
-        stops_with_routes.append(stop_info)
-    
-    # Sort by stop_id for easier lookup
-    stops_with_routes.sort(key=lambda x: x['stop_id'])
-    
+        })
+
+    return stops_with_routes
+
+def build_stops_with_routes(stops, stop_routes, routes):
+    """Build the stops_with_routes list (sorted by stop_id) from stop-route pairs."""
+    return stops_with_routes_from_adjacency(stop_route_adjacency(stops, stop_routes, routes), stops)
+
+def encode_stops(stops_with_routes, adjacency, indexed_route_ids):
+    """Dictionary-encoded stops: stop columns plus CSR route indexes into routes_index.json, both ways.
+
+    `route_offsets`/`route_indexes` give the routes_index.json positions of
+    each stop's routes; `stop_offsets`/`stops` give the stop positions of
+    each routes_index.json entry. Routes missing from routes_index.json
+    (no shape) are left out. Returns (encoded dict, dropped pair count).
+    """
+    position = pd.Index(indexed_route_ids).get_indexer(adjacency['route_ids'])
+    pair_stops = np.repeat(np.arange(len(adjacency['stop_ids'])), np.diff(adjacency['stop_offsets']))
+    pair_routes = position[adjacency['stop_routes']]
+    indexed = pair_routes >= 0
+
+    csr = csr_adjacency(pair_stops[indexed], pair_routes[indexed], len(adjacency['stop_ids']),
+                        len(indexed_route_ids))
+    encoded = {
+        'routes_index': 'routes_index.json',
+        'stop_ids': adjacency['stop_ids'],
+        'stop_codes': [stop['stop_code'] for stop in stops_with_routes],
+        'stop_names': [stop['stop_name'] for stop in stops_with_routes],
+        'stop_lats': [stop['stop_lat'] for stop in stops_with_routes],
+        'stop_lons': [stop['stop_lon'] for stop in stops_with_routes],
+        'route_offsets': csr['stop_offsets'].tolist(),
+        'route_indexes': csr['stop_routes'].tolist(),
+        'stop_offsets': csr['route_offsets'].tolist(),
+        'stops': csr['route_stops'].tolist(),
+    }
+    return encoded, int((~indexed).sum())
+
+def stop_routes_encoded(encoded, routes_index, stop_id):
+    """Route info dicts of one stop from stops_encoded.json and routes_index.json."""
+    try:
+        i = encoded['stop_ids'].index(stop_id)
+    except ValueError:
+        return []
+    start, end = encoded['route_offsets'][i], encoded['route_offsets'][i + 1]
+    return [routes_index[r] for r in encoded['route_indexes'][start:end]]
+
+def load_indexed_route_ids(output_dir):
+    """route_ids of an existing routes_index.json, or None if there is none."""
+    path = os.path.join(output_dir, 'routes_index.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return [route['route_id'] for route in json.load(f)]
+
+def save_stop_outputs(stops_with_routes, output_dir, adjacency=None, indexed_route_ids=None):
+    """Save stops_with_routes.json, stops.geojson, routes_to_stops.json and the stop grid, and print statistics.
+
+    `adjacency` (see stop_route_adjacency) is derived from stops_with_routes
+    when not given. With `indexed_route_ids`, stops_encoded.json and the
+    search shards (see stop_search.py) are saved too.
+    """
+    if adjacency is None:
+        adjacency = adjacency_from_stops_with_routes(stops_with_routes)
+
     # Save stops data with routes
-    stops_file_path = os.path.join(OUTPUT_DIR, 'stops_with_routes.json')
+    stops_file_path = os.path.join(output_dir, 'stops_with_routes.json')
     with open(stops_file_path, 'w', encoding='utf-8') as f:
         json.dump(stops_with_routes, f, ensure_ascii=False, indent=2)
     
@@ -141,57 +254,92 @@ def process_stops_data(stops, stop_times, trips, routes):
         "features": features
     }
     
-    geojson_file_path = os.path.join(OUTPUT_DIR, 'stops.geojson')
+    geojson_file_path = os.path.join(output_dir, 'stops.geojson')
     with open(geojson_file_path, 'w', encoding='utf-8') as f:
         json.dump(geojson, f, ensure_ascii=False, indent=2)
     
     print(f"Saved stops GeoJSON to {geojson_file_path}")
     
-    # Create a reverse index: route_id -> list of stop_ids
+    # Reverse index route_id -> stop_ids, straight from the route->stop CSR arrays
     print("Creating route-to-stops index...")
-    route_stops = {}
-    for stop in stops_with_routes:
-        for route in stop['routes']:
-            route_id = route['route_id']
-            if route_id not in route_stops:
-                route_stops[route_id] = {
-                    'route_id': route_id,
-                    'route_short_name': route['route_short_name'],
-                    'route_long_name': route['route_long_name'],
-                    'stop_ids': []
-                }
-            route_stops[route_id]['stop_ids'].append(stop['stop_id'])
-    
-    # Convert to list and sort
-    route_stops_list = list(route_stops.values())
-    route_stops_list.sort(key=lambda x: x['route_id'])
+    stop_ids = adjacency['stop_ids']
+    route_offsets = adjacency['route_offsets'].tolist()
+    route_stops = adjacency['route_stops'].tolist()
+    route_stops_list = [{
+        'route_id': route['route_id'],
+        'route_short_name': route['route_short_name'],
+        'route_long_name': route['route_long_name'],
+        'stop_ids': [stop_ids[code] for code in route_stops[route_offsets[r]:route_offsets[r + 1]]]
+    } for r, route in enumerate(adjacency['routes'])]
     
-    route_stops_file_path = os.path.join(OUTPUT_DIR, 'routes_to_stops.json')
+    route_stops_file_path = os.path.join(output_dir, 'routes_to_stops.json')
     with open(route_stops_file_path, 'w', encoding='utf-8') as f:
         json.dump(route_stops_list, f, ensure_ascii=False, indent=2)
     
     print(f"Saved route-to-stops mapping to {route_stops_file_path}")
+
+    if indexed_route_ids is not None:
+        encoded, dropped = encode_stops(stops_with_routes, adjacency, indexed_route_ids)
+        encoded_file_path = os.path.join(output_dir, ENCODED_STOPS_NAME)
+        with open(encoded_file_path, 'w', encoding='utf-8') as f:
+            json.dump(encoded, f, ensure_ascii=False, separators=(',', ':'))
+        print(f"Saved dictionary-encoded stops to {encoded_file_path} "
+              f"({os.path.getsize(encoded_file_path) / 1024:.0f} KB vs "
+              f"{os.path.getsize(stops_file_path) / 1024:.0f} KB)"
+              f"{f', {dropped} pairs of routes missing from routes_index.json left out' if dropped else ''}")
+
+        # Search shards over stop codes, stop names and the names of the
+        # indexed routes that serve a stop, in routes_index.json order
+        details = dict(zip(adjacency['route_ids'], adjacency['routes']))
+        routes_index = [details[route_id] for route_id in indexed_route_ids if route_id in details]
+        shard_count = save_search_index(stops_with_routes, routes_index, output_dir)
+        print(f"Saved {shard_count} search shards to {os.path.join(output_dir, SEARCH_DIR)}")
+    
+    # Spatial index for nearby-route lookups: one small shard per grid cell
+    shard_count = save_stop_grid(stops_with_routes, output_dir)
+    print(f"Saved {shard_count} stop grid shards ({GRID_CELL_DEGREES} degree cells) to "
+          f"{os.path.join(output_dir, GRID_DIR)}")
     
     # Print some statistics
     print("\n=== Statistics ===")
     print(f"Total unique stops: {len(stops_with_routes)}")
-    print(f"Total unique routes: {len(route_stops)}")
+    print(f"Total unique routes: {len(adjacency['route_ids'])}")
     avg_routes_per_stop = sum(s['route_count'] for s in stops_with_routes) / len(stops_with_routes)
     print(f"Average routes per stop: {avg_routes_per_stop:.2f}")
     max_routes_stop = max(stops_with_routes, key=lambda x: x['route_count'])
     print(f"Stop with most routes: {max_routes_stop['stop_name']} ({max_routes_stop['route_count']} routes)")
 
 def main():
+    parser = argparse.ArgumentParser(description="Build stop -> route outputs from a GTFS feed")
+    parser.add_argument('--stream', action='store_true',
+                        help="read stop_times.txt in chunks instead of loading it whole")
+    parser.add_argument('--memory-budget', type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help=f"memory budget in MB for --stream (default: {DEFAULT_MEMORY_BUDGET_MB})")
+    args = parser.parse_args()
+
     if not os.path.exists(GTFS_ZIP_PATH):
         print(f"File not found: {GTFS_ZIP_PATH}")
         return
 
-    data = load_gtfs_stops_data(GTFS_ZIP_PATH)
-    if not data:
-        return
-        
-    stops, stop_times, trips, routes = data
-    process_stops_data(stops, stop_times, trips, routes)
+    if args.stream:
+        data = stream_gtfs_stops_data(GTFS_ZIP_PATH, args.memory_budget)
+        if not data:
+            return
+
+        stops, stop_routes, routes = data
+    else:
+        data = load_gtfs_stops_data(GTFS_ZIP_PATH)
+        if not data:
+            return
+
+        stops, stop_times, trips, routes = data
+        stop_routes = get_stop_routes(stop_times, trips)
+
+    # Route indexes point into the routes_index.json of process_gtfs.py, when it has run
+    indexed_route_ids = load_indexed_route_ids(OUTPUT_DIR)
+    if indexed_route_ids is None:
+        print(f"No routes_index.json in {OUTPUT_DIR} yet, skipping {ENCODED_STOPS_NAME}")
+    process_stops_data(stops, stop_routes, routes, indexed_route_ids=indexed_route_ids)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import GTFS_ZIP_PATH, format_gtfs_time, load_feed
+from headways import calculate_all_route_headways, first_stop_departures, get_weekday_services
+from process_stops import route_details
+from stop_headways import calculate_stop_route_headways, categorical_codes, row_route_codes, stop_frequencies_at
+from stop_times_stream import stop_route_pairs
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Distinct queries whose responses are kept (see FeedIndex.query)
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_DEPARTURES = 20
+MAX_DEPARTURES = 500
+# Longest request head accepted, in bytes
+MAX_REQUEST_BYTES = 8192
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+class QueryError(Exception):
+    """A query that cannot be answered, with the HTTP status to answer it with."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+def parse_clock(value):
+    """HH:MM or HH:MM:SS (hours past 24 allowed, as in GTFS) -> seconds since midnight."""
+    parts = value.split(':')
+    if len(parts) not in (2, 3) or not all(part.isdigit() for part in parts):
+        raise QueryError(400, f"invalid time {value!r}, expected HH:MM[:SS]")
+    hours, minutes, seconds = (int(part) for part in parts + ['0'] * (3 - len(parts)))
+    if minutes > 59 or seconds > 59:
+        raise QueryError(400, f"invalid time {value!r}, expected HH:MM[:SS]")
+    return hours * 3600 + minutes * 60 + seconds
+
+def parse_int(params, name, default=None):
+    """Integer query parameter, or `default` when absent."""
+    if name not in params:
+        return default
+    try:
+        return int(params[name])
+    except ValueError:
+        raise QueryError(400, f"{name} must be an integer") from None
+
+class FeedIndex:
+    """The feed loaded once into indexed structures for headway, departure and stop queries.
+
+    Headways and departures cover the weekday services, like
+    route_frequencies.json: route headways from the first-stop departures,
+    stop headways from every departure at the stop. Departures are sorted
+    by (stop, time), so the departures of a stop are one slice of flat
+    arrays and a time lookup is a binary search in it. Stop -> route lookups
+    cover every service.
+
+    Responses are serialized once and kept in an LRU cache keyed by the
+    request path and its sorted parameters.
+    """
+
+    def __init__(self, feed, cache_size=DEFAULT_CACHE_SIZE):
+        routes, trips, stop_times = feed['routes'], feed['trips'], feed['stop_times']
+        service_ids = get_weekday_services(feed['calendar'])
+
+        self.routes = {info['route_id']: info for info in route_details(routes.drop_duplicates('route_id'))}
+        self.routes_by_name = {}
+        for route_id, info in self.routes.items():
+            self.routes_by_name.setdefault(info['route_short_name'], []).append(route_id)
+
+        stops = feed['stops'].assign(stop_id=feed['stops']['stop_id'].astype(str)).drop_duplicates('stop_id')
+        self.stops = {row['stop_id']: {
+            'stop_id': row['stop_id'],
+            'stop_code': str(row['stop_code']) if pd.notna(row['stop_code']) else "",
+            'stop_name': str(row['stop_name']) if pd.notna(row['stop_name']) else "",
+        } for row in stops.to_dict('records')}
+
+        self.route_headways = calculate_all_route_headways(trips, first_stop_departures(stop_times), service_ids)
+        self.stop_headways = calculate_stop_route_headways(trips, stop_times, service_ids)
+        self.stop_headway_index = {stop_id: i for i, stop_id in enumerate(self.stop_headways['stop_ids'])}
+
+        self.stop_routes = {}
+        for stop_id, route_id in stop_route_pairs(stop_times, trips).itertuples(index=False):
+            self.stop_routes.setdefault(str(stop_id), []).append(str(route_id))
+
+        self.build_departures(trips, stop_times, service_ids)
+        self.cached_query = lru_cache(maxsize=cache_size)(self.query)
+
+    def build_departures(self, trips, stop_times, service_ids):
+        """Departure arrays of the trips running on `service_ids`, sorted by stop then time."""
+        service_trips = trips.loc[trips['service_id'].isin(service_ids), ['trip_id', 'route_id']]
+        service_trips = service_trips.drop_duplicates('trip_id')
+        route_codes, route_ids = pd.factorize(service_trips['route_id'].astype(str), sort=True)
+
+        trip_codes, trip_ids = categorical_codes(stop_times['trip_id'])
+        row_routes = row_route_codes(trip_codes, trip_ids, service_trips['trip_id'], route_codes)
+
+        stop_codes, stop_ids = categorical_codes(stop_times['stop_id'])
+        departures = stop_times['departure_time'].to_numpy()
+        keep = np.flatnonzero((row_routes >= 0) & (stop_codes >= 0) & (departures >= 0))
+        order = keep[np.lexsort((departures[keep], stop_codes[keep]))]
+
+        self.departure_route_ids = route_ids.tolist()
+        self.departure_route_codes = {route_id: i for i, route_id in enumerate(self.departure_route_ids)}
+        self.departure_route_names = [self.routes[route_id]['route_short_name'] if route_id in self.routes else ""
+                                      for route_id in self.departure_route_ids]
+        self.departure_trip_ids = [str(trip_id) for trip_id in trip_ids]
+        self.departure_stop_index = {str(stop_id): i for i, stop_id in enumerate(stop_ids)}
+        self.departure_offsets = np.searchsorted(stop_codes[order], np.arange(len(stop_ids) + 1))
+        self.departure_times = departures[order].astype(np.int32)
+        self.departure_routes = row_routes[order].astype(np.int32)
+        self.departure_trips = trip_codes[order].astype(np.int32)
+
+    @classmethod
+    def load(cls, zip_path=GTFS_ZIP_PATH, cache_size=DEFAULT_CACHE_SIZE):
+        """Index of a GTFS zip (through the loader's Parquet cache), or None if tables are missing."""
+        feed = load_feed(zip_path, ['routes', 'trips', 'stop_times', 'stops', 'calendar'])
+        if feed is None:
+            return None
+        return cls(feed, cache_size)
+
+    def resolve_routes(self, route):
+        """route_ids of a route_id or a route_short_name (all its variants)."""
+        if route in self.routes:
+            return [route]
+        route_ids = self.routes_by_name.get(route)
+        if not route_ids:
+            raise QueryError(404, f"unknown route {route!r}")
+        return route_ids
+
+    def stop(self, stop_id):
+        """Stop info dict, for a stop_id of stops.txt."""
+        if stop_id not in self.stops:
+            raise QueryError(404, f"unknown stop {stop_id!r}")
+        return self.stops[stop_id]
+
+    def routes_query(self, params):
+        """Variants of a route: /routes?route=<route_id or short name>."""
+        return [self.routes[route_id] for route_id in self.resolve_routes(params['route'])]
+
+    def headways_query(self, params):
+        """Weekday headways by route, by hour over every route, or by stop.
+
+        /headways?route=R[&hour=H]: stats and hourly profile of every
+        variant of R (or just hour H). /headways?hour=H: that hour of every
+        route with trips in it. /headways?stop=S[&route=R]: the routes at S,
+        from their departures there.
+        """
+        hour = parse_int(params, 'hour')
+        if 'stop' in params:
+            stop = self.stop(params['stop'])
+            i = self.stop_headway_index.get(stop['stop_id'])
+            frequencies = stop_frequencies_at(self.stop_headways, i) if i is not None else {}
+            if 'route' in params:
+                route_ids = set(self.resolve_routes(params['route']))
+                frequencies = {route_id: stats for route_id, stats in frequencies.items() if route_id in route_ids}
+            return {**stop, 'routes': frequencies}
+
+        if 'route' in params:
+            route_ids = self.resolve_routes(params['route'])
+        elif hour is not None:
+            route_ids = self.route_headways
+        else:
+            raise QueryError(400, "headways needs a route, hour or stop parameter")
+
+        result = {}
+        for route_id in route_ids:
+            stats = self.route_headways.get(route_id)
+            if stats is None:
+                continue
+            if hour is not None:
+                hourly = [entry for entry in stats['hourly_profile'] if entry['hour'] == hour and entry['trips']]
+                if not hourly:
+                    continue
+                stats = hourly[0]
+            result[route_id] = stats
+        return result
+
+    def departures_query(self, params):
+        """Next weekday departures at a stop: /departures?stop=S[&after=HH:MM][&route=R][&limit=N]."""
+        stop = self.stop(params['stop'])
+        after = parse_clock(params.get('after', '00:00'))
+        limit = min(max(parse_int(params, 'limit', DEFAULT_DEPARTURES), 0), MAX_DEPARTURES)
+
+        code = self.departure_stop_index.get(stop['stop_id'])
+        if code is None:
+            return {**stop, 'departures': []}
+        start, end = self.departure_offsets[code], self.departure_offsets[code + 1]
+        start += np.searchsorted(self.departure_times[start:end], after)
+
+        if 'route' in params:
+            codes = [self.departure_route_codes[route_id] for route_id in self.resolve_routes(params['route'])
+                     if route_id in self.departure_route_codes]
+            positions = np.arange(start, end)
+            positions = positions[np.isin(self.departure_routes[start:end], codes)][:limit]
+        else:
+            positions = np.arange(start, min(end, start + limit))
+
+        departures = [{
+            'departure_time': format_gtfs_time(seconds),
+            'route_id': self.departure_route_ids[route],
+            'route_short_name': self.departure_route_names[route],
+            'trip_id': self.departure_trip_ids[trip],
+        } for seconds, route, trip in zip(self.departure_times[positions].tolist(),
+                                          self.departure_routes[positions].tolist(),
+                                          self.departure_trips[positions].tolist())]
+        return {**stop, 'departures': departures}
+
+    def stop_routes_query(self, params):
+        """Routes serving a stop on any service: /stop_routes?stop=S."""
+        stop = self.stop(params['stop'])
+        routes = [self.routes[route_id] for route_id in self.stop_routes.get(stop['stop_id'], [])
+                  if route_id in self.routes]
+        return {**stop, 'routes': routes}
+
+    def stats_query(self, params):
+        """Index sizes and LRU cache counters: /stats."""
+        cache = self.cached_query.cache_info()
+        return {
+            'routes': len(self.routes),
+            'stops': len(self.stops),
+            'departures': len(self.departure_times),
+            'cache': {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize, 'max_size': cache.maxsize},
+        }
+
+    ENDPOINTS = {
+        '/routes': (routes_query, ['route']),
+        '/headways': (headways_query, []),
+        '/departures': (departures_query, ['stop']),
+        '/stop_routes': (stop_routes_query, ['stop']),
+    }
+
+    def query(self, path, params):
+        """(HTTP status, JSON body bytes) of a query. `params` is a sorted tuple of (name, value) pairs."""
+        params = dict(params)
+        try:
+            if path not in self.ENDPOINTS:
+                raise QueryError(404, f"unknown endpoint {path!r}, expected one of {', '.join(self.ENDPOINTS)}")
+            handler, required = self.ENDPOINTS[path]
+            missing = [name for name in required if name not in params]
+            if missing:
+                raise QueryError(400, f"missing parameter(s): {', '.join(missing)}")
+            status, result = 200, handler(self, params)
+        except QueryError as e:
+            status, result = e.status, {'error': str(e)}
+        return status, json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def handle(self, target):
+        """(status, body) of a request target such as /departures?stop=X&after=07:00, through the cache."""
+        url = urlsplit(target)
+        if url.path == '/stats':
+            # Never cached, so the counters are current
+            return 200, json.dumps(self.stats_query({}), separators=(',', ':')).encode('utf-8')
+        return self.cached_query(url.path.rstrip('/') or '/', tuple(sorted(parse_qsl(url.query))))
+
+def http_response(status, body, keep_alive=True):
+    """Raw HTTP/1.1 response with a JSON body."""
+    head = (f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('ascii') + body
+
+async def serve_connection(index, reader, writer):
+    """Answer the GET requests of one (keep-alive) connection until the client closes it."""
+    try:
+        while True:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                break
+            lines = head.decode('latin-1').split('\r\n')
+            request = lines[0].split()
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+            keep_alive = (headers.get('connection', '').lower() != 'close' and
+                          len(request) == 3 and request[2] == 'HTTP/1.1')
+
+            if len(request) != 3:
+                status, body = 400, b'{"error":"malformed request line"}'
+                keep_alive = False
+            elif request[0] != 'GET':
+                status, body = 405, b'{"error":"only GET is supported"}'
+            else:
+                status, body = index.handle(request[1])
+
+            writer.write(http_response(status, body, keep_alive))
+            await writer.drain()
+            if not keep_alive:
+                break
+    finally:
+        writer.close()
+
+async def serve(index, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """Serve `index` over HTTP until cancelled."""
+    server = await asyncio.start_server(lambda reader, writer: serve_connection(index, reader, writer),
+                                        host, port, limit=MAX_REQUEST_BYTES)
+    print(f"Serving on http://{host}:{port} "
+          f"(endpoints: {', '.join(FeedIndex.ENDPOINTS)}, /stats)")
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve headway, departure and stop-route queries over HTTP")
+    parser.add_argument('gtfs', nargs='?', default=GTFS_ZIP_PATH,
+                        help=f"path to the GTFS zip (default: {GTFS_ZIP_PATH})")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f"responses kept in the LRU cache (default: {DEFAULT_CACHE_SIZE})")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gtfs):
+        print(f"File not found: {args.gtfs}")
+        return
+
+    start = time.perf_counter()
+    index = FeedIndex.load(args.gtfs, args.cache_size)
+    if index is None:
+        return
+    print(f"Indexed {len(index.routes)} routes, {len(index.stops)} stops and {len(index.departure_times)} "
+          f"weekday departures in {time.perf_counter() - start:.1f} s")
+
+    try:
+        asyncio.run(serve(index, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
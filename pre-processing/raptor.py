@@ -0,0 +1,390 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import GTFS_ZIP_PATH, format_gtfs_time, load_feed, parse_gtfs_times
+from service_calendar import build_service_days, day_type_services, parse_gtfs_dates, services_on
+from stop_index import haversine_m
+from trip_patterns import extract_trip_patterns, trip_times
+
+# Walking transfers between stops up to this far apart, at this speed
+MAX_WALK_M = 400
+WALK_SPEED_MPS = 1.2
+METRES_PER_DEGREE = 111_320
+
+MAX_TRANSFERS = 2
+UNREACHED = np.iinfo(np.int64).max
+
+# How a stop got its label in a round (see raptor)
+CARRIED, ORIGIN, RIDE, WALK = 0, 1, 2, 3
+
+def csr_gather(offsets, values, rows):
+    """Concatenated CSR slices values[offsets[r]:offsets[r + 1]] of every row in `rows`, and their sources."""
+    starts, ends = offsets[rows], offsets[rows + 1]
+    lengths = ends - starts
+    sources = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[sources]
+    return values[positions], sources
+
+def walking_transfers(lats, lons, max_walk_m=MAX_WALK_M, walk_speed=WALK_SPEED_MPS):
+    """Footpaths between stops within `max_walk_m`, as CSR arrays (offsets, target stops, walking seconds).
+
+    Stops are bucketed into grid cells at least `max_walk_m` wide, so only
+    the stops of the 3x3 neighbouring cells are measured.
+    """
+    n = len(lats)
+    if n == 0:
+        return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+    cell_lat = max_walk_m / METRES_PER_DEGREE
+    cell_lon = cell_lat / np.cos(np.radians(np.mean(lats)))
+    cells = pd.DataFrame({'row': np.floor(lats / cell_lat).astype(np.int64),
+                          'col': np.floor(lons / cell_lon).astype(np.int64),
+                          'stop': np.arange(n)})
+
+    pairs = []
+    for d_row in (-1, 0, 1):
+        for d_col in (-1, 0, 1):
+            shifted = cells.assign(row=cells['row'] + d_row, col=cells['col'] + d_col)
+            merged = pd.merge(shifted, cells, on=['row', 'col'], suffixes=('_from', '_to'))
+            pairs.append(merged[['stop_from', 'stop_to']].to_numpy())
+    pairs = np.concatenate(pairs)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+
+    distances = haversine_m(lats[pairs[:, 0]], lons[pairs[:, 0]], lats[pairs[:, 1]], lons[pairs[:, 1]])
+    near = distances <= max_walk_m
+    pairs, distances = pairs[near], distances[near]
+    order = np.lexsort((pairs[:, 1], pairs[:, 0]))
+    pairs, distances = pairs[order], distances[order]
+
+    offsets = np.searchsorted(pairs[:, 0], np.arange(n + 1))
+    return offsets, pairs[:, 1].astype(np.int32), np.ceil(distances / walk_speed).astype(np.int32)
+
+def fifo_lanes(arrivals, departures):
+    """Split trips sorted by departure into lanes in which no trip overtakes an earlier one.
+
+    RAPTOR takes the earliest boardable trip of a pattern to be the earliest
+    at every later stop too. Returns the lane of each trip.
+    """
+    lanes = np.zeros(len(arrivals), dtype=np.int64)
+    if len(arrivals) < 2 or ((np.diff(arrivals, axis=0) >= 0).all() and (np.diff(departures, axis=0) >= 0).all()):
+        return lanes
+
+    last_trips = []
+    for trip in range(len(arrivals)):
+        for lane, last in enumerate(last_trips):
+            if (arrivals[last] <= arrivals[trip]).all() and (departures[last] <= departures[trip]).all():
+                break
+        else:
+            lane = len(last_trips)
+            last_trips.append(trip)
+        last_trips[lane] = trip
+        lanes[trip] = lane
+    return lanes
+
+def build_timetable(trips, stop_times, stops, service_ids=None, max_walk_m=MAX_WALK_M,
+                    walk_speed=WALK_SPEED_MPS):
+    """Flat RAPTOR arrays of the trips running on `service_ids` (all trips if None).
+
+    Trips are grouped by their trip pattern (see trip_patterns.py), split
+    further if a trip overtakes another. Each pattern stores its stops
+    once and the times of its trips as a trip-major (trips x stops) block,
+    trips sorted by departure. Trips with a stop time missing both
+    arrival and departure are left out.
+
+    Returns a dict of arrays: pattern_stop_offsets/pattern_stops,
+    pattern_trip_offsets/trip_ids, pattern_time_offsets/arrivals/
+    departures, pattern_routes, stop_pattern_offsets/stop_patterns and the
+    walking transfers transfer_offsets/transfer_stops/transfer_seconds,
+    plus the stop_ids (and stop_index, stop_id -> code), stop_names and
+    route_ids they index into.
+    """
+    if service_ids is not None:
+        trips = trips[trips['service_id'].astype(str).isin([str(service_id) for service_id in service_ids])]
+    patterns = extract_trip_patterns(stop_times, trips)
+
+    stop_ids = pd.Index(stops['stop_id'].astype(str))
+    # Pattern stop codes -> rows of `stops` (-1 for stops missing there, which are skipped)
+    stop_rows = stop_ids.get_indexer(pd.Index(patterns['stop_ids']).astype(str))
+
+    pattern_routes, pattern_stops, trip_order, time_blocks = [], [], [], []
+    for pattern, route in enumerate(patterns['pattern_routes'].tolist()):
+        stop_slice = slice(patterns['pattern_stop_offsets'][pattern], patterns['pattern_stop_offsets'][pattern + 1])
+        pattern_stop_rows = stop_rows[patterns['pattern_stops'][stop_slice]]
+        known = pattern_stop_rows >= 0
+        members, arr, dep = trip_times(patterns, pattern)
+        arr, dep = arr[:, known], dep[:, known]
+        # A missing arrival or departure takes the other one
+        arr, dep = np.where(arr >= 0, arr, dep), np.where(dep >= 0, dep, arr)
+        complete = (arr >= 0).all(axis=1)
+        if not complete.any() or not known.any():
+            continue
+        members, arr, dep = members[complete], arr[complete], dep[complete]
+
+        by_departure = np.lexsort(dep.T[::-1])
+        members, arr, dep = members[by_departure], arr[by_departure], dep[by_departure]
+        lanes = fifo_lanes(arr, dep)
+        for lane in range(lanes.max() + 1):
+            in_lane = lanes == lane
+            pattern_routes.append(route)
+            pattern_stops.append(pattern_stop_rows[known])
+            trip_order.append(patterns['trip_codes'][members[in_lane]])
+            time_blocks.append((arr[in_lane].ravel(), dep[in_lane].ravel()))
+
+    def offsets(parts):
+        return np.r_[0, np.cumsum([len(part) for part in parts])].astype(np.int64)
+
+    def concat(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts else np.empty(0, dtype=dtype)
+
+    pattern_stop_offsets = offsets(pattern_stops)
+    flat_stops = concat(pattern_stops, np.int32)
+
+    # stop -> patterns through it (once each, even on loops)
+    stop_pattern_pairs = np.unique(np.stack([flat_stops.astype(np.int64),
+                                             np.repeat(np.arange(len(pattern_stops)),
+                                                       np.diff(pattern_stop_offsets))]), axis=1)
+    stop_pattern_offsets = np.searchsorted(stop_pattern_pairs[0], np.arange(len(stop_ids) + 1))
+
+    lats = stops['stop_lat'].to_numpy().astype(np.float64)
+    lons = stops['stop_lon'].to_numpy().astype(np.float64)
+    transfer_offsets, transfer_stops, transfer_seconds = walking_transfers(lats, lons, max_walk_m, walk_speed)
+
+    return {
+        'stop_ids': stop_ids.tolist(),
+        'stop_index': {stop_id: i for i, stop_id in enumerate(stop_ids)},
+        'stop_names': stops['stop_name'].astype(str).tolist(),
+        'route_ids': [str(route_id) for route_id in patterns['route_ids']],
+        'pattern_routes': np.array(pattern_routes, dtype=np.int32),
+        'pattern_stop_offsets': pattern_stop_offsets,
+        'pattern_stops': flat_stops,
+        'pattern_trip_offsets': offsets(trip_order),
+        'trip_ids': np.asarray(patterns['trip_ids']).astype(str)[concat(trip_order, np.int64)],
+        'pattern_time_offsets': offsets([arr for arr, _ in time_blocks]),
+        'arrivals': concat([arr for arr, _ in time_blocks], np.int32),
+        'departures': concat([dep for _, dep in time_blocks], np.int32),
+        'stop_pattern_offsets': stop_pattern_offsets,
+        'stop_patterns': stop_pattern_pairs[1].astype(np.int32),
+        'transfer_offsets': transfer_offsets,
+        'transfer_stops': transfer_stops,
+        'transfer_seconds': transfer_seconds,
+    }
+
+def pattern_block(timetable, pattern):
+    """Stops of a pattern and its (trips x stops) arrival and departure matrices."""
+    stops = timetable['pattern_stops'][timetable['pattern_stop_offsets'][pattern]:
+                                       timetable['pattern_stop_offsets'][pattern + 1]]
+    start, end = timetable['pattern_time_offsets'][pattern], timetable['pattern_time_offsets'][pattern + 1]
+    shape = (-1, len(stops))
+    return (stops, timetable['arrivals'][start:end].reshape(shape),
+            timetable['departures'][start:end].reshape(shape))
+
+def best_candidates(stops, arrivals):
+    """Earliest candidate per stop: indexes into the candidate arrays, one per distinct stop."""
+    order = np.lexsort((arrivals, stops))
+    if len(order) == 0:
+        return order
+    first = np.r_[True, stops[order][1:] != stops[order][:-1]]
+    return order[first]
+
+def raptor(timetable, origin, departure, max_transfers=MAX_TRANSFERS, target=None):
+    """Round-based earliest-arrival search from stop code `origin` at `departure` seconds.
+
+    Round k rides k vehicles: it scans every pattern through a stop improved
+    in round k - 1, boarding at each stop the earliest trip departing after
+    that round's label, then walks the footpaths from the stops it reached.
+    Ride arrivals are kept apart from walking ones, since walking on from a
+    ride can pay off even when another walk reached the stop earlier. With a
+    `target` stop code, arrivals later than the target's best are pruned.
+
+    Returns the (rounds x stops) arrival labels and, per round, how each
+    stop was reached: kind (CARRIED, ORIGIN, RIDE, WALK) and the stop walked
+    from, plus the round's ride arrival at the stop (ride_arrival) with its
+    pattern, trip within the pattern and board and alight positions.
+    """
+    n_stops, rounds = len(timetable['stop_ids']), max_transfers + 2
+    labels = np.full((rounds, n_stops), UNREACHED, dtype=np.int64)
+    parents = {name: np.full((rounds, n_stops), -1, dtype=np.int64)
+               for name in ('kind', 'walk_from', 'pattern', 'trip', 'board', 'alight')}
+    parents['ride_arrival'] = np.full((rounds, n_stops), UNREACHED, dtype=np.int64)
+    best = np.full(n_stops, UNREACHED, dtype=np.int64)
+    best_ride = np.full(n_stops, UNREACHED, dtype=np.int64)
+
+    def walk(k, from_stops, times):
+        targets, sources = csr_gather(timetable['transfer_offsets'], timetable['transfer_stops'], from_stops)
+        seconds, _ = csr_gather(timetable['transfer_offsets'], timetable['transfer_seconds'], from_stops)
+        chosen = best_candidates(targets, times[sources] + seconds)
+        targets, arrivals, sources = targets[chosen], times[sources[chosen]] + seconds[chosen], sources[chosen]
+        bound = best[target] if target is not None else UNREACHED
+        better = arrivals < np.minimum(best[targets], bound)
+        targets, arrivals = targets[better], arrivals[better]
+        labels[k, targets] = best[targets] = arrivals
+        parents['kind'][k, targets] = WALK
+        parents['walk_from'][k, targets] = from_stops[sources[better]]
+        return targets
+
+    labels[0, origin] = best[origin] = departure
+    parents['kind'][0, origin] = ORIGIN
+    marked = np.union1d([origin], walk(0, np.array([origin]), np.array([departure])))
+
+    for k in range(1, rounds):
+        labels[k] = labels[k - 1]
+        parents['kind'][k] = CARRIED
+        if len(marked) == 0:
+            break
+
+        patterns, _ = csr_gather(timetable['stop_pattern_offsets'], timetable['stop_patterns'], marked)
+        candidates = []
+        for pattern in np.unique(patterns).tolist():
+            stops, arrivals, departures = pattern_block(timetable, pattern)
+            previous = labels[k - 1, stops]
+            boardable = previous < UNREACHED
+            first = int(np.argmax(boardable))
+            n_trips, length = departures.shape
+            # Earliest trip leaving each stop at or after its previous-round label
+            board_trips = (departures[:, first:] < previous[first:]).sum(axis=0)
+            board_trips[~boardable[first:]] = n_trips
+            # Best (earliest) trip boarded at any earlier stop, and where
+            keys = np.minimum.accumulate(board_trips * length + np.arange(first, length))
+            keys = np.r_[n_trips * length, keys[:-1]]
+            trips, boards = keys // length, keys % length
+            ride = np.flatnonzero(trips < n_trips)
+            if len(ride) == 0:
+                continue
+            alights = ride + first
+            candidates.append((stops[alights], arrivals[trips[ride], alights], np.full(len(ride), pattern),
+                               trips[ride], boards[ride], alights))
+        if not candidates:
+            marked = np.empty(0, dtype=np.int64)
+            continue
+
+        stops, arrivals, patterns, trips, boards, alights = (np.concatenate(part) for part in zip(*candidates))
+        chosen = best_candidates(stops, arrivals)
+        bound = best[target] if target is not None else UNREACHED
+        chosen = chosen[arrivals[chosen] < np.minimum(best_ride[stops[chosen]], bound)]
+        ridden = stops[chosen].astype(np.int64)
+        arrivals = arrivals[chosen]
+        parents['ride_arrival'][k, ridden] = best_ride[ridden] = arrivals
+        for name, values in (('pattern', patterns), ('trip', trips), ('board', boards), ('alight', alights)):
+            parents[name][k, ridden] = values[chosen]
+
+        improved = ridden[arrivals < best[ridden]]
+        labels[k, improved] = best[improved] = parents['ride_arrival'][k, improved]
+        parents['kind'][k, improved] = RIDE
+
+        marked = np.union1d(improved, walk(k, ridden, parents['ride_arrival'][k, ridden]))
+
+    return labels, parents
+
+def ride_leg(timetable, parents, k, stop):
+    """The round-k ride to a stop code, and the stop code it boarded at."""
+    pattern, trip = int(parents['pattern'][k, stop]), int(parents['trip'][k, stop])
+    board, alight = int(parents['board'][k, stop]), int(parents['alight'][k, stop])
+    stops, arrivals, departures = pattern_block(timetable, pattern)
+    leg = {'mode': 'bus',
+           'route_id': timetable['route_ids'][timetable['pattern_routes'][pattern]],
+           'trip_id': str(timetable['trip_ids'][timetable['pattern_trip_offsets'][pattern] + trip]),
+           'from_stop': timetable['stop_ids'][stops[board]],
+           'to_stop': timetable['stop_ids'][stops[alight]],
+           'departure': format_gtfs_time(departures[trip, board]),
+           'arrival': format_gtfs_time(arrivals[trip, alight])}
+    return leg, int(stops[board])
+
+def journey_legs(timetable, labels, parents, k, stop):
+    """Legs of the round-k journey to a stop code, from the origin on."""
+    legs = []
+    while True:
+        kind = parents['kind'][k, stop]
+        if kind == CARRIED:
+            k -= 1
+            continue
+        if kind == ORIGIN:
+            return legs[::-1]
+
+        if kind == WALK:
+            from_stop = int(parents['walk_from'][k, stop])
+            departure = labels[0, from_stop] if k == 0 else parents['ride_arrival'][k, from_stop]
+            legs.append({'mode': 'walk', 'from_stop': timetable['stop_ids'][from_stop],
+                         'to_stop': timetable['stop_ids'][stop],
+                         'departure': format_gtfs_time(departure),
+                         'arrival': format_gtfs_time(labels[k, stop])})
+            stop = from_stop
+            if k == 0:
+                continue
+        # Walks after round 0 start where that round's ride ended
+        leg, stop = ride_leg(timetable, parents, k, stop)
+        legs.append(leg)
+        k -= 1
+
+def plan(timetable, origin_id, destination_id, departure, max_transfers=MAX_TRANSFERS):
+    """Journeys from one stop_id to another leaving at `departure` seconds since midnight.
+
+    One journey per number of rides that arrives earlier than all journeys
+    with fewer rides, each with its legs (bus rides and walks). A destination
+    within walking distance of the origin gives a walk-only journey first.
+    """
+    origin, destination = timetable['stop_index'].get(origin_id), timetable['stop_index'].get(destination_id)
+    if origin is None or destination is None:
+        return []
+
+    labels, parents = raptor(timetable, origin, departure, max_transfers, destination)
+    journeys, earliest = [], UNREACHED
+    for k in range(len(labels)):
+        arrival = labels[k, destination]
+        if arrival < earliest:
+            earliest = arrival
+            journeys.append({'rides': k, 'transfers': max(k - 1, 0), 'arrival': format_gtfs_time(arrival),
+                             'legs': journey_legs(timetable, labels, parents, k, destination)})
+    return journeys
+
+def load_timetable(zip_path=GTFS_ZIP_PATH, date=None, max_walk_m=MAX_WALK_M):
+    """Build the timetable of the services running on `date` (YYYYMMDD; default: a typical weekday)."""
+    feed = load_feed(zip_path, ['trips', 'stop_times', 'stops', 'calendar'], optional=['calendar_dates'])
+    if feed is None:
+        return None
+
+    service_days = build_service_days(feed['calendar'], feed.get('calendar_dates'))
+    if date is None:
+        date, service_ids = day_type_services(service_days).get('weekday', (None, None))
+    else:
+        service_ids = services_on(service_days, parse_gtfs_dates([date])[0])
+    print(f"Building the RAPTOR timetable for {date or 'all services'}...")
+
+    timetable = build_timetable(feed['trips'], feed['stop_times'], feed['stops'], service_ids, max_walk_m)
+    print(f"{len(timetable['pattern_routes'])} patterns, {len(timetable['trip_ids'])} trips, "
+          f"{len(timetable['transfer_stops'])} walking transfers")
+    return timetable
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan a journey between two stops with RAPTOR")
+    parser.add_argument('origin', help="origin stop_id")
+    parser.add_argument('destination', help="destination stop_id")
+    parser.add_argument('--time', default='07:30:00', help="departure time HH:MM:SS (default: 07:30:00)")
+    parser.add_argument('--date', help="service date YYYYMMDD (default: a typical weekday of the feed)")
+    parser.add_argument('--max-transfers', type=int, default=MAX_TRANSFERS)
+    parser.add_argument('--max-walk', type=float, default=MAX_WALK_M,
+                        help=f"longest walking transfer in metres (default: {MAX_WALK_M})")
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    timetable = load_timetable(GTFS_ZIP_PATH, args.date, args.max_walk)
+    if timetable is None:
+        return
+
+    journeys = plan(timetable, args.origin, args.destination, int(parse_gtfs_times([args.time])[0]),
+                    args.max_transfers)
+    if not journeys:
+        print(f"No journey from {args.origin} to {args.destination} with at most {args.max_transfers} transfers")
+    for journey in journeys:
+        print(f"\nArrive {journey['arrival']} after {journey['rides']} ride(s), {journey['transfers']} transfer(s):")
+        for leg in journey['legs']:
+            what = f"route {leg['route_id']}" if leg['mode'] == 'bus' else 'walk'
+            print(f"  {leg['departure']} {leg['from_stop']} -> {leg['arrival']} {leg['to_stop']} ({what})")
+
+if __name__ == "__main__":
+    main()
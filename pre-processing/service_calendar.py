@@ -0,0 +1,197 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+
+WEEKDAY_COLUMNS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Day types of the frequency profiles. Holidays run the Sunday service, so a
+# weekday with the same active services as a Sunday counts as sunday_holiday
+DAY_TYPES = ['weekday', 'saturday', 'sunday_holiday']
+
+def parse_gtfs_dates(values):
+    """YYYYMMDD strings -> datetime64[D] array."""
+    return pd.to_datetime(pd.Series(values, dtype='str'), format='%Y%m%d').to_numpy().astype('datetime64[D]')
+
+def day_of_week(dates):
+    """Monday = 0 ... Sunday = 6 of a datetime64[D] array (1970-01-01 was a Thursday)."""
+    return (np.asarray(dates, dtype='datetime64[D]').astype(np.int64) + 3) % 7
+
+def build_service_days(calendar, calendar_dates=None):
+    """Service-day bitmasks of every service_id, from calendar.txt and calendar_dates.txt.
+
+    The date axis runs from the earliest to the latest date either table
+    mentions. A service starts active on the days of its calendar.txt
+    weekday flags between start_date and end_date; calendar_dates then adds
+    (exception_type 1) or removes (exception_type 2) single dates.
+
+    Returns a dict with `service_ids`, the `first_date` of the axis, the
+    number of days `n_days` and `bits`, one np.packbits row per service
+    (bit d set = active on first_date + d).
+    """
+    if calendar_dates is None:
+        calendar_dates = pd.DataFrame({'service_id': [], 'date': [], 'exception_type': []})
+
+    service_ids = pd.Index(pd.concat([calendar['service_id'].astype(str),
+                                      calendar_dates['service_id'].astype(str)]).unique())
+    starts = parse_gtfs_dates(calendar['start_date'])
+    ends = parse_gtfs_dates(calendar['end_date'])
+    exception_dates = parse_gtfs_dates(calendar_dates['date'])
+
+    bounds = np.concatenate([starts, ends, exception_dates])
+    if len(bounds) == 0:
+        return {'service_ids': service_ids, 'first_date': np.datetime64('1970-01-01'), 'n_days': 0,
+                'bits': np.zeros((len(service_ids), 0), dtype=np.uint8)}
+    first_date = bounds.min()
+    days = np.arange(first_date, bounds.max() + 1)
+
+    # calendar.txt: weekday flag of the day's weekday, within the date range
+    flags = calendar[WEEKDAY_COLUMNS].to_numpy().astype(bool)
+    in_range = (days >= starts[:, None]) & (days <= ends[:, None])
+    row_active = flags[:, day_of_week(days)] & in_range
+
+    active = np.zeros((len(service_ids), len(days)), dtype=bool)
+    np.logical_or.at(active, service_ids.get_indexer(calendar['service_id'].astype(str)), row_active)
+
+    # calendar_dates.txt exceptions
+    codes = service_ids.get_indexer(calendar_dates['service_id'].astype(str))
+    offsets = (exception_dates - first_date).astype(np.int64)
+    exception_types = calendar_dates['exception_type'].to_numpy()
+    added, removed = exception_types == 1, exception_types == 2
+    active[codes[added], offsets[added]] = True
+    active[codes[removed], offsets[removed]] = False
+
+    return {'service_ids': service_ids, 'first_date': first_date, 'n_days': len(days),
+            'bits': np.packbits(active, axis=1)}
+
+def service_dates(service_days):
+    """Every date of the service_days axis (datetime64[D] array)."""
+    return np.arange(service_days['n_days']) + service_days['first_date']
+
+def active_services(service_days, dates):
+    """Boolean (service, date) matrix: which services run on each date. Dates off the axis run nothing."""
+    offsets = (np.asarray(dates, dtype='datetime64[D]') - service_days['first_date']).astype(np.int64)
+    valid = (offsets >= 0) & (offsets < service_days['n_days'])
+    offsets = np.where(valid, offsets, 0)
+    if service_days['n_days'] == 0:
+        return np.zeros((len(service_days['service_ids']), len(offsets)), dtype=bool)
+    bits = (service_days['bits'][:, offsets >> 3] >> (7 - (offsets & 7)).astype(np.uint8)) & 1
+    return bits.astype(bool) & valid
+
+def services_on(service_days, date):
+    """service_ids running on one date."""
+    return service_days['service_ids'][active_services(service_days, [date])[:, 0]].tolist()
+
+def active_trip_mask(trips, service_days, dates):
+    """Boolean (trip, date) matrix for the rows of `trips`, through their service_id.
+
+    Trips of service_ids the calendar doesn't know never run.
+    """
+    codes = service_days['service_ids'].get_indexer(trips['service_id'].astype(str))
+    active = active_services(service_days, dates)
+    # Unknown services (code -1) read an extra all-False row
+    active = np.vstack([active, np.zeros((1, active.shape[1]), dtype=bool)])
+    return active[codes]
+
+def service_set_keys(active):
+    """One comparable key per column of a (service, date) matrix, equal for dates running the same services."""
+    packed = np.packbits(active, axis=0).T.copy()
+    return packed.view(f'V{max(packed.shape[1], 1)}').ravel()
+
+def most_common_column(active, columns):
+    """The most common column of a (service, date) matrix among `columns` (a service set), or None."""
+    if not columns.any():
+        return None
+    keys = service_set_keys(active[:, columns])
+    _, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    return active[:, np.flatnonzero(columns)[first[np.argmax(counts)]]]
+
+def classify_days(service_days):
+    """Day type (index into DAY_TYPES) of every date on the axis, -1 for dates without service.
+
+    Holidays are weekdays running all the Sunday-only services: those of
+    the most common Sunday that don't run on the most common weekday
+    (usually added for the date through calendar_dates).
+    """
+    dates = service_dates(service_days)
+    dow = day_of_week(dates)
+    day_types = np.select([dow < 5, dow == 5], [0, 1], 2)
+
+    active = active_services(service_days, dates)
+    has_service = active.any(axis=0)
+    sunday = most_common_column(active, (dow == 6) & has_service)
+    weekday = most_common_column(active, (dow < 5) & has_service)
+    if sunday is not None:
+        sunday_only = sunday & ~weekday if weekday is not None else sunday
+        if sunday_only.any():
+            holidays = (day_types == 0) & active[sunday_only].all(axis=0)
+            day_types[holidays] = 2
+
+    day_types[~has_service] = -1
+    return day_types
+
+def representative_dates(service_days):
+    """Day type -> the date whose services define that day type's profile.
+
+    The most common set of active services among the dates of the day type
+    wins, and the earliest date with that set represents it. Day types
+    without any service date are left out.
+    """
+    dates = service_dates(service_days)
+    day_types = classify_days(service_days)
+    active = active_services(service_days, dates)
+    signatures = service_set_keys(active)
+
+    representatives = {}
+    for code, day_type in enumerate(DAY_TYPES):
+        candidates = np.flatnonzero(day_types == code)
+        if len(candidates) == 0:
+            continue
+        # np.unique's first indexes are the earliest dates of each set
+        _, first, counts = np.unique(signatures[candidates], return_index=True, return_counts=True)
+        best = counts == counts.max()
+        representatives[day_type] = dates[candidates[first[best].min()]]
+
+    return representatives
+
+def day_type_services(service_days):
+    """Day type -> (representative date as YYYY-MM-DD, service_ids running that day)."""
+    return {day_type: (str(date), services_on(service_days, date))
+            for day_type, date in representative_dates(service_days).items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the service days of a GTFS feed")
+    parser.add_argument('--date', help="also list the services running on this date (YYYYMMDD)")
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    feed = load_feed(GTFS_ZIP_PATH, ['calendar'], optional=['calendar_dates'])
+    if feed is None:
+        return
+
+    service_days = build_service_days(feed['calendar'], feed.get('calendar_dates'))
+    dates = service_dates(service_days)
+    day_types = classify_days(service_days)
+    print(f"{len(service_days['service_ids'])} services over {service_days['n_days']} days "
+          f"({dates[0] if len(dates) else '-'} to {dates[-1] if len(dates) else '-'})")
+    for code, day_type in enumerate(DAY_TYPES):
+        print(f"  {day_type}: {int((day_types == code).sum())} days")
+    for day_type, (date, services) in day_type_services(service_days).items():
+        print(f"  {day_type} profile: {date}, {len(services)} services")
+
+    holidays = dates[(day_types == 2) & (day_of_week(dates) < 5)]
+    if len(holidays):
+        print(f"Holidays: {', '.join(str(date) for date in holidays)}")
+
+    if args.date:
+        date = parse_gtfs_dates([args.date])[0]
+        print(f"Services on {date}: {', '.join(services_on(service_days, date)) or 'none'}")
+
+if __name__ == "__main__":
+    main()
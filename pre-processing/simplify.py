@@ -0,0 +1,123 @@
+import json
+
+import numpy as np
+import shapely
+
+# Mean Earth radius in metres, for the local equirectangular projection
+EARTH_RADIUS_M = 6_371_008.8
+
+# Per-route report of the last simplified build, relative to pre-processing/
+SIMPLIFICATION_REPORT = 'simplification_report.json'
+
+def project_to_metres(coords, ref_lat):
+    """Project [lon, lat] degrees to local x/y metres around `ref_lat`."""
+    radians = np.radians(coords)
+    return np.column_stack((
+        radians[:, 0] * EARTH_RADIUS_M * np.cos(np.radians(ref_lat)),
+        radians[:, 1] * EARTH_RADIUS_M,
+    ))
+
+def douglas_peucker(xy, tolerance):
+    """Mask of the points of a polyline kept by Douglas-Peucker simplification.
+
+    Distances are measured to the segment (not the infinite line) between the
+    kept end points, so closed loops simplify correctly and every dropped
+    point is within `tolerance` of the simplified line. The end points are
+    always kept.
+    """
+    n = len(xy)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+
+        segment = xy[last] - xy[first]
+        points = xy[first + 1:last] - xy[first]
+        length2 = segment @ segment
+        t = np.clip(points @ segment / length2, 0, 1) if length2 > 0 else np.zeros(len(points))
+        offsets = points - t[:, None] * segment
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            split = first + 1 + farthest
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return keep
+
+def simplify_coords(coords, tolerance_m=0, precision=None):
+    """Simplify a [lon, lat] LineString and round it to `precision` decimals.
+
+    Returns (coords, max_deviation_m), where the deviation is the Hausdorff
+    distance in metres between the original and the output line.
+    """
+    ref_lat = coords[:, 1].mean()
+    original = project_to_metres(coords, ref_lat)
+
+    result = coords
+    if tolerance_m > 0 and len(coords) > 2:
+        result = result[douglas_peucker(original, tolerance_m)]
+    if precision is not None:
+        result = np.round(result, precision)
+
+    deviation = shapely.hausdorff_distance(shapely.linestrings(original),
+                                           shapely.linestrings(project_to_metres(result, ref_lat)))
+    return result, float(deviation)
+
+def simplify_route_features(route_features, tolerance_m=0, precision=None):
+    """Simplify the geometry of every route feature (see build_route_features).
+
+    Returns (route_features, report): the same mapping with simplified
+    coordinate arrays, and per route the points and geometry bytes before
+    and after, and the worst-case deviation in metres of any of its shapes.
+    """
+    simplified = {}
+    report = {}
+    for route_id, features in route_features.items():
+        stats = {'points_before': 0, 'points_after': 0, 'bytes_before': 0, 'bytes_after': 0, 'max_deviation_m': 0.0}
+        simplified_features = []
+        for feature, coords in features:
+            new_coords, deviation = simplify_coords(coords, tolerance_m, precision)
+            simplified_features.append((feature, new_coords))
+
+            # Only the coordinates change, so their text length is the size difference
+            stats['points_before'] += len(coords)
+            stats['points_after'] += len(new_coords)
+            stats['bytes_before'] += len(json.dumps(coords.tolist()))
+            stats['bytes_after'] += len(json.dumps(new_coords.tolist()))
+            stats['max_deviation_m'] = max(stats['max_deviation_m'], round(deviation, 2))
+
+        simplified[route_id] = simplified_features
+        report[str(route_id)] = stats
+
+    return simplified, report
+
+def print_simplification_summary(report):
+    """Print totals and the routes with the largest deviation."""
+    if not report:
+        return
+
+    points_before = sum(stats['points_before'] for stats in report.values())
+    points_after = sum(stats['points_after'] for stats in report.values())
+    bytes_before = sum(stats['bytes_before'] for stats in report.values())
+    bytes_after = sum(stats['bytes_after'] for stats in report.values())
+    saved = bytes_before - bytes_after
+
+    print(f"Simplified {points_before} -> {points_after} shape points")
+    # Every feature is written twice: in its route file and in all_routes.geojson
+    print(f"Saved {saved / 1e6:.2f} MB of coordinates per copy "
+          f"({100 * saved / bytes_before if bytes_before else 0:.1f}%)")
+
+    worst = sorted(report.items(), key=lambda item: item[1]['max_deviation_m'], reverse=True)[:5]
+    print("Largest deviations: " + ", ".join(f"{route_id} {stats['max_deviation_m']} m" for route_id, stats in worst))
+
+def save_simplification_report(report, path=SIMPLIFICATION_REPORT):
+    """Save the per-route simplification report."""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
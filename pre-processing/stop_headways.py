@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import GTFS_ZIP_PATH, format_gtfs_time, load_feed
+from headways import PROFILE_END_HOUR, PROFILE_START_HOUR, get_weekday_services, grouped_headways
+
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+OUTPUT_NAME = 'stop_frequencies.json'
+
+def load_gtfs_stop_headway_data(zip_path):
+    """Load the GTFS tables needed for per-stop headways."""
+    feed = load_feed(zip_path, ['trips', 'stop_times', 'calendar'])
+    if feed is None:
+        return None
+
+    return feed['trips'], feed['stop_times'], feed['calendar']
+
+def categorical_codes(values):
+    """Codes and categories of a column, reusing the loader's categories when it has them."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype(np.int64), values.cat.categories
+    codes, categories = pd.factorize(values, sort=True)
+    return codes.astype(np.int64), categories
+
+def row_route_codes(trip_codes, trip_ids, trip_routes, route_codes):
+    """Route code of every stop_times row, -1 where the row has no trip_id or its trip no route.
+
+    `trip_codes` are the rows' codes into `trip_ids`; `trip_routes` is a
+    trip_id column and `route_codes` the route code of each of its trips.
+    Trips that are not in `trip_ids` are ignored.
+    """
+    trip_route = np.full(len(trip_ids), -1, dtype=np.int64)
+    codes = pd.Categorical(trip_routes, categories=trip_ids).codes
+    known = codes >= 0
+    trip_route[codes[known]] = np.asarray(route_codes)[known]
+    return np.where(trip_codes >= 0, trip_route[np.maximum(trip_codes, 0)], -1)
+
+def calculate_stop_route_headways(trips, stop_times, service_ids):
+    """Headway statistics for every (stop, route) pair, in one sort of the full stop_times table.
+
+    Every departure of a trip running on `service_ids` counts at its stop, so
+    a mid-route stop gets the frequency its riders actually see. Pairs are
+    ordered by stop, then route; `stop_offsets` gives each stop's slice of
+    the pair arrays.
+
+    Returns the columnar dict saved as stop_frequencies.json.
+    """
+    service_trips = trips.loc[trips['service_id'].isin(service_ids), ['trip_id', 'route_id']].drop_duplicates('trip_id')
+    route_codes, route_ids = pd.factorize(service_trips['route_id'], sort=True)
+
+    # trip -> route code, through the trip_id codes of stop_times
+    trip_codes, trip_ids = categorical_codes(stop_times['trip_id'])
+    row_routes = row_route_codes(trip_codes, trip_ids, service_trips['trip_id'], route_codes)
+
+    stop_codes, stop_ids = categorical_codes(stop_times['stop_id'])
+    departures = stop_times['departure_time'].to_numpy()
+    keep = (row_routes >= 0) & (stop_codes >= 0) & (departures >= 0)
+
+    # One group per (stop, route) pair present in the feed; unique() sorts
+    # them by stop, then route
+    n_routes = max(len(route_ids), 1)
+    pairs, pair_codes = np.unique(stop_codes[keep] * n_routes + row_routes[keep], return_inverse=True)
+    pair_stops = pairs // n_routes
+    pair_routes = pairs % n_routes
+
+    used_stops, pair_stop_index = np.unique(pair_stops, return_inverse=True)
+    stop_offsets = np.searchsorted(pair_stop_index, np.arange(len(used_stops) + 1))
+
+    stats = grouped_headways(pair_codes, len(pairs), departures[keep])
+
+    # Pairs without a positive headway get 0, like the route profiles
+    with np.errstate(divide='ignore', invalid='ignore'):
+        avg_headway = np.round(stats['headway_sum'] / stats['headway_count'], 1)
+        hour_avg_headway = np.round(stats['hour_headway_sum'] / stats['hour_headway_count'], 1)
+    has_headway = stats['headway_count'] > 0
+    avg_headway = np.where(has_headway, avg_headway, 0)
+    min_headway = np.where(has_headway, np.round(stats['headway_min'], 1), 0)
+    max_headway = np.where(has_headway, np.round(stats['headway_max'], 1), 0)
+    hour_avg_headway = np.where(stats['hour_headway_count'] > 0, hour_avg_headway, 0)
+
+    return {
+        'hours': list(range(PROFILE_START_HOUR, PROFILE_END_HOUR)),
+        'stop_ids': [str(stop_id) for stop_id in stop_ids[used_stops]],
+        'route_ids': [str(route_id) for route_id in route_ids],
+        'stop_offsets': stop_offsets.tolist(),
+        'route': pair_routes.tolist(),
+        'num_trips': stats['num_trips'].tolist(),
+        'first_departure': [format_gtfs_time(seconds) for seconds in stats['first_departure'].tolist()],
+        'last_departure': [format_gtfs_time(seconds) for seconds in stats['last_departure'].tolist()],
+        'avg_headway_minutes': avg_headway.tolist(),
+        'min_headway_minutes': min_headway.tolist(),
+        'max_headway_minutes': max_headway.tolist(),
+        'hourly_trips': stats['hour_trips'].tolist(),
+        'hourly_avg_headway_minutes': hour_avg_headway.tolist(),
+    }
+
+def stop_frequencies(columnar, stop_id):
+    """Frequency data of one stop from the columnar dict: {route_id: stats with an hourly_profile}."""
+    try:
+        i = columnar['stop_ids'].index(stop_id)
+    except ValueError:
+        return {}
+    return stop_frequencies_at(columnar, i)
+
+def stop_frequencies_at(columnar, i):
+    """stop_frequencies of the stop at position `i` of the columnar dict's stop_ids."""
+    result = {}
+    for pair in range(columnar['stop_offsets'][i], columnar['stop_offsets'][i + 1]):
+        route_id = columnar['route_ids'][columnar['route'][pair]]
+        result[route_id] = {
+            'num_trips': columnar['num_trips'][pair],
+            'first_departure': columnar['first_departure'][pair],
+            'last_departure': columnar['last_departure'][pair],
+            'avg_headway_minutes': columnar['avg_headway_minutes'][pair],
+            'min_headway_minutes': columnar['min_headway_minutes'][pair],
+            'max_headway_minutes': columnar['max_headway_minutes'][pair],
+            'hourly_profile': [
+                {'hour': hour, 'trips': trips, 'avg_headway_minutes': headway}
+                for hour, trips, headway in zip(columnar['hours'], columnar['hourly_trips'][pair],
+                                                columnar['hourly_avg_headway_minutes'][pair])
+            ],
+        }
+    return result
+
+def build_stop_frequencies(trips, stop_times, calendar):
+    """Per-stop weekday frequencies of every route serving each stop."""
+    weekday_services = get_weekday_services(calendar)
+    print(f"Computing per-stop headways over {len(stop_times)} stop_times rows...")
+    columnar = calculate_stop_route_headways(trips, stop_times, weekday_services)
+    print(f"Computed {len(columnar['route'])} stop-route pairs at {len(columnar['stop_ids'])} stops")
+    return columnar
+
+def save_stop_frequencies(columnar, output_file):
+    """Save the columnar per-stop frequencies (minified)."""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(columnar, f, ensure_ascii=False, separators=(',', ':'))
+
+    print(f"Saved per-stop frequency data to: {output_file} ({os.path.getsize(output_file) / 1024:.0f} KB)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build stop_frequencies.json from a GTFS feed")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory for the generated file (default: {OUTPUT_DIR})")
+    args = parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    data = load_gtfs_stop_headway_data(GTFS_ZIP_PATH)
+    if not data:
+        return
+
+    trips, stop_times, calendar = data
+    columnar = build_stop_frequencies(trips, stop_times, calendar)
+    save_stop_frequencies(columnar, os.path.join(args.output_dir, OUTPUT_NAME))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import json
+import math
+import os
+
+import numpy as np
+
+# Stops are bucketed into square cells of this many degrees (about 1.1 km
+# north-south in Bogotá); each cell is one shard file
+GRID_CELL_DEGREES = 0.01
+GRID_DIR = 'stops_grid'
+
+EARTH_RADIUS_M = 6_371_008.8
+
+def grid_cells(lat, lon, cell_degrees=GRID_CELL_DEGREES):
+    """Integer (row, column) grid cell of each point."""
+    return (np.floor(np.asarray(lat) / cell_degrees).astype(np.int64),
+            np.floor(np.asarray(lon) / cell_degrees).astype(np.int64))
+
+def cell_name(row, col):
+    """Shard file name of a grid cell."""
+    return f"{row}_{col}.json"
+
+def haversine_m(lat, lon, lats, lons):
+    """Distance in metres from one point to arrays of points."""
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+def save_stop_grid(stops_with_routes, output_dir, cell_degrees=GRID_CELL_DEGREES):
+    """Save the stops bucketed into grid cells: one small JSON shard per cell plus index.json.
+
+    Shards hold the stop fields and the route_ids; route details are in
+    routes_index.json. Returns the number of shards.
+    """
+    grid_dir = os.path.join(output_dir, GRID_DIR)
+    os.makedirs(grid_dir, exist_ok=True)
+    # Cells that lost all their stops must not keep an old shard
+    for name in os.listdir(grid_dir):
+        if name.endswith('.json'):
+            os.remove(os.path.join(grid_dir, name))
+
+    rows, cols = grid_cells([stop['stop_lat'] for stop in stops_with_routes],
+                            [stop['stop_lon'] for stop in stops_with_routes], cell_degrees)
+    shards = {}
+    for stop, row, col in zip(stops_with_routes, rows.tolist(), cols.tolist()):
+        shards.setdefault((row, col), []).append({
+            'stop_id': stop['stop_id'],
+            'stop_name': stop['stop_name'],
+            'stop_code': stop['stop_code'],
+            'stop_lat': stop['stop_lat'],
+            'stop_lon': stop['stop_lon'],
+            'route_ids': [route['route_id'] for route in stop['routes']],
+        })
+
+    for (row, col), stops in shards.items():
+        with open(os.path.join(grid_dir, cell_name(row, col)), 'w', encoding='utf-8') as f:
+            json.dump(stops, f, ensure_ascii=False, separators=(',', ':'))
+
+    index = {
+        'cell_degrees': cell_degrees,
+        'cells': sorted([row, col, len(stops)] for (row, col), stops in shards.items()),
+    }
+    with open(os.path.join(grid_dir, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+
+    return len(shards)
+
+class StopGridIndex:
+    """In-memory grid index of stops for "which routes pass near this point" queries.
+
+    Stops are sorted by grid cell, so the stops of a cell are one slice of
+    the coordinate arrays; a query only measures distances to the stops in
+    the cells its radius overlaps.
+    """
+
+    def __init__(self, stops, cell_degrees=GRID_CELL_DEGREES):
+        """`stops`: dicts with stop_id, stop_lat, stop_lon and route_ids."""
+        lats = np.array([stop['stop_lat'] for stop in stops], dtype=np.float64)
+        lons = np.array([stop['stop_lon'] for stop in stops], dtype=np.float64)
+        rows, cols = grid_cells(lats, lons, cell_degrees)
+        order = np.lexsort((cols, rows))
+
+        self.cell_degrees = cell_degrees
+        self.lats = lats[order]
+        self.lons = lons[order]
+        self.stop_ids = [stops[i]['stop_id'] for i in order]
+        self.route_ids = [stops[i]['route_ids'] for i in order]
+
+        # (row, col) -> [start, end) of the cell's stops in the sorted arrays
+        rows, cols = rows[order], cols[order]
+        starts = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])])
+        ends = np.r_[starts[1:], len(rows)]
+        self.cells = {(row, col): (start, end)
+                      for row, col, start, end in zip(rows[starts].tolist(), cols[starts].tolist(),
+                                                      starts.tolist(), ends.tolist())}
+
+    @classmethod
+    def from_stops_with_routes(cls, stops_with_routes, cell_degrees=GRID_CELL_DEGREES):
+        """Index built from the stops_with_routes list of process_stops.py."""
+        stops = [dict(stop, route_ids=[route['route_id'] for route in stop['routes']]) for stop in stops_with_routes]
+        return cls(stops, cell_degrees)
+
+    @classmethod
+    def load(cls, output_dir):
+        """Index built from the grid shards saved by save_stop_grid."""
+        grid_dir = os.path.join(output_dir, GRID_DIR)
+        with open(os.path.join(grid_dir, 'index.json'), encoding='utf-8') as f:
+            index = json.load(f)
+
+        stops = []
+        for row, col, _ in index['cells']:
+            with open(os.path.join(grid_dir, cell_name(row, col)), encoding='utf-8') as f:
+                stops.extend(json.load(f))
+        return cls(stops, index['cell_degrees'])
+
+    def stops_near(self, lat, lon, radius_m):
+        """Indexes (into the sorted arrays) and distances of the stops within radius_m of a point."""
+        # Cell range covering the radius; longitude degrees shrink with latitude
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        row0, col0 = math.floor((lat - dlat) / self.cell_degrees), math.floor((lon - dlon) / self.cell_degrees)
+        row1, col1 = math.floor((lat + dlat) / self.cell_degrees), math.floor((lon + dlon) / self.cell_degrees)
+
+        ranges = [self.cells[(row, col)] for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)
+                  if (row, col) in self.cells]
+        if not ranges:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = np.concatenate([np.arange(start, end) for start, end in ranges])
+
+        distances = haversine_m(lat, lon, self.lats[candidates], self.lons[candidates])
+        inside = distances <= radius_m
+        return candidates[inside], distances[inside]
+
+    def routes_near(self, lat, lon, radius_m):
+        """Routes with a stop within radius_m of a point: [(route_id, metres to its nearest stop)], nearest first."""
+        indexes, distances = self.stops_near(lat, lon, radius_m)
+        nearest = {}
+        for i in np.argsort(distances, kind='stable').tolist():
+            for route_id in self.route_ids[indexes[i]]:
+                if route_id not in nearest:
+                    nearest[route_id] = float(distances[i])
+        return list(nearest.items())
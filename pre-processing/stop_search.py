@@ -0,0 +1,219 @@
+import json
+import os
+import re
+import unicodedata
+from bisect import bisect_left
+
+# Search index shards (see save_search_index), under the output directory
+SEARCH_DIR = 'search'
+# A shard whose keys point at more stops and routes than this is split by one
+# more character of the keys
+MAX_SHARD_POSTINGS = 1500
+ROUTE_FIELDS = ['route_id', 'route_short_name', 'route_long_name', 'route_color', 'route_text_color']
+
+def fold_text(text):
+    """Lowercase, accent-free text: 'Bogotá' -> 'bogota'."""
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+def search_tokens(text):
+    """Accent-folded alphanumeric words of a text or query."""
+    return re.findall(r'[a-z0-9]+', fold_text(text))
+
+def compact_key(text):
+    """A code as one key, without spaces or punctuation: 'K-23 ' -> 'k23'."""
+    return ''.join(search_tokens(text))
+
+def stop_keys(stop):
+    """Search keys of a stop: its stop_code and the words of its stop_name."""
+    keys = set(search_tokens(stop['stop_name']))
+    if compact_key(stop['stop_code']):
+        keys.add(compact_key(stop['stop_code']))
+    return keys
+
+def route_keys(route):
+    """Search keys of a route: its route_short_name, whole and word by word."""
+    keys = set(search_tokens(route['route_short_name']))
+    if compact_key(route['route_short_name']):
+        keys.add(compact_key(route['route_short_name']))
+    return keys
+
+def shard_name(prefix):
+    """Shard file name of a key prefix. The 'p_' keeps names like con.json (reserved on Windows) out."""
+    return f"p_{prefix}.json"
+
+def split_prefixes(postings, prefix=''):
+    """Prefix -> keys of each shard, splitting any shard over MAX_SHARD_POSTINGS by one more character.
+
+    Keys no longer than the prefix stay in the prefix's own shard, so every
+    key is in the shard of the longest shard prefix it starts with.
+    """
+    keys = [key for key in postings if key.startswith(prefix)]
+    size = sum(postings[key] for key in keys)
+    if (prefix and size <= MAX_SHARD_POSTINGS) or all(len(key) <= len(prefix) for key in keys):
+        return {prefix: keys}
+
+    shards = {}
+    own = [key for key in keys if len(key) == len(prefix)]
+    if own:
+        shards[prefix] = own
+    for char in sorted({key[len(prefix)] for key in keys if len(key) > len(prefix)}):
+        shards.update(split_prefixes({key: postings[key] for key in keys if len(key) > len(prefix)}, prefix + char))
+    return shards
+
+def build_search_index(stops_with_routes, routes_index):
+    """Search shards over stop codes, folded stop names and route short names.
+
+    Returns prefix -> shard dict with:
+      routes: [route_id, route_short_name, route_long_name, route_color,
+               route_text_color] of the routes the shard refers to,
+      stops: [stop_id, stop_code, stop_name, stop_lat, stop_lon, route
+              positions in `routes`] of the stops it refers to,
+      keys: the sorted keys, with key_stops/key_routes giving the
+            positions of each key's stops and routes.
+    """
+    key_stops, key_routes = {}, {}
+    for i, stop in enumerate(stops_with_routes):
+        for key in stop_keys(stop):
+            key_stops.setdefault(key, []).append(i)
+    for i, route in enumerate(routes_index):
+        for key in route_keys(route):
+            key_routes.setdefault(key, []).append(i)
+
+    postings = {key: len(key_stops.get(key, [])) + len(key_routes.get(key, []))
+                for key in key_stops.keys() | key_routes.keys()}
+    route_position = {route['route_id']: i for i, route in enumerate(routes_index)}
+
+    shards = {}
+    for prefix, keys in split_prefixes(postings).items():
+        keys = sorted(keys)
+        stop_rows = sorted({i for key in keys for i in key_stops.get(key, [])})
+        # Routes of the matched routes and of the matched stops' route lists
+        route_rows = {i for key in keys for i in key_routes.get(key, [])}
+        route_rows.update(route_position[route['route_id']] for i in stop_rows
+                          for route in stops_with_routes[i]['routes'] if route['route_id'] in route_position)
+        route_rows = sorted(route_rows)
+        local_stop = {row: j for j, row in enumerate(stop_rows)}
+        local_route = {row: j for j, row in enumerate(route_rows)}
+
+        shards[prefix] = {
+            'routes': [[routes_index[row][field] for field in ROUTE_FIELDS] for row in route_rows],
+            'stops': [[stop['stop_id'], stop['stop_code'], stop['stop_name'], stop['stop_lat'], stop['stop_lon'],
+                       [local_route[route_position[route['route_id']]] for route in stop['routes']
+                        if route['route_id'] in route_position]]
+                      for stop in (stops_with_routes[row] for row in stop_rows)],
+            'keys': keys,
+            'key_stops': [[local_stop[row] for row in key_stops.get(key, [])] for key in keys],
+            'key_routes': [[local_route[row] for row in key_routes.get(key, [])] for key in keys],
+        }
+    return shards
+
+def save_search_index(stops_with_routes, routes_index, output_dir):
+    """Save the search shards plus index.json (the list of shard prefixes). Returns the number of shards."""
+    search_dir = os.path.join(output_dir, SEARCH_DIR)
+    os.makedirs(search_dir, exist_ok=True)
+    # Prefixes that were split or lost their keys must not keep an old shard
+    for name in os.listdir(search_dir):
+        if name.endswith('.json'):
+            os.remove(os.path.join(search_dir, name))
+
+    shards = build_search_index(stops_with_routes, routes_index)
+    for prefix, shard in shards.items():
+        with open(os.path.join(search_dir, shard_name(prefix)), 'w', encoding='utf-8') as f:
+            json.dump(shard, f, ensure_ascii=False, separators=(',', ':'))
+
+    with open(os.path.join(search_dir, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump({'prefixes': sorted(shards)}, f, separators=(',', ':'))
+
+    return len(shards)
+
+def matching_results(stops, routes, query_tokens, limit=None):
+    """Results dict of the stops and routes whose keys cover every query token (as a key prefix).
+
+    `stops` and `routes` map stop_id / route_id to (keys, result dict).
+    Stops and routes are sorted by ID.
+    """
+    def matches(keys):
+        return all(any(key.startswith(token) for key in keys) for token in query_tokens)
+
+    stop_results = [stop for stop_id, (keys, stop) in sorted(stops.items()) if matches(keys)]
+    route_results = [route for route_id, (keys, route) in sorted(routes.items()) if matches(keys)]
+    return {'stops': stop_results[:limit], 'routes': route_results[:limit]}
+
+def linear_search(stops_with_routes, routes_index, query, limit=None):
+    """Reference implementation: fold and scan every stop of stops_with_routes.json and route of routes_index.json."""
+    query_tokens = search_tokens(query)
+    if not query_tokens:
+        return {'stops': [], 'routes': []}
+    indexed = {route['route_id']: {field: route[field] for field in ROUTE_FIELDS} for route in routes_index}
+    stops = {stop['stop_id']: (stop_keys(stop), {
+        'stop_id': stop['stop_id'], 'stop_code': stop['stop_code'], 'stop_name': stop['stop_name'],
+        'stop_lat': stop['stop_lat'], 'stop_lon': stop['stop_lon'],
+        'routes': [indexed[route['route_id']] for route in stop['routes'] if route['route_id'] in indexed],
+    }) for stop in stops_with_routes}
+    routes = {route_id: (route_keys(route), route) for route_id, route in indexed.items()}
+    return matching_results(stops, routes, query_tokens, limit)
+
+class StopSearchIndex:
+    """Prefix search over the saved shards, reading only the shards a query needs.
+
+    A query token is looked up in the shard of the longest shard prefix it
+    starts with, plus any shards whose prefix starts with the token (when
+    the token is shorter than the split). Shards are read once and kept;
+    `bytes_read` counts what was fetched.
+    """
+
+    def __init__(self, output_dir):
+        self.search_dir = os.path.join(output_dir, SEARCH_DIR)
+        with open(os.path.join(self.search_dir, 'index.json'), encoding='utf-8') as f:
+            self.prefixes = json.load(f)['prefixes']
+        self.shards = {}
+        self.bytes_read = 0
+
+    def shard(self, prefix):
+        """One shard, read on first use."""
+        if prefix not in self.shards:
+            path = os.path.join(self.search_dir, shard_name(prefix))
+            with open(path, encoding='utf-8') as f:
+                self.shards[prefix] = json.load(f)
+            self.bytes_read += os.path.getsize(path)
+        return self.shards[prefix]
+
+    def shards_for(self, token):
+        """Prefixes of the shards that can hold keys starting with `token`."""
+        covering = [prefix for prefix in self.prefixes if token.startswith(prefix)]
+        below = [prefix for prefix in self.prefixes if prefix.startswith(token) and prefix != token]
+        return ([max(covering, key=len)] if covering else []) + below
+
+    def token_matches(self, token):
+        """(stop_id -> stop result, route_id -> route result) of the keys starting with `token`."""
+        stops, routes = {}, {}
+        for prefix in self.shards_for(token):
+            shard = self.shard(prefix)
+            shard_routes = [dict(zip(ROUTE_FIELDS, route)) for route in shard['routes']]
+            keys = shard['keys']
+            for i in range(bisect_left(keys, token), len(keys)):
+                if not keys[i].startswith(token):
+                    break
+                for j in shard['key_routes'][i]:
+                    routes[shard_routes[j]['route_id']] = shard_routes[j]
+                for j in shard['key_stops'][i]:
+                    stop_id, stop_code, stop_name, lat, lon, stop_routes = shard['stops'][j]
+                    stops[stop_id] = {'stop_id': stop_id, 'stop_code': stop_code, 'stop_name': stop_name,
+                                      'stop_lat': lat, 'stop_lon': lon,
+                                      'routes': [shard_routes[r] for r in stop_routes]}
+        return stops, routes
+
+    def search(self, query, limit=None):
+        """Stops and routes matching every word of `query` as a prefix of a stop code, name word or route name."""
+        query_tokens = search_tokens(query)
+        if not query_tokens:
+            return {'stops': [], 'routes': []}
+
+        stops, routes = self.token_matches(query_tokens[0])
+        for token in query_tokens[1:]:
+            token_stops, token_routes = self.token_matches(token)
+            stops = {stop_id: stop for stop_id, stop in stops.items() if stop_id in token_stops}
+            routes = {route_id: route for route_id, route in routes.items() if route_id in token_routes}
+        return {'stops': [stops[stop_id] for stop_id in sorted(stops)][:limit],
+                'routes': [routes[route_id] for route_id in sorted(routes)][:limit]}
@@ -0,0 +1,116 @@
+import sys
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import iter_table_chunks
+from headways import first_stop_departures
+from stop_headways import row_route_codes
+
+# Default memory budget for the streaming mode, in MB
+DEFAULT_MEMORY_BUDGET_MB = 256
+
+# Peak memory of reading and folding one chunk, relative to the parsed
+# chunk's own size (DataFrame.memory_usage(deep=True), about 140 bytes per
+# row on synthetic feeds). Measured on a 2M-row synthetic feed: budgets of
+# 32, 64 and 128 MB raised the peak RSS by 35, 56 and 99 MB
+PARSE_OVERHEAD = 2.0
+# The first chunk, which measures the bytes per row, and the smallest one
+PROBE_ROWS = 10_000
+MIN_CHUNK_ROWS = 10_000
+
+def chunk_rows_for_budget(budget_bytes, bytes_per_row):
+    """Number of stop_times rows to read per chunk so reading and folding it fits in `budget_bytes`."""
+    return max(MIN_CHUNK_ROWS, int(budget_bytes // (bytes_per_row * PARSE_OVERHEAD)))
+
+def stop_route_pairs(stop_times, trips):
+    """Unique (stop_id, route_id) pairs, in order of first appearance in stop_times."""
+    stop_trips = pd.merge(
+        stop_times[['trip_id', 'stop_id']].drop_duplicates(),
+        trips[['trip_id', 'route_id']],
+        on='trip_id'
+    )
+    return stop_trips[['stop_id', 'route_id']].drop_duplicates()
+
+def stream_stop_times(zip_path, trips, stops=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """Read stop_times.txt in chunks sized to a memory budget and fold it into small summaries.
+
+    Each chunk is reduced to its stop-route pairs (only when `stops` is
+    given) and its first-stop departures before the next one is read. The
+    first chunk has PROBE_ROWS rows; after each chunk its measured size per
+    row sets the next chunk's rows, so that reading and folding a chunk
+    fits in what the summaries leave of the budget. The summaries grow with
+    the feed (one first-stop row per trip, one entry per distinct
+    stop-route pair), so peak memory is about one chunk plus the summaries;
+    a warning is printed if the summaries alone outgrow the budget. Both
+    results come out in file order, so they match running stop_route_pairs
+    / first_stop_departures on the fully loaded table, except that pairs
+    of stops missing from `stops` are left out (the stops outputs drop
+    them anyway).
+
+    Returns (stop_routes, first_stops); stop_routes is None without `stops`.
+    """
+    budget_bytes = memory_budget_mb * 1024 * 1024
+    columns = ['trip_id', 'departure_time', 'stop_sequence']
+    trip_ids = trips['trip_id'].cat.categories
+    categories = {'trip_id': trip_ids}
+    stop_ids = None
+    if stops is not None:
+        columns.append('stop_id')
+        stop_ids = categories['stop_id'] = stops['stop_id'].cat.categories
+
+    route_codes = trips['route_id'].cat.codes.to_numpy().astype(np.int64)
+    route_ids = trips['route_id'].cat.categories
+    n_routes = max(len(route_ids), 1)
+
+    print(f"Streaming stop_times.txt in chunks sized to a {memory_budget_mb} MB budget...")
+
+    # Packed stop code * n_routes + route code keys, in order of first
+    # appearance; a dict keeps that order and only grows by the new pairs
+    pairs = {}
+    first_stop_chunks = []
+    first_stop_bytes = 0
+    # Rows of the next chunk, read by iter_table_chunks before each chunk
+    next_chunk = {'rows': PROBE_ROWS}
+    bytes_per_row = 0.0
+    warned = False
+    chunk_sizes = []
+
+    for chunk in iter_table_chunks(zip_path, 'stop_times', lambda: next_chunk['rows'], columns, categories):
+        chunk_sizes.append(len(chunk))
+        bytes_per_row = max(bytes_per_row, chunk.memory_usage(deep=True).sum() / max(len(chunk), 1))
+
+        first_stops = first_stop_departures(chunk)
+        first_stop_chunks.append(first_stops)
+        first_stop_bytes += first_stops.memory_usage(deep=True).sum()
+
+        if stops is not None:
+            trip_codes = pd.Categorical(chunk['trip_id'], categories=trip_ids).codes.astype(np.int64)
+            row_routes = row_route_codes(trip_codes, trip_ids, trips['trip_id'], route_codes)
+            stop_codes = pd.Categorical(chunk['stop_id'], categories=stop_ids).codes.astype(np.int64)
+            keep = (row_routes >= 0) & (stop_codes >= 0)
+            keys = pd.unique(stop_codes[keep] * n_routes + row_routes[keep])
+            pairs.update(dict.fromkeys(keys.tolist()))
+
+        # Python ints of the pair keys, plus the dict's own table
+        summary_bytes = first_stop_bytes + sys.getsizeof(pairs) + 32 * len(pairs)
+        available = budget_bytes - summary_bytes
+        if available < MIN_CHUNK_ROWS * bytes_per_row * PARSE_OVERHEAD and not warned:
+            print(f"Warning: the stop_times summaries take {summary_bytes / 1024 ** 2:.0f} MB, "
+                  f"leaving less than one {MIN_CHUNK_ROWS}-row chunk of the {memory_budget_mb} MB budget")
+            warned = True
+        next_chunk['rows'] = chunk_rows_for_budget(max(available, 0), bytes_per_row)
+
+    print(f"Read {sum(chunk_sizes)} stop_times rows in {len(chunk_sizes)} chunks "
+          f"(up to {max(chunk_sizes, default=0)} rows, {bytes_per_row:.0f} bytes per parsed row)")
+
+    first_stops = pd.concat(first_stop_chunks, ignore_index=True)
+    stop_routes = None
+    if stops is not None:
+        keys = np.fromiter(pairs, dtype=np.int64, count=len(pairs))
+        stop_routes = pd.DataFrame({
+            'stop_id': pd.Categorical.from_codes(keys // n_routes, categories=stop_ids),
+            'route_id': pd.Categorical.from_codes(keys % n_routes, categories=route_ids),
+        })
+
+    return stop_routes, first_stops
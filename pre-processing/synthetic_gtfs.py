@@ -0,0 +1,181 @@
+import argparse
+import io
+import math
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+# Bogotá bounding box (lat, lon) the synthetic stops are spread over
+BOGOTA_BBOX = (4.47, -74.22, 4.83, -74.01)
+
+# Service mix of every route: share of its trips on each service_id
+SERVICE_SHARES = {'WKD': 0.7, 'SAT': 0.15, 'SUN': 0.15}
+SERVICE_START_HOUR = 5
+SERVICE_HOURS = 18
+# Holiday running the Sunday service instead of the weekday one
+HOLIDAY = '20251103'
+
+# Interpolated shape points between two consecutive stops
+SHAPE_POINTS_PER_SEGMENT = 4
+
+STREET_NAMES = ['Calle', 'Carrera', 'Av. Jiménez', 'Av. Boyacá', 'Diagonal', 'Transversal', 'Av. Suba',
+                'Autopista Norte', 'Av. Américas', 'Av. Ciudad de Cali']
+ROUTE_COLORS = ['00618E', '808000', 'B21F2C', 'E5A000', '4D4D4D', '6C2D83']
+
+def feed_shape(stop_times_rows, stops_per_trip=25, trips_per_route=80):
+    """Number of routes giving about `stop_times_rows` rows with the other dimensions fixed."""
+    return max(1, math.ceil(stop_times_rows / (stops_per_trip * trips_per_route)))
+
+def format_times(seconds):
+    """Vectorized zero-padded HH:MM:SS strings of int seconds (hours may pass 24, as in GTFS)."""
+    seconds = np.asarray(seconds, dtype=np.int64)
+    parts = [seconds // 36000, seconds // 3600 % 10, seconds % 3600 // 600, seconds % 600 // 60,
+             seconds % 60 // 10, seconds % 10]
+    chars = np.full((len(seconds), 8), ord(':'), dtype=np.uint8)
+    for column, digits in zip((0, 1, 3, 4, 6, 7), parts):
+        chars[:, column] = digits + ord('0')
+    return chars.view('S8').ravel().astype(str)
+
+def build_tables(routes=60, trips_per_route=80, stops_per_trip=25, seed=0):
+    """The GTFS tables of a synthetic feed, as DataFrames. Same arguments, same tables.
+
+    Routes run through stops shared with other routes (about four routes
+    per stop), along a shape passing through their stops. Trips are split
+    between weekday, Saturday and Sunday services, evenly spaced over the
+    service day.
+    """
+    rng = np.random.default_rng(seed)
+    lat0, lon0, lat1, lon1 = BOGOTA_BBOX
+
+    n_stops = max(stops_per_trip * 2, routes * stops_per_trip // 4)
+    stop_numbers = np.arange(n_stops)
+    stops = pd.DataFrame({
+        'stop_id': [f"S{i:07d}" for i in stop_numbers],
+        'stop_code': [f"{100000 + i}" for i in stop_numbers],
+        'stop_name': [f"{STREET_NAMES[i % len(STREET_NAMES)]} {i % 200} - "
+                      f"{STREET_NAMES[i // 7 % len(STREET_NAMES)]} {i // 200}" for i in stop_numbers],
+        'stop_lat': rng.uniform(lat0, lat1, n_stops).round(6),
+        'stop_lon': rng.uniform(lon0, lon1, n_stops).round(6),
+    })
+
+    route_numbers = np.arange(routes)
+    route_ids = np.array([f"R{i:06d}" for i in route_numbers])
+    routes_table = pd.DataFrame({
+        'route_id': route_ids,
+        'route_short_name': [f"{chr(ord('A') + i % 26)}{i // 26}" for i in route_numbers],
+        'route_long_name': [f"Portal {i % 9} - {STREET_NAMES[i % len(STREET_NAMES)]} {i}" for i in route_numbers],
+        'route_color': [ROUTE_COLORS[i % len(ROUTE_COLORS)] for i in route_numbers],
+        'route_text_color': 'FFFFFF',
+    })
+
+    # Each route: random stops, ordered along a random direction so the path
+    # doesn't zigzag across the city
+    stop_lats, stop_lons = stops['stop_lat'].to_numpy(), stops['stop_lon'].to_numpy()
+    route_stops = np.empty((routes, stops_per_trip), dtype=np.int64)
+    for r in range(routes):
+        chosen = rng.choice(n_stops, size=stops_per_trip, replace=False)
+        angle = rng.uniform(0, 2 * np.pi)
+        projection = stop_lats[chosen] * np.cos(angle) + stop_lons[chosen] * np.sin(angle)
+        route_stops[r] = chosen[np.argsort(projection)]
+
+    # Shapes: the stop coordinates plus interpolated points in between
+    lats = stop_lats[route_stops]
+    lons = stop_lons[route_stops]
+    steps = np.arange(SHAPE_POINTS_PER_SEGMENT) / SHAPE_POINTS_PER_SEGMENT
+    shape_lats = np.concatenate([(lats[:, :-1, None] + (lats[:, 1:, None] - lats[:, :-1, None]) * steps)
+                                 .reshape(routes, -1), lats[:, -1:]], axis=1)
+    shape_lons = np.concatenate([(lons[:, :-1, None] + (lons[:, 1:, None] - lons[:, :-1, None]) * steps)
+                                 .reshape(routes, -1), lons[:, -1:]], axis=1)
+    points_per_shape = shape_lats.shape[1]
+    shapes = pd.DataFrame({
+        'shape_id': np.repeat(route_ids, points_per_shape),
+        'shape_pt_lat': shape_lats.ravel().round(6),
+        'shape_pt_lon': shape_lons.ravel().round(6),
+        'shape_pt_sequence': np.tile(np.arange(1, points_per_shape + 1), routes),
+    })
+
+    # Trips: service blocks of evenly spaced departures, per route
+    service_names = list(SERVICE_SHARES)
+    counts = np.floor(np.array(list(SERVICE_SHARES.values())) * trips_per_route).astype(np.int64)
+    counts[0] += trips_per_route - counts.sum()
+    trip_services = np.repeat(np.arange(len(service_names)), counts)
+    trip_index = np.concatenate([np.arange(count) for count in counts])
+    headways = (SERVICE_HOURS * 3600) // np.maximum(counts, 1)
+
+    first_departure = SERVICE_START_HOUR * 3600 + rng.integers(0, 1800, routes)
+    departures = first_departure[:, None] + trip_index[None, :] * headways[trip_services][None, :]
+    trip_ids = np.array([f"{route_id}_{t:05d}" for route_id in route_ids for t in range(trips_per_route)])
+    trips = pd.DataFrame({
+        'route_id': np.repeat(route_ids, trips_per_route),
+        'service_id': np.tile(np.array(service_names)[trip_services], routes),
+        'trip_id': trip_ids,
+        'shape_id': np.repeat(route_ids, trips_per_route),
+        'direction_id': 0,
+    })
+
+    # Stop times: per-route segment running times, the same for every trip
+    running = np.concatenate([np.zeros((routes, 1), dtype=np.int64),
+                              np.cumsum(rng.integers(60, 240, (routes, stops_per_trip - 1)), axis=1)], axis=1)
+    times = format_times((departures[:, :, None] + running[:, None, :]).ravel())
+    stop_times = pd.DataFrame({
+        'trip_id': np.repeat(trip_ids, stops_per_trip),
+        'arrival_time': times,
+        'departure_time': times,
+        'stop_id': stops['stop_id'].to_numpy()[np.repeat(route_stops, trips_per_route, axis=0).ravel()],
+        'stop_sequence': np.tile(np.arange(1, stops_per_trip + 1), routes * trips_per_route),
+    })
+
+    flags = {'WKD': [1, 1, 1, 1, 1, 0, 0], 'SAT': [0, 0, 0, 0, 0, 1, 0], 'SUN': [0, 0, 0, 0, 0, 0, 1]}
+    calendar = pd.DataFrame([[service, *flags[service], '20251001', '20251231'] for service in service_names],
+                            columns=['service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                                     'saturday', 'sunday', 'start_date', 'end_date'])
+    calendar_dates = pd.DataFrame({'service_id': ['SUN', 'WKD'], 'date': [HOLIDAY, HOLIDAY], 'exception_type': [1, 2]})
+
+    return {
+        'agency': pd.DataFrame({'agency_id': ['SYN'], 'agency_name': ['Synthetic Transit']}),
+        'stops': stops,
+        'routes': routes_table,
+        'trips': trips,
+        'stop_times': stop_times,
+        'shapes': shapes,
+        'calendar': calendar,
+        'calendar_dates': calendar_dates,
+    }
+
+def write_feed(tables, path):
+    """Write GTFS tables to a zip. Entries get a fixed timestamp so the same tables give the same bytes."""
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, table in tables.items():
+            info = zipfile.ZipInfo(f"{name}.txt", date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with z.open(info, 'w') as raw, io.TextIOWrapper(raw, encoding='utf-8', newline='') as f:
+                table.to_csv(f, index=False, lineterminator='\n')
+
+def generate_feed(path, routes=60, trips_per_route=80, stops_per_trip=25, seed=0):
+    """Generate a synthetic GTFS zip at `path`. Returns the number of stop_times rows."""
+    tables = build_tables(routes, trips_per_route, stops_per_trip, seed)
+    write_feed(tables, path)
+    return len(tables['stop_times'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic GTFS feed")
+    parser.add_argument('output', help="path of the GTFS zip to write")
+    parser.add_argument('--routes', type=int, default=60)
+    parser.add_argument('--trips-per-route', type=int, default=80)
+    parser.add_argument('--stops-per-trip', type=int, default=25)
+    parser.add_argument('--stop-times', type=int, default=None,
+                        help="size the feed to about this many stop_times rows (sets --routes)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    routes = args.routes
+    if args.stop_times:
+        routes = feed_shape(args.stop_times, args.stops_per_trip, args.trips_per_route)
+
+    rows = generate_feed(args.output, routes, args.trips_per_route, args.stops_per_trip, args.seed)
+    print(f"Saved {args.output}: {routes} routes x {args.trips_per_route} trips x {args.stops_per_trip} stops "
+          f"= {rows} stop_times rows")
+
+if __name__ == "__main__":
+    main()
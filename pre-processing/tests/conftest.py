@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# The pre-processing scripts are flat modules run from their own directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic_gtfs import build_tables, write_feed
+
+# Enough stop_times rows (20 x 80 x 25) for the streaming tests to read several chunks
+ROUTES = 20
+
+@pytest.fixture(scope='session')
+def feed_tables():
+    """The GTFS tables of the synthetic test feed."""
+    return build_tables(routes=ROUTES)
+
+@pytest.fixture(scope='session')
+def feed_zip(tmp_path_factory, feed_tables):
+    """Path of the synthetic test feed zip."""
+    path = tmp_path_factory.mktemp('feed') / 'gtfs.zip'
+    write_feed(feed_tables, path)
+    return str(path)
@@ -0,0 +1,15 @@
+import json
+
+from benchmark_headways import legacy_route_headways, load_raw_tables
+from gtfs_loader import load_feed
+from headways import calculate_all_route_headways, get_weekday_services
+
+def test_vectorized_headways_match_per_route_loop(feed_zip):
+    routes, trips, stop_times, calendar = load_raw_tables(feed_zip)
+    legacy = legacy_route_headways(routes, trips, stop_times, get_weekday_services(calendar))
+
+    feed = load_feed(feed_zip, ['trips', 'stop_times', 'calendar'], use_cache=False)
+    vectorized = calculate_all_route_headways(feed['trips'], feed['stop_times'], get_weekday_services(feed['calendar']))
+
+    assert legacy
+    assert json.dumps(vectorized, ensure_ascii=False, indent=2) == json.dumps(legacy, ensure_ascii=False, indent=2)
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from pipeline import run_pipeline
+from synthetic_gtfs import write_feed
+
+def changed_tables(tables):
+    """The test feed with one route removed, one route recoloured and one stop renamed."""
+    tables = {name: table.copy() for name, table in tables.items()}
+    removed = tables['routes']['route_id'].iloc[-1]
+    removed_trips = tables['trips'].loc[tables['trips']['route_id'] == removed, 'trip_id']
+
+    tables['routes'] = tables['routes'][tables['routes']['route_id'] != removed]
+    tables['trips'] = tables['trips'][tables['trips']['route_id'] != removed]
+    tables['stop_times'] = tables['stop_times'][~tables['stop_times']['trip_id'].isin(removed_trips)]
+    tables['routes'].loc[tables['routes'].index[0], 'route_color'] = '123456'
+    tables['stops'].loc[tables['stops'].index[0], 'stop_name'] = 'Renamed stop'
+    return tables
+
+def read_tree(root):
+    """{relative path: bytes} of every file under `root`."""
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+@pytest.mark.parametrize('dedupe_shapes', [False, True])
+def test_incremental_build_matches_full_build(tmp_path, feed_zip, feed_tables, dedupe_shapes):
+    changed_zip = str(tmp_path / 'changed.zip')
+    write_feed(changed_tables(feed_tables), changed_zip)
+    settings = dict(workers=2, use_cache=False, dedupe_shapes=dedupe_shapes, report_path=str(tmp_path / 'report.json'))
+
+    incremental_dir = str(tmp_path / 'incremental')
+    manifest = str(tmp_path / 'incremental_manifest.json')
+    run_pipeline(feed_zip, incremental_dir, manifest_path=manifest, **settings)
+    run_pipeline(changed_zip, incremental_dir, incremental=True, manifest_path=manifest, **settings)
+
+    full_dir = str(tmp_path / 'full')
+    run_pipeline(changed_zip, full_dir, manifest_path=str(tmp_path / 'full_manifest.json'), **settings)
+
+    incremental, full = read_tree(incremental_dir), read_tree(full_dir)
+    assert sorted(incremental) == sorted(full)
+    assert [path for path in full if incremental[path] != full[path]] == []
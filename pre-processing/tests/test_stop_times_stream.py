@@ -0,0 +1,42 @@
+import json
+
+import pandas as pd
+import pytest
+
+from gtfs_loader import load_feed
+from headways import calculate_all_route_headways, first_stop_departures, get_weekday_services
+from process_stops import build_stops_with_routes
+from stop_times_stream import stop_route_pairs, stream_stop_times
+
+def as_strings(table):
+    """Table with every column as plain strings and a fresh index, to compare categorical and object columns."""
+    return table.astype(str).reset_index(drop=True)
+
+@pytest.fixture(scope='module')
+def feed(feed_zip):
+    return load_feed(feed_zip, ['stops', 'stop_times', 'trips', 'routes', 'calendar'], use_cache=False)
+
+@pytest.fixture(scope='module')
+def streamed(feed_zip, feed):
+    # The smallest budget reads the feed in several MIN_CHUNK_ROWS chunks
+    return stream_stop_times(feed_zip, feed['trips'], feed['stops'], memory_budget_mb=1)
+
+def test_streamed_stop_route_pairs_match_in_memory(feed, streamed):
+    stop_routes, _ = streamed
+    expected = stop_route_pairs(feed['stop_times'], feed['trips'])
+
+    pd.testing.assert_frame_equal(as_strings(stop_routes), as_strings(expected))
+
+    streamed_stops = build_stops_with_routes(feed['stops'], stop_routes, feed['routes'])
+    expected_stops = build_stops_with_routes(feed['stops'], expected, feed['routes'])
+    assert json.dumps(streamed_stops) == json.dumps(expected_stops)
+
+def test_streamed_first_stops_match_in_memory(feed, streamed):
+    _, first_stops = streamed
+    expected = first_stop_departures(feed['stop_times'])
+
+    pd.testing.assert_frame_equal(as_strings(first_stops), as_strings(expected))
+
+    weekday_services = get_weekday_services(feed['calendar'])
+    assert (calculate_all_route_headways(feed['trips'], first_stops, weekday_services)
+            == calculate_all_route_headways(feed['trips'], feed['stop_times'], weekday_services))
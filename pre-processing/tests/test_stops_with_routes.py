@@ -0,0 +1,55 @@
+import json
+import zipfile
+
+import pandas as pd
+
+from gtfs_loader import load_feed
+from process_stops import build_stops_with_routes
+from stop_times_stream import stop_route_pairs
+
+def load_raw_stop_tables(zip_path):
+    """Reference loader: plain read_csv, as process_stops.py used to do."""
+    with zipfile.ZipFile(zip_path) as z:
+        return [pd.read_csv(z.open(f'{name}.txt')) for name in ('stops', 'stop_times', 'trips', 'routes')]
+
+def legacy_stops_with_routes(stops, stop_times, trips, routes):
+    """Reference implementation: merge the tables and build each stop's entry from its grouped rows."""
+    stop_trips = pd.merge(stop_times[['trip_id', 'stop_id']].drop_duplicates(), trips[['trip_id', 'route_id']],
+                          on='trip_id')
+    stop_routes = stop_trips[['stop_id', 'route_id']].drop_duplicates()
+    detailed = pd.merge(pd.merge(stop_routes, routes, on='route_id'), stops, on='stop_id')
+
+    stops_with_routes = []
+    for stop_id, group in detailed.groupby('stop_id'):
+        first_row = group.iloc[0]
+        routes_list = []
+        for _, row in group.iterrows():
+            routes_list.append({
+                'route_id': str(row['route_id']),
+                'route_short_name': str(row['route_short_name']),
+                'route_long_name': str(row['route_long_name']) if pd.notna(row['route_long_name']) else "",
+                'route_color': f"{row['route_color']}" if pd.notna(row['route_color']) else "000000",
+                'route_text_color': f"{row['route_text_color']}" if pd.notna(row['route_text_color']) else "FFFFFF"
+            })
+        stops_with_routes.append({
+            'stop_id': str(stop_id),
+            'stop_name': str(first_row['stop_name']) if pd.notna(first_row['stop_name']) else "",
+            'stop_lat': float(first_row['stop_lat']),
+            'stop_lon': float(first_row['stop_lon']),
+            'stop_code': str(first_row['stop_code']) if 'stop_code' in first_row and pd.notna(first_row['stop_code']) else "",
+            'routes': routes_list,
+            'route_count': len(routes_list)
+        })
+
+    stops_with_routes.sort(key=lambda x: x['stop_id'])
+    return stops_with_routes
+
+def test_adjacency_stops_with_routes_match_merge(feed_zip):
+    legacy = legacy_stops_with_routes(*load_raw_stop_tables(feed_zip))
+
+    feed = load_feed(feed_zip, ['stops', 'stop_times', 'trips', 'routes'], use_cache=False)
+    stop_routes = stop_route_pairs(feed['stop_times'], feed['trips'])
+    fast = build_stops_with_routes(feed['stops'], stop_routes, feed['routes'])
+
+    assert legacy
+    assert json.dumps(fast, ensure_ascii=False, indent=2) == json.dumps(legacy, ensure_ascii=False, indent=2)
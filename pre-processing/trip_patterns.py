@@ -0,0 +1,208 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import GTFS_ZIP_PATH, load_feed
+from stop_headways import categorical_codes, row_route_codes
+
+# Bytes per stop_times row of the equivalent integer-coded table (trip, stop,
+# stop_sequence, arrival and departure as int32), the baseline of the ratio
+RAW_BYTES_PER_ROW = 5 * 4
+
+def extract_trip_patterns(stop_times, trips):
+    """Group trips into patterns: trips of the same route with the same ordered stops.
+
+    Each trip's ordered (stop, stop_sequence) list is hashed; trips with
+    the same list and route share a pattern, whose stops are stored once.
+    A trip keeps its departure offset (earliest time) and a time profile:
+    arrival and departure seconds relative to the offset, -1 where
+    stop_times has no time. Trips of a pattern with the same relative times
+    share the profile. Rows of trips missing from `trips` are left out.
+
+    Returns a dict of arrays; IDs are codes into stop_ids, route_ids and
+    trip_ids:
+      pattern_routes, pattern_stop_offsets/pattern_stops/pattern_sequences,
+      pattern_first_rows (first stop_times row of every pattern stop, for
+      outputs in file order), pattern_trip_offsets/pattern_trips,
+      trip_codes, trip_patterns, trip_departures, trip_profiles,
+      trip_first_rows,
+      profile_patterns, profile_offsets/profile_arrivals/profile_departures,
+    plus the number of stop_times rows it covers (`rows`).
+    """
+    trip_codes, trip_ids = categorical_codes(stop_times['trip_id'])
+    stop_codes, stop_ids = categorical_codes(stop_times['stop_id'])
+
+    trip_routes = trips[['trip_id', 'route_id']].drop_duplicates('trip_id')
+    route_codes, route_ids = categorical_codes(trip_routes['route_id'])
+    row_routes = row_route_codes(trip_codes, trip_ids, trip_routes['trip_id'], route_codes)
+
+    rows = np.flatnonzero((row_routes >= 0) & (stop_codes >= 0))
+    sequences = stop_times['stop_sequence'].to_numpy()
+    order = rows[np.lexsort((sequences[rows], trip_codes[rows]))]
+    row_trips = trip_codes[order]
+    starts = np.flatnonzero(np.r_[True, row_trips[1:] != row_trips[:-1]]) if len(order) else np.empty(0, np.int64)
+    lengths = np.diff(np.r_[starts, len(order)])
+    trip_of_row = np.repeat(np.arange(len(starts)), lengths)
+
+    row_stops = stop_codes[order].astype(np.int32)
+    row_sequences = sequences[order].astype(np.int32)
+    arrivals = stop_times['arrival_time'].to_numpy()[order].astype(np.int64)
+    departures = stop_times['departure_time'].to_numpy()[order].astype(np.int64)
+
+    # Departure offset: the trip's earliest time; times become relative to it
+    missing = np.iinfo(np.int64).max
+    earliest = np.minimum(np.where(arrivals >= 0, arrivals, missing), np.where(departures >= 0, departures, missing))
+    offsets = np.minimum.reduceat(earliest, starts) if len(starts) else np.empty(0, dtype=np.int64)
+    offsets[offsets == missing] = 0
+    relative_arrivals = np.where(arrivals >= 0, arrivals - offsets[trip_of_row], -1).astype(np.int32)
+    relative_departures = np.where(departures >= 0, departures - offsets[trip_of_row], -1).astype(np.int32)
+
+    trip_route_codes = row_routes[order][starts] if len(starts) else np.empty(0, dtype=np.int64)
+    pattern_keys, profile_keys = {}, {}
+    trip_patterns = np.empty(len(starts), dtype=np.int32)
+    trip_profiles = np.empty(len(starts), dtype=np.int32)
+    pattern_trips, profile_trips = [], []
+    for trip, (start, end, route) in enumerate(zip(starts.tolist(), (starts + lengths).tolist(),
+                                                   trip_route_codes.tolist())):
+        key = (route, row_stops[start:end].tobytes(), row_sequences[start:end].tobytes())
+        pattern = pattern_keys.setdefault(key, len(pattern_keys))
+        if pattern == len(pattern_trips):
+            pattern_trips.append(trip)
+        profile_key = (pattern, relative_arrivals[start:end].tobytes(), relative_departures[start:end].tobytes())
+        profile = profile_keys.setdefault(profile_key, len(profile_keys))
+        if profile == len(profile_trips):
+            profile_trips.append(trip)
+        trip_patterns[trip] = pattern
+        trip_profiles[trip] = profile
+
+    def slices(first_trips):
+        """Row positions (in `order`) of the given trips, and the offsets of each trip's slice."""
+        first_trips = np.array(first_trips, dtype=np.int64)
+        sizes = lengths[first_trips]
+        slice_offsets = np.r_[0, np.cumsum(sizes)].astype(np.int64)
+        positions = np.repeat(starts[first_trips] - slice_offsets[:-1], sizes) + np.arange(slice_offsets[-1])
+        return positions, slice_offsets
+
+    pattern_rows, pattern_stop_offsets = slices(pattern_trips)
+    profile_rows, profile_offsets = slices(profile_trips)
+
+    # First stop_times row of every pattern stop over all the pattern's trips
+    positions = np.arange(len(order)) - np.repeat(starts, lengths)
+    pattern_first_rows = np.full(len(pattern_rows), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(pattern_first_rows, pattern_stop_offsets[trip_patterns[trip_of_row]] + positions, order)
+
+    return {
+        'stop_ids': stop_ids,
+        'route_ids': route_ids,
+        'trip_ids': trip_ids,
+        'rows': len(order),
+        'pattern_routes': trip_route_codes[pattern_trips].astype(np.int32),
+        'pattern_stop_offsets': pattern_stop_offsets,
+        'pattern_stops': row_stops[pattern_rows],
+        'pattern_sequences': row_sequences[pattern_rows],
+        'pattern_first_rows': pattern_first_rows,
+        'pattern_trip_offsets': np.r_[0, np.cumsum(np.bincount(trip_patterns, minlength=len(pattern_trips)))],
+        'pattern_trips': np.argsort(trip_patterns, kind='stable').astype(np.int32),
+        'trip_codes': row_trips[starts].astype(np.int32) if len(starts) else np.empty(0, dtype=np.int32),
+        'trip_patterns': trip_patterns,
+        'trip_departures': offsets.astype(np.int32),
+        'trip_profiles': trip_profiles,
+        'trip_first_rows': np.minimum.reduceat(order, starts) if len(starts) else np.empty(0, dtype=np.int64),
+        'profile_patterns': trip_patterns[profile_trips] if profile_trips else np.empty(0, dtype=np.int32),
+        'profile_offsets': profile_offsets,
+        'profile_arrivals': relative_arrivals[profile_rows],
+        'profile_departures': relative_departures[profile_rows],
+    }
+
+def pattern_stop_routes(patterns):
+    """Unique (stop_id, route_id) pairs in order of first appearance in stop_times, like stop_route_pairs."""
+    lengths = np.diff(patterns['pattern_stop_offsets'])
+    pair_routes = np.repeat(patterns['pattern_routes'], lengths).astype(np.int64)
+    pairs = pd.DataFrame({'stop': patterns['pattern_stops'], 'route': pair_routes,
+                          'row': patterns['pattern_first_rows']})
+    pairs = pairs.sort_values('row', kind='stable').drop_duplicates(['stop', 'route'])
+    return pd.DataFrame({'stop_id': np.asarray(patterns['stop_ids'])[pairs['stop'].to_numpy()],
+                         'route_id': np.asarray(patterns['route_ids'])[pairs['route'].to_numpy()]})
+
+def pattern_first_stop_departures(patterns):
+    """first_stop_departures (stop_sequence == 1, non-empty departures) rebuilt from the patterns.
+
+    Rows come in the stop_times order of their trips' first rows, which is
+    the file order when every trip's rows are contiguous.
+    """
+    offsets = patterns['pattern_stop_offsets']
+    is_first = patterns['pattern_sequences'] == 1
+    # Position of the stop_sequence 1 stop of every pattern (-1 if none)
+    first_positions = np.full(len(offsets) - 1, -1, dtype=np.int64)
+    first_index = np.flatnonzero(is_first)
+    pattern_of = np.searchsorted(offsets, first_index, side='right') - 1
+    first_positions[pattern_of[::-1]] = (first_index - offsets[pattern_of])[::-1]
+
+    trip_positions = first_positions[patterns['trip_patterns']]
+    has_first = trip_positions >= 0
+    profiles = patterns['trip_profiles'][has_first]
+    relative = patterns['profile_departures'][patterns['profile_offsets'][profiles] + trip_positions[has_first]]
+    departures = np.where(relative >= 0, patterns['trip_departures'][has_first] + relative, -1)
+
+    first_stops = pd.DataFrame({
+        'trip_id': pd.Categorical.from_codes(patterns['trip_codes'][has_first], categories=patterns['trip_ids']),
+        'departure_time': departures.astype(np.int32),
+        'stop_sequence': np.ones(int(has_first.sum()), dtype=np.int32),
+        'row': patterns['trip_first_rows'][has_first],
+    })
+    first_stops = first_stops[first_stops['departure_time'] >= 0].sort_values('row', kind='stable')
+    return first_stops.drop(columns='row').reset_index(drop=True)
+
+def trip_times(patterns, pattern):
+    """Trip codes of a pattern and their (trips x stops) absolute arrival and departure matrices (-1 = no time)."""
+    trips = patterns['pattern_trips'][patterns['pattern_trip_offsets'][pattern]:
+                                      patterns['pattern_trip_offsets'][pattern + 1]]
+    length = patterns['pattern_stop_offsets'][pattern + 1] - patterns['pattern_stop_offsets'][pattern]
+    blocks = patterns['profile_offsets'][patterns['trip_profiles'][trips]][:, None] + np.arange(length)
+    base = patterns['trip_departures'][trips][:, None].astype(np.int64)
+    relative_arrivals = patterns['profile_arrivals'][blocks]
+    relative_departures = patterns['profile_departures'][blocks]
+    return (trips, np.where(relative_arrivals >= 0, base + relative_arrivals, -1),
+            np.where(relative_departures >= 0, base + relative_departures, -1))
+
+def compression_stats(patterns):
+    """Pattern, profile and trip counts, and the compression ratio against the integer-coded stop_times."""
+    array_bytes = sum(value.nbytes for name, value in patterns.items()
+                      if isinstance(value, np.ndarray) and name not in ('stop_ids', 'route_ids', 'trip_ids'))
+    raw_bytes = patterns['rows'] * RAW_BYTES_PER_ROW
+    return {
+        'stop_times_rows': patterns['rows'],
+        'trips': len(patterns['trip_patterns']),
+        'patterns': len(patterns['pattern_routes']),
+        'pattern_stops': len(patterns['pattern_stops']),
+        'time_profiles': len(patterns['profile_patterns']),
+        'raw_bytes': raw_bytes,
+        'pattern_bytes': array_bytes,
+        'compression_ratio': round(raw_bytes / array_bytes, 2) if array_bytes else None,
+    }
+
+def format_compression(stats):
+    """One-line summary of compression_stats."""
+    return (f"{stats['trips']} trips in {stats['patterns']} patterns and {stats['time_profiles']} time profiles; "
+            f"{stats['stop_times_rows']} stop_times rows ({stats['raw_bytes'] / 1024 ** 2:.1f} MB) -> "
+            f"{stats['pattern_bytes'] / 1024 ** 2:.1f} MB, {stats['compression_ratio']}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress stop_times into trip patterns and report the ratio")
+    parser.parse_args()
+
+    if not os.path.exists(GTFS_ZIP_PATH):
+        print(f"File not found: {GTFS_ZIP_PATH}")
+        return
+
+    feed = load_feed(GTFS_ZIP_PATH, ['trips', 'stop_times'])
+    if feed is None:
+        return
+
+    patterns = extract_trip_patterns(feed['stop_times'], feed['trips'])
+    print(format_compression(compression_stats(patterns)))
+
+if __name__ == "__main__":
+    main()
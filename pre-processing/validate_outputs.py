@@ -0,0 +1,454 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from process_gtfs import SHAPES_DIR, route_filename
+
+# Paths
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+
+# (min_lat, min_lon, max_lat, max_lon) every coordinate must fall in: Bogotá
+# plus the neighbouring municipalities the SITP reaches (Soacha, rural Usme)
+SERVICE_AREA_BBOX = (4.20, -74.35, 4.95, -73.90)
+
+# Aggregate outputs and the kind of check each gets; everything else at the
+# top level is a route file, unless listed in OTHER_OUTPUTS
+INDEX_FILES = {
+    'routes_index.json': 'routes_index',
+    'stops_with_routes.json': 'stops',
+    'routes_to_stops.json': 'routes_to_stops',
+    'route_frequencies.json': 'frequencies',
+    'all_routes.geojson': 'all_routes',
+}
+OTHER_OUTPUTS = ('stops.geojson', 'stops_encoded.json', 'stop_frequencies.json', 'od_index.json',
+                 'route_frequencies_by_day_type.json', 'route_frequencies.columnar.json', 'shape_stops.json',
+                 'manifest.json')
+
+CHUNK_SIZE = 1 << 16
+# Errors kept per file; the rest are only counted
+MAX_ERRORS_PER_FILE = 20
+
+ROUTE_FIELDS = ('route_id', 'route_short_name', 'route_long_name', 'route_color', 'route_text_color')
+STOP_FIELDS = ('stop_id', 'stop_name', 'stop_code', 'stop_lat', 'stop_lon', 'routes')
+FREQUENCY_FIELDS = ('num_trips', 'first_departure', 'last_departure', 'avg_headway_minutes',
+                    'min_headway_minutes', 'max_headway_minutes', 'hourly_profile')
+COLOR = re.compile(r'#?[0-9A-Fa-f]{6}')
+WHITESPACE = re.compile(r'\s*')
+NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+class JsonStream:
+    """Reads one JSON document a value at a time, so large files are never held whole.
+
+    members() walks the array or object at the current position and yields
+    its indexes or keys; the caller reads each member with value() (or
+    walks into it with members()) before asking for the next one.
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer, self.pos, self.eof = '', 0, False
+
+    def fill(self, size):
+        """Append up to `size` more characters, dropping the consumed ones. False at the end of the file."""
+        if self.eof:
+            return False
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character ('' at the end of the file)."""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill(self.chunk_size):
+                return ''
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of `chars`."""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"expected one of {chars!r}, found {char or 'end of file'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete value, reading more of the file until it is whole."""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            # A number cut off by the end of the buffer continues in the next chunk
+            if (isinstance(value, (int, float)) and NUMBER_TAIL.fullmatch(self.buffer, end)
+                    and self.fill(size)):
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Indexes (arrays) or keys (objects) of the container at the current position."""
+        opener = self.expect('[{')
+        closer = ']' if opener == '[' else '}'
+        if self.peek() == closer:
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            if opener == '{':
+                key = self.value()
+                self.expect(':')
+            else:
+                key = index
+            yield key
+            index += 1
+            if self.expect(',' + closer) == closer:
+                return
+
+    def end(self):
+        """Check that nothing but whitespace follows the document."""
+        if self.peek():
+            raise ValueError("extra data after the JSON document")
+
+class FileCheck:
+    """Errors and cross-file facts gathered while validating one file."""
+
+    def __init__(self, path, kind, bbox):
+        self.path, self.kind, self.bbox = path, kind, bbox
+        self.errors, self.error_count = [], 0
+        self.facts = {}
+
+    def error(self, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS_PER_FILE:
+            self.errors.append(message)
+
+    def collect(self, fact, value):
+        self.facts.setdefault(fact, []).append(value)
+
+    def result(self):
+        return {'path': self.path, 'kind': self.kind, 'errors': self.errors, 'error_count': self.error_count,
+                'facts': self.facts}
+
+def outside_bbox(coords, bbox):
+    """Number of [lon, lat] pairs outside the (min_lat, min_lon, max_lat, max_lon) box, or None if malformed."""
+    try:
+        points = np.asarray(coords, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    if points.ndim != 2 or points.shape[1] < 2 or not np.isfinite(points[:, :2]).all():
+        return None
+    min_lat, min_lon, max_lat, max_lon = bbox
+    lons, lats = points[:, 0], points[:, 1]
+    return int(((lats < min_lat) | (lats > max_lat) | (lons < min_lon) | (lons > max_lon)).sum())
+
+def check_geometry(check, geometry, where):
+    """LineString/MultiLineString with well-formed coordinates inside the bounding box."""
+    if not isinstance(geometry, dict) or geometry.get('type') not in ('LineString', 'MultiLineString'):
+        check.error(f"{where}: geometry is not a LineString or MultiLineString")
+        return
+    coordinates = geometry.get('coordinates')
+    lines = coordinates if geometry['type'] == 'MultiLineString' else [coordinates]
+    if not isinstance(lines, list) or not lines:
+        check.error(f"{where}: geometry has no coordinates")
+        return
+    for line in lines:
+        outside = outside_bbox(line, check.bbox) if isinstance(line, list) and len(line) >= 2 else None
+        if outside is None:
+            check.error(f"{where}: malformed coordinates (need at least two [lon, lat] pairs)")
+        elif outside:
+            check.error(f"{where}: {outside} coordinates outside the service area")
+
+def check_feature(check, feature, where):
+    """Route feature: properties with the route fields, and a geometry or a shape store reference."""
+    if not isinstance(feature, dict) or feature.get('type') != 'Feature':
+        check.error(f"{where}: not a Feature")
+        return
+    properties = feature.get('properties')
+    if not isinstance(properties, dict) or not isinstance(properties.get('route_id'), str):
+        check.error(f"{where}: properties without a route_id")
+        return
+    missing = [field for field in ROUTE_FIELDS if field not in properties]
+    if missing:
+        check.error(f"{where}: properties missing {', '.join(missing)}")
+    for field in ('route_color', 'route_text_color'):
+        if field in properties and not COLOR.fullmatch(str(properties[field])):
+            check.error(f"{where}: {field} {properties[field]!r} is not a hex colour")
+
+    check.collect('route_ids', properties['route_id'])
+    geometry_ref = properties.get('geometry_ref')
+    if feature.get('geometry') is None and geometry_ref is not None:
+        check.collect('geometry_refs', geometry_ref)
+    else:
+        check_geometry(check, feature.get('geometry'), where)
+
+def check_feature_collection(check, stream):
+    """A FeatureCollection of route features, streamed feature by feature."""
+    collection_type, n_features = None, None
+    for key in stream.members():
+        if key == 'features' and stream.peek() == '[':
+            n_features = 0
+            for index in stream.members():
+                check_feature(check, stream.value(), f"feature {index}")
+                n_features += 1
+        elif key == 'type':
+            collection_type = stream.value()
+        else:
+            stream.value()
+    if collection_type != 'FeatureCollection':
+        check.error("not a FeatureCollection")
+    if n_features is None:
+        check.error("no features array")
+    elif n_features == 0 and check.kind == 'route':
+        check.error("route file without features")
+
+    if check.kind == 'route':
+        name = os.path.basename(check.path)
+        wrong = sorted({route_id for route_id in check.facts.get('route_ids', []) if route_filename(route_id) != name})
+        if wrong:
+            check.error(f"features of other routes: {', '.join(wrong[:5])}")
+
+def check_route_entry(check, entry, where, fields):
+    """An object with the given fields and a string route_id, which is collected."""
+    if not isinstance(entry, dict) or not isinstance(entry.get('route_id'), str):
+        check.error(f"{where}: entry without a route_id")
+        return False
+    missing = [field for field in fields if field not in entry]
+    if missing:
+        check.error(f"{where}: missing {', '.join(missing)}")
+    check.collect('route_ids', entry['route_id'])
+    return True
+
+def check_routes_index(check, stream):
+    for index in stream.members():
+        entry = stream.value()
+        if check_route_entry(check, entry, f"route {index}", ROUTE_FIELDS):
+            for field in ('route_color', 'route_text_color'):
+                if field in entry and not COLOR.fullmatch(str(entry[field])):
+                    check.error(f"route {entry['route_id']}: {field} {entry[field]!r} is not a hex colour")
+
+def check_stops(check, stream):
+    min_lat, min_lon, max_lat, max_lon = check.bbox
+    for index in stream.members():
+        stop = stream.value()
+        if not isinstance(stop, dict) or not isinstance(stop.get('stop_id'), str):
+            check.error(f"stop {index}: entry without a stop_id")
+            continue
+        where = f"stop {stop['stop_id']}"
+        missing = [field for field in STOP_FIELDS if field not in stop]
+        if missing:
+            check.error(f"{where}: missing {', '.join(missing)}")
+        check.collect('stop_ids', stop['stop_id'])
+
+        lat, lon = stop.get('stop_lat'), stop.get('stop_lon')
+        if not isinstance(lat, (int, float)) or not isinstance(lon, (int, float)):
+            check.error(f"{where}: coordinates are not numbers")
+        elif not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            check.error(f"{where}: ({lat}, {lon}) is outside the service area")
+
+        routes = stop.get('routes', [])
+        if not isinstance(routes, list):
+            check.error(f"{where}: routes is not a list")
+            continue
+        for route in routes:
+            check_route_entry(check, route, where, ROUTE_FIELDS)
+
+def check_routes_to_stops(check, stream):
+    for index in stream.members():
+        entry = stream.value()
+        if not check_route_entry(check, entry, f"route {index}", ('route_id', 'stop_ids')):
+            continue
+        stop_ids = entry.get('stop_ids', [])
+        if not isinstance(stop_ids, list) or not all(isinstance(stop_id, str) for stop_id in stop_ids):
+            check.error(f"route {entry['route_id']}: stop_ids is not a list of strings")
+            continue
+        check.facts.setdefault('stop_ids', []).extend(stop_ids)
+
+def check_frequencies(check, stream):
+    for route_id in stream.members():
+        stats = stream.value()
+        where = f"route {route_id}"
+        if not isinstance(stats, dict):
+            check.error(f"{where}: entry is not an object")
+            continue
+        check.collect('route_ids', route_id)
+        if stats.get('route_id') != route_id:
+            check.error(f"{where}: keyed under a different route_id ({stats.get('route_id')!r})")
+        missing = [field for field in FREQUENCY_FIELDS if field not in stats]
+        if missing:
+            check.error(f"{where}: missing {', '.join(missing)}")
+        if not isinstance(stats.get('num_trips', 0), int) or stats.get('num_trips', 0) < 0:
+            check.error(f"{where}: num_trips is not a non-negative integer")
+        for hour in stats.get('hourly_profile', []):
+            if not isinstance(hour, dict) or not isinstance(hour.get('hour'), int) or not 0 <= hour['hour'] < 48:
+                check.error(f"{where}: malformed hourly_profile entry {hour!r}")
+                break
+
+def check_shape(check, stream):
+    check_geometry(check, stream.value(), "shape")
+
+CHECKS = {
+    'route': check_feature_collection,
+    'all_routes': check_feature_collection,
+    'routes_index': check_routes_index,
+    'stops': check_stops,
+    'routes_to_stops': check_routes_to_stops,
+    'frequencies': check_frequencies,
+    'shape': check_shape,
+}
+
+def validate_file(path, kind, bbox=SERVICE_AREA_BBOX):
+    """Stream one output file through the check of its kind. Returns its errors and cross-file facts."""
+    check = FileCheck(path, kind, bbox)
+    try:
+        with open(path, encoding='utf-8') as f:
+            stream = JsonStream(f)
+            CHECKS[kind](check, stream)
+            stream.end()
+    except (ValueError, UnicodeDecodeError) as e:
+        # JSONDecodeError is a ValueError
+        check.error(f"invalid JSON: {e}")
+    return check.result()
+
+def find_files(output_dir):
+    """(path, kind) of every file to validate, largest first so big files start early."""
+    files = []
+    for name in os.listdir(output_dir):
+        path = os.path.join(output_dir, name)
+        if name in INDEX_FILES:
+            files.append((path, INDEX_FILES[name]))
+        elif name.endswith('.json') and name not in OTHER_OUTPUTS and os.path.isfile(path):
+            files.append((path, 'route'))
+
+    shapes_dir = os.path.join(output_dir, SHAPES_DIR)
+    if os.path.isdir(shapes_dir):
+        files.extend((os.path.join(shapes_dir, name), 'shape')
+                     for name in os.listdir(shapes_dir) if name.endswith('.json'))
+    return sorted(files, key=lambda item: os.path.getsize(item[0]), reverse=True)
+
+def cross_check(results):
+    """Consistency errors and warnings between the files."""
+    errors, warnings = [], []
+    by_kind = {}
+    for result in results:
+        by_kind.setdefault(result['kind'], []).append(result)
+
+    def facts(kind, fact):
+        return {value for result in by_kind.get(kind, []) for value in result['facts'].get(fact, [])}
+
+    def report(messages, what, values):
+        if values:
+            values = sorted(values)
+            examples = ', '.join(values[:5]) + (', ...' if len(values) > 5 else '')
+            messages.append(f"{len(values)} {what}: {examples}")
+
+    for name, kind in INDEX_FILES.items():
+        if kind not in by_kind:
+            errors.append(f"{name} is missing")
+
+    indexed = facts('routes_index', 'route_ids')
+    route_files = {os.path.basename(result['path']) for result in by_kind.get('route', [])}
+    report(errors, "indexed routes without a route file",
+           [route_id for route_id in indexed if route_filename(route_id) not in route_files])
+    report(warnings, "route files of routes missing from routes_index.json",
+           route_files - {route_filename(route_id) for route_id in indexed})
+
+    report(errors, "routes in stops_with_routes.json missing from routes_index.json",
+           facts('stops', 'route_ids') - indexed)
+    report(errors, "routes in routes_to_stops.json missing from routes_index.json",
+           facts('routes_to_stops', 'route_ids') - indexed)
+    if 'stops' in by_kind:
+        report(errors, "stops in routes_to_stops.json missing from stops_with_routes.json",
+               facts('routes_to_stops', 'stop_ids') - facts('stops', 'stop_ids'))
+    # Routes with trips but no shape have frequencies and no route file
+    report(warnings, "routes in route_frequencies.json missing from routes_index.json",
+           facts('frequencies', 'route_ids') - indexed)
+    if 'all_routes' in by_kind:
+        all_routes = facts('all_routes', 'route_ids')
+        report(errors, "indexed routes missing from all_routes.geojson", indexed - all_routes)
+        report(errors, "routes in all_routes.geojson missing from routes_index.json", all_routes - indexed)
+
+    shapes = {os.path.splitext(os.path.basename(result['path']))[0] for result in by_kind.get('shape', [])}
+    report(errors, "geometry_refs without a shape store file", facts('route', 'geometry_refs') - shapes)
+
+    for result in by_kind.get('stops', []):
+        duplicates = len(result['facts'].get('stop_ids', [])) - len(set(result['facts'].get('stop_ids', [])))
+        if duplicates:
+            errors.append(f"{duplicates} duplicate stop_ids in stops_with_routes.json")
+    for result in by_kind.get('routes_index', []):
+        duplicates = len(result['facts'].get('route_ids', [])) - len(indexed)
+        if duplicates:
+            errors.append(f"{duplicates} duplicate route_ids in routes_index.json")
+
+    return errors, warnings
+
+def validate_outputs(output_dir=OUTPUT_DIR, workers=None, bbox=SERVICE_AREA_BBOX):
+    """Validate every output file in parallel, then check them against each other. True if there are no errors."""
+    start = time.perf_counter()
+    if not os.path.isdir(output_dir):
+        print(f"Directory not found: {output_dir}")
+        return False
+
+    files = find_files(output_dir)
+    print(f"Validating {len(files)} files in {output_dir}...")
+    paths, kinds = zip(*files) if files else ((), ())
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Small files are cheap, so batch them to keep the inter-process traffic low
+        results = list(pool.map(validate_file, paths, kinds, [bbox] * len(files), chunksize=8))
+
+    n_errors = 0
+    for result in results:
+        if result['error_count']:
+            n_errors += result['error_count']
+            print(f"\n{os.path.relpath(result['path'], output_dir)}: {result['error_count']} errors")
+            for message in result['errors']:
+                print(f"  {message}")
+            if result['error_count'] > len(result['errors']):
+                print(f"  ... {result['error_count'] - len(result['errors'])} more")
+
+    errors, warnings = cross_check(results)
+    for message in errors:
+        print(f"Error: {message}")
+    for message in warnings:
+        print(f"Warning: {message}")
+    n_errors += len(errors)
+
+    n_routes = len([result for result in results if result['kind'] == 'route'])
+    print(f"\nChecked {len(files)} files ({n_routes} route files) in {time.perf_counter() - start:.2f} s: "
+          f"{n_errors} errors, {len(warnings)} warnings")
+    return n_errors == 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate every generated output file and their consistency")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with the generated files (default: {OUTPUT_DIR})")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument('--bbox', type=float, nargs=4, default=SERVICE_AREA_BBOX,
+                        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'),
+                        help=f"area every coordinate must fall in (default: {' '.join(map(str, SERVICE_AREA_BBOX))})")
+    args = parser.parse_args()
+
+    if not validate_outputs(args.output_dir, args.workers, tuple(args.bbox)):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
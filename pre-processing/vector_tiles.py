@@ -0,0 +1,410 @@
+import argparse
+import gzip
+import json
+import math
+import os
+import struct
+
+import numpy as np
+import shapely
+
+# Paths
+OUTPUT_DIR = os.path.join('..', 'gtfs-app', 'public', 'routes_data')
+PMTILES_FILE = 'network.pmtiles'
+
+# Zoom range of the archive; the map overzooms past MAX_ZOOM
+MIN_ZOOM = 10
+MAX_ZOOM = 14
+# Stops are only useful (and only light enough) from this zoom on
+STOPS_MIN_ZOOM = 13
+
+# MVT tile grid: coordinates per tile side, and how far lines extend past
+# the tile edge so strokes join up between neighbouring tiles
+EXTENT = 4096
+BUFFER = 64
+
+MAX_LATITUDE = 85.0511287798
+
+# MVT geometry types and commands
+POINT, LINESTRING = 1, 2
+MOVE_TO, LINE_TO = 1, 2
+
+# PMTiles v3 constants
+PMTILES_HEADER_SIZE = 127
+PMTILES_ROOT_SIZE = 16384
+COMPRESSION_GZIP = 2
+TILE_TYPE_MVT = 1
+LEAF_SIZE = 4096
+
+# --- Protobuf encoding ---
+
+def varint(value):
+    """Protobuf varint of a non-negative int."""
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def encode_varints(values):
+    """Packed varints of an array of non-negative ints, encoded with NumPy."""
+    values = np.asarray(values, dtype=np.uint64)
+    if len(values) == 0:
+        return b''
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    for shift in range(7, 64, 7):
+        n_bytes += values >= np.uint64(1 << shift)
+    ends = np.cumsum(n_bytes)
+    starts = ends - n_bytes
+    out = np.empty(ends[-1], dtype=np.uint8)
+    for k in range(int(n_bytes.max())):
+        has_byte = n_bytes > k
+        byte = (values[has_byte] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        more = np.where(n_bytes[has_byte] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[has_byte] + k] = byte | more
+    return out.tobytes()
+
+def zigzag(values):
+    """Zigzag-encode signed ints so small negatives stay small varints."""
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+def field(number, payload):
+    """Length-delimited protobuf field."""
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+def varint_field(number, value):
+    """Varint protobuf field."""
+    return varint(number << 3) + varint(value)
+
+def encode_value(value):
+    """MVT Value message for a property value."""
+    if isinstance(value, bool):
+        return varint_field(7, int(value))
+    if isinstance(value, int):
+        return varint_field(5, value) if value >= 0 else varint_field(6, int(zigzag([value])[0]))
+    if isinstance(value, float):
+        return varint(3 << 3 | 1) + struct.pack('<d', value)
+    return field(1, str(value).encode('utf-8'))
+
+def encode_layer(name, features):
+    """MVT Layer message from (properties, geometry type, command integers) features."""
+    keys, values = {}, {}
+    encoded_features = []
+    for properties, geom_type, commands in features:
+        tags = []
+        for key, value in properties.items():
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        encoded_features.append(field(2, encode_varints(tags)) + varint_field(3, geom_type) +
+                                field(4, encode_varints(commands)))
+
+    layer = bytearray(varint_field(15, 2) + field(1, name.encode('utf-8')))
+    for feature in encoded_features:
+        layer += field(2, feature)
+    for key in keys:
+        layer += field(3, key.encode('utf-8'))
+    for _, value in values:
+        layer += field(4, encode_value(value))
+    layer += varint_field(5, EXTENT)
+    return bytes(layer)
+
+def encode_tile(layers):
+    """MVT Tile message from {layer name: features}."""
+    return b''.join(field(3, encode_layer(name, features)) for name, features in layers.items() if features)
+
+# --- Geometry ---
+
+def lonlat_to_world(coords):
+    """Web Mercator position of [lon, lat] points, as fractions (0-1) of the world."""
+    lon = coords[:, 0]
+    lat = np.radians(np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+    return np.column_stack(((lon + 180) / 360, (1 - np.arcsinh(np.tan(lat)) / math.pi) / 2))
+
+def line_commands(points):
+    """MVT command integers of a LineString in tile coordinates (None if it collapses to a point)."""
+    deltas = np.diff(points, axis=0, prepend=[[0, 0]])
+    # Points that land on the same tile coordinate add nothing
+    moves = np.concatenate(([True], (deltas[1:] != 0).any(axis=1)))
+    deltas = deltas[moves]
+    if len(deltas) < 2:
+        return None
+
+    encoded = zigzag(deltas).reshape(-1)
+    return np.concatenate(([MOVE_TO | 1 << 3], encoded[:2], [LINE_TO | (len(deltas) - 1) << 3], encoded[2:]))
+
+def tile_lines(geometries, properties, zoom, tiles):
+    """Clip world-coordinate LineStrings to the tiles of `zoom` and add them to `tiles`."""
+    scale = 1 << zoom
+    buffer = BUFFER / EXTENT
+    bounds = shapely.bounds(geometries) * scale
+    x0 = np.floor(bounds[:, 0] - buffer).astype(np.int64).clip(0, scale - 1)
+    y0 = np.floor(bounds[:, 1] - buffer).astype(np.int64).clip(0, scale - 1)
+    x1 = np.floor(bounds[:, 2] + buffer).astype(np.int64).clip(0, scale - 1)
+    y1 = np.floor(bounds[:, 3] + buffer).astype(np.int64).clip(0, scale - 1)
+
+    # Every (feature, tile) pair in the feature's bounding box
+    widths = x1 - x0 + 1
+    counts = widths * (y1 - y0 + 1)
+    feature_index = np.repeat(np.arange(len(geometries)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    tx = x0[feature_index] + position % widths[feature_index]
+    ty = y0[feature_index] + position // widths[feature_index]
+
+    boxes = shapely.box((tx - buffer) / scale, (ty - buffer) / scale,
+                        (tx + 1 + buffer) / scale, (ty + 1 + buffer) / scale)
+    clipped = shapely.intersection(geometries[feature_index], boxes)
+
+    parts, part_pair = shapely.get_parts(clipped, return_index=True)
+    is_line = (shapely.get_type_id(parts) == 1) & ~shapely.is_empty(parts)
+    parts, part_pair = parts[is_line], part_pair[is_line]
+    coords, part_index = shapely.get_coordinates(parts, return_index=True)
+    pair = part_pair[part_index]
+    tile_coords = np.round((coords * scale - np.column_stack((tx[pair], ty[pair]))) * EXTENT).astype(np.int64)
+
+    part_starts = np.searchsorted(part_index, np.arange(len(parts) + 1))
+    for part in range(len(parts)):
+        commands = line_commands(tile_coords[part_starts[part]:part_starts[part + 1]])
+        if commands is None:
+            continue
+        p = part_pair[part]
+        layers = tiles.setdefault((zoom, int(tx[p]), int(ty[p])), {'routes': [], 'stops': []})
+        layers['routes'].append((properties[feature_index[p]], LINESTRING, commands))
+
+def tile_points(world, properties, zoom, tiles):
+    """Add world-coordinate points to the tiles of `zoom` they fall in."""
+    scale = 1 << zoom
+    scaled = world * scale
+    tile_xy = np.floor(scaled).astype(np.int64).clip(0, scale - 1)
+    tile_coords = np.round((scaled - tile_xy) * EXTENT).astype(np.int64)
+    encoded = zigzag(tile_coords)
+
+    for i in range(len(world)):
+        layers = tiles.setdefault((zoom, int(tile_xy[i, 0]), int(tile_xy[i, 1])), {'routes': [], 'stops': []})
+        layers['stops'].append((properties[i], POINT, [MOVE_TO | 1 << 3, encoded[i, 0], encoded[i, 1]]))
+
+# --- PMTiles ---
+
+def zxy_to_tile_id(z, x, y):
+    """PMTiles tile id: tiles of lower zooms first, then Hilbert curve order within a zoom."""
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    n = 1 << z
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x, y = n - 1 - x, n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return tile_id
+
+def serialize_directory(entries):
+    """Gzipped PMTiles directory of (tile_id, offset, length, run_length) entries."""
+    if not entries:
+        return gzip.compress(varint(0), mtime=0)
+    tile_ids, offsets, lengths, run_lengths = (np.array(column, dtype=np.uint64) for column in zip(*entries))
+    # Offsets of tiles that directly follow the previous one are stored as 0
+    contiguous = np.zeros(len(entries), dtype=bool)
+    contiguous[1:] = offsets[1:] == offsets[:-1] + lengths[:-1]
+    stored_offsets = np.where(contiguous, np.uint64(0), offsets + np.uint64(1))
+    data = (varint(len(entries)) + encode_varints(np.diff(tile_ids, prepend=np.uint64(0))) +
+            encode_varints(run_lengths) + encode_varints(lengths) + encode_varints(stored_offsets))
+    return gzip.compress(data, mtime=0)
+
+def build_directories(entries):
+    """Root directory, and leaf directories when the entries don't fit in the root."""
+    root = serialize_directory(entries)
+    if len(root) <= PMTILES_ROOT_SIZE - PMTILES_HEADER_SIZE:
+        return root, b''
+
+    leaf_size = LEAF_SIZE
+    while True:
+        root_entries, leaves = [], bytearray()
+        for start in range(0, len(entries), leaf_size):
+            leaf = serialize_directory(entries[start:start + leaf_size])
+            root_entries.append((entries[start][0], len(leaves), len(leaf), 0))
+            leaves += leaf
+        root = serialize_directory(root_entries)
+        if len(root) <= PMTILES_ROOT_SIZE - PMTILES_HEADER_SIZE:
+            return root, bytes(leaves)
+        leaf_size *= 2
+
+def write_pmtiles(path, tiles, metadata, min_zoom, max_zoom, bounds):
+    """Write {(z, x, y): MVT bytes} to a PMTiles v3 archive with gzipped tiles.
+
+    Identical tiles are stored once; runs of identical tiles with
+    consecutive ids share one directory entry.
+    """
+    entries = []
+    contents = {}
+    tile_data = bytearray()
+    for tile_id, tile in sorted((zxy_to_tile_id(*zxy), tile) for zxy, tile in tiles.items()):
+        compressed = gzip.compress(tile, mtime=0)
+        if compressed not in contents:
+            contents[compressed] = len(tile_data)
+            tile_data += compressed
+        offset = contents[compressed]
+
+        last = entries[-1] if entries else None
+        if last and last[1] == offset and last[0] + last[3] == tile_id:
+            entries[-1] = (last[0], last[1], last[2], last[3] + 1)
+        else:
+            entries.append((tile_id, offset, len(compressed), 1))
+
+    root, leaves = build_directories(entries)
+    metadata = gzip.compress(json.dumps(metadata, ensure_ascii=False).encode('utf-8'), mtime=0)
+
+    root_offset = PMTILES_HEADER_SIZE
+    metadata_offset = root_offset + len(root)
+    leaves_offset = metadata_offset + len(metadata)
+    data_offset = leaves_offset + len(leaves)
+    min_lon, min_lat, max_lon, max_lat = (round(value * 1e7) for value in bounds)
+
+    header = struct.pack(
+        '<7sBQQQQQQQQQQQBBBBBBiiiiBii',
+        b'PMTiles', 3,
+        root_offset, len(root), metadata_offset, len(metadata), leaves_offset, len(leaves),
+        data_offset, len(tile_data),
+        len(tiles), len(entries), len(contents),
+        1, COMPRESSION_GZIP, COMPRESSION_GZIP, TILE_TYPE_MVT, min_zoom, max_zoom,
+        min_lon, min_lat, max_lon, max_lat,
+        min_zoom, (min_lon + max_lon) // 2, (min_lat + max_lat) // 2,
+    )
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(root)
+        f.write(metadata)
+        f.write(leaves)
+        f.write(tile_data)
+
+    return len(entries), len(contents)
+
+# --- Stage ---
+
+def load_features(output_dir):
+    """Route and stop features from all_routes.geojson and stops.geojson."""
+    with open(os.path.join(output_dir, 'all_routes.geojson'), encoding='utf-8') as f:
+        routes = json.load(f)['features']
+    with open(os.path.join(output_dir, 'stops.geojson'), encoding='utf-8') as f:
+        stops = json.load(f)['features']
+    return routes, stops
+
+def stop_tile_properties(properties):
+    """Stop properties with the route lists joined, since MVT values can't be arrays."""
+    return {key: ','.join(value) if isinstance(value, list) else value for key, value in properties.items()}
+
+def build_tiles(routes, stops, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, stops_min_zoom=STOPS_MIN_ZOOM):
+    """Tile route and stop features. Returns ({(z, x, y): MVT bytes}, [min lon, min lat, max lon, max lat])."""
+    route_coords = [np.asarray(feature['geometry']['coordinates'], dtype=np.float64) for feature in routes]
+    all_coords = np.concatenate(route_coords + [np.array([feature['geometry']['coordinates'] for feature in stops],
+                                                         dtype=np.float64).reshape(-1, 2)])
+    bounds = [*all_coords.min(axis=0), *all_coords.max(axis=0)]
+
+    lengths = [len(coords) for coords in route_coords]
+    route_world = lonlat_to_world(np.concatenate(route_coords)) if route_coords else np.empty((0, 2))
+    route_geometries = shapely.linestrings(route_world, indices=np.repeat(np.arange(len(routes)), lengths))
+    route_properties = [feature['properties'] for feature in routes]
+
+    stop_world = lonlat_to_world(np.array([feature['geometry']['coordinates'] for feature in stops],
+                                          dtype=np.float64).reshape(-1, 2))
+    stop_properties = [stop_tile_properties(feature['properties']) for feature in stops]
+
+    tiles = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        tile_lines(route_geometries, route_properties, zoom, tiles)
+        if zoom >= stops_min_zoom:
+            tile_points(stop_world, stop_properties, zoom, tiles)
+        print(f"Zoom {zoom}: {sum(1 for z, _, _ in tiles if z == zoom)} tiles")
+
+    return {zxy: encode_tile(layers) for zxy, layers in tiles.items()}, bounds
+
+def tiles_metadata(routes, stops, min_zoom, max_zoom, stops_min_zoom):
+    """TileJSON-style metadata describing the vector layers."""
+    def fields(features):
+        return {key: 'String' if isinstance(value, (str, list)) else 'Number'
+                for key, value in (features[0]['properties'].items() if features else [])}
+
+    return {
+        'name': 'pordondepasa-sitp',
+        'format': 'pbf',
+        'vector_layers': [
+            {'id': 'routes', 'fields': fields(routes), 'minzoom': min_zoom, 'maxzoom': max_zoom},
+            {'id': 'stops', 'fields': fields(stops), 'minzoom': stops_min_zoom, 'maxzoom': max_zoom},
+        ],
+    }
+
+def export_pmtiles(output_dir=OUTPUT_DIR, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, stops_min_zoom=STOPS_MIN_ZOOM):
+    """Tile all_routes.geojson and stops.geojson into network.pmtiles in output_dir."""
+    print("Building vector tiles...")
+    routes, stops = load_features(output_dir)
+    tiles, bounds = build_tiles(routes, stops, min_zoom, max_zoom, stops_min_zoom)
+
+    path = os.path.join(output_dir, PMTILES_FILE)
+    metadata = tiles_metadata(routes, stops, min_zoom, max_zoom, stops_min_zoom)
+    n_entries, n_contents = write_pmtiles(path, tiles, metadata, min_zoom, max_zoom, bounds)
+
+    print(f"Saved {len(tiles)} tiles ({n_contents} unique, {n_entries} directory entries, "
+          f"{os.path.getsize(path) / 1e6:.2f} MB) to {path}")
+
+def read_tile(path, z, x, y):
+    """Read one tile (uncompressed MVT bytes, or None) from a PMTiles archive written by write_pmtiles."""
+    def parse_directory(data):
+        data = gzip.decompress(data)
+        values, pos = [], 0
+        while pos < len(data):
+            value, shift = 0, 0
+            while True:
+                byte = data[pos]
+                pos += 1
+                value |= (byte & 0x7f) << shift
+                shift += 7
+                if byte < 0x80:
+                    break
+            values.append(value)
+        n = values[0]
+        tile_ids = np.cumsum(values[1:n + 1])
+        run_lengths, lengths, offsets = values[n + 1:2 * n + 1], values[2 * n + 1:3 * n + 1], values[3 * n + 1:]
+        entries = []
+        for i in range(n):
+            offset = offsets[i] - 1 if offsets[i] else entries[-1][1] + entries[-1][2]
+            entries.append((int(tile_ids[i]), offset, lengths[i], run_lengths[i]))
+        return entries
+
+    tile_id = zxy_to_tile_id(z, x, y)
+    with open(path, 'rb') as f:
+        header = struct.unpack('<7sBQQQQQQQQQQQBBBBBBiiiiBii', f.read(PMTILES_HEADER_SIZE))
+        root_offset, root_length, _, _, leaves_offset, _, data_offset = header[2:9]
+        f.seek(root_offset)
+        entries = parse_directory(f.read(root_length))
+        while True:
+            candidates = [entry for entry in entries if entry[0] <= tile_id]
+            if not candidates:
+                return None
+            entry_id, offset, length, run_length = candidates[-1]
+            if run_length == 0:
+                f.seek(leaves_offset + offset)
+                entries = parse_directory(f.read(length))
+                continue
+            if tile_id >= entry_id + run_length:
+                return None
+            f.seek(data_offset + offset)
+            return gzip.decompress(f.read(length))
+
+def main():
+    parser = argparse.ArgumentParser(description="Export routes and stops to a PMTiles vector tile archive")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR,
+                        help=f"directory with all_routes.geojson and stops.geojson (default: {OUTPUT_DIR})")
+    parser.add_argument('--min-zoom', type=int, default=MIN_ZOOM)
+    parser.add_argument('--max-zoom', type=int, default=MAX_ZOOM)
+    parser.add_argument('--stops-min-zoom', type=int, default=STOPS_MIN_ZOOM)
+    args = parser.parse_args()
+
+    export_pmtiles(args.output_dir, args.min_zoom, args.max_zoom, args.stops_min_zoom)
+
+if __name__ == "__main__":
+    main()